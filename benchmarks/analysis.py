@@ -0,0 +1,69 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures the time of register liveness/availability analysis as a function of the number of instructions"""
+
+from __future__ import print_function
+import argparse
+import timeit
+
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+parser = argparse.ArgumentParser(description="Benchmark of liveness analysis in PeachPy x86-64 functions")
+parser.add_argument("-n", "--instructions", dest="instructions", type=int, nargs="+",
+                    default=[1000, 2000, 5000, 10000, 20000, 50000],
+                    help="Approximate number of instructions in the benchmarked functions")
+parser.add_argument("-b", "--block-size", dest="block_size", type=int, default=64,
+                    help="Number of instructions in every loop body")
+parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3,
+                    help="Number of repetitions of every measurement (the best time is reported)")
+
+
+def build_function(instruction_count, block_size):
+    x = Argument(ptr(const_uint64_t), name="x")
+    n = Argument(size_t, name="n")
+    with Function("kernel", (x, n), uint64_t) as function:
+        reg_x = GeneralPurposeRegister64()
+        reg_n = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        LOAD.ARGUMENT(reg_n, n)
+
+        accumulators = [GeneralPurposeRegister64() for _ in range(8)]
+        for accumulator in accumulators:
+            XOR(accumulator.as_dword, accumulator.as_dword)
+
+        for block in range(max(instruction_count // block_size, 1)):
+            reg_i = GeneralPurposeRegister64()
+            MOV(reg_i, reg_n)
+            with Loop() as loop:
+                for i in range(block_size - 3):
+                    temp = GeneralPurposeRegister64()
+                    MOV(temp, [reg_x + (i % 16) * 8])
+                    ADD(accumulators[(block + i) % len(accumulators)], temp)
+                SUB(reg_i, 1)
+                JNZ(loop.begin)
+
+        for accumulator in accumulators[1:]:
+            ADD(accumulators[0], accumulator)
+        RETURN(accumulators[0])
+    return function
+
+
+def main():
+    options = parser.parse_args()
+    print("%12s %12s %16s %16s" % ("Instructions", "Blocks", "Analysis (ms)", "Function (ms)"))
+    for instruction_count in options.instructions:
+        function = build_function(instruction_count, options.block_size)
+        block_count = len([instruction for instruction in function._instructions
+                           if instruction.name == "LABEL"])
+        analysis_time = min(timeit.repeat(function._analize, number=1, repeat=options.repeat))
+        function_time = min(timeit.repeat(lambda: build_function(instruction_count, options.block_size),
+                                          number=1, repeat=options.repeat))
+        print("%12d %12d %16.1f %16.1f" %
+              (len(function._instructions), block_count, analysis_time * 1000.0, function_time * 1000.0))
+
+
+if __name__ == "__main__":
+    main()
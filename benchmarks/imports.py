@@ -0,0 +1,50 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures the time of importing peachpy.x86_64 in a fresh Python interpreter"""
+
+from __future__ import print_function
+import argparse
+import subprocess
+import sys
+
+
+parser = argparse.ArgumentParser(description="Benchmark of peachpy.x86_64 import time")
+parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=5,
+                    help="Number of repetitions of every measurement (the best time is reported)")
+
+statements = [
+    ("import peachpy.x86_64", "import peachpy.x86_64"),
+    ("generic instructions", "from peachpy.x86_64 import MOV, ADD, SUB, JNZ, RET"),
+    ("generic + SSE + AVX", "from peachpy.x86_64 import MOV, ADD, MOVAPS, ADDPS, VADDPS"),
+    ("import *", "from peachpy.x86_64 import *"),
+]
+
+script = """
+import sys
+import timeit
+start = timeit.default_timer()
+{statement}
+elapsed = timeit.default_timer() - start
+modules = [name for name in sys.modules if name.startswith("peachpy.x86_64.")]
+print(elapsed, len(modules))
+"""
+
+
+def measure(statement):
+    output = subprocess.check_output([sys.executable, "-c", script.format(statement=statement)])
+    elapsed, modules = output.decode("ascii").split()
+    return float(elapsed), int(modules)
+
+
+def main():
+    options = parser.parse_args()
+    print("%-24s %12s %10s" % ("Statement", "Time (ms)", "Modules"))
+    for name, statement in statements:
+        measurements = [measure(statement) for _ in range(options.repeat)]
+        elapsed, modules = min(measurements)
+        print("%-24s %12.1f %10d" % (name, elapsed * 1000.0, modules))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures the cost of calls to many small loaded kernels, which is dominated by iTLB misses, in every loader mode"""
+
+from __future__ import print_function
+import argparse
+import ctypes
+import random
+import timeit
+
+from peachpy import *
+from peachpy.x86_64 import *
+from peachpy.loader import CodeArena
+
+
+parser = argparse.ArgumentParser(description="Benchmark of iTLB-bound calls to kernels in different loader modes")
+parser.add_argument("-k", "--kernels", dest="kernels", type=int, default=4096,
+                    help="Number of loaded kernels")
+parser.add_argument("-s", "--stride", dest="stride", type=int, default=4096,
+                    help="Alignment of kernels in code arenas, in bytes")
+parser.add_argument("-i", "--iterations", dest="iterations", type=int, default=100,
+                    help="Number of passes over the kernels in a measurement")
+parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=5,
+                    help="Number of repetitions of every measurement (the best time is reported)")
+parser.add_argument("--numa-node", dest="numa_node", type=int,
+                    help="NUMA node to bind code arenas to")
+
+
+def build_kernel(index):
+    with Function("Kernel%d" % index, ()) as function:
+        NOP()
+        RETURN()
+    return function.finalize(abi.detect()).encode()
+
+
+def build_driver():
+    """Builds a function which calls every kernel in a table of addresses in a loop"""
+    table = Argument(ptr(const_uint64_t), name="table")
+    count = Argument(size_t, name="count")
+    iterations = Argument(size_t, name="iterations")
+    with Function("CallKernels", (table, count, iterations)) as function:
+        reg_table = GeneralPurposeRegister64()
+        reg_count = GeneralPurposeRegister64()
+        reg_iterations = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_table, table)
+        LOAD.ARGUMENT(reg_count, count)
+        LOAD.ARGUMENT(reg_iterations, iterations)
+
+        reg_address = GeneralPurposeRegister64()
+        reg_remaining = GeneralPurposeRegister64()
+        with Loop() as pass_loop:
+            MOV(reg_address, reg_table)
+            MOV(reg_remaining, reg_count)
+            with Loop() as call_loop:
+                CALL([reg_address])
+                ADD(reg_address, 8)
+                SUB(reg_remaining, 1)
+                JNZ(call_loop.begin)
+            SUB(reg_iterations, 1)
+            JNZ(pass_loop.begin)
+        RETURN()
+    return function.finalize(abi.detect()).encode().load()
+
+
+def kernel_address(kernel):
+    return ctypes.cast(kernel.function_pointer, ctypes.c_void_p).value
+
+
+def main():
+    options = parser.parse_args()
+    kernels = [build_kernel(i) for i in range(options.kernels)]
+    driver = build_driver()
+
+    modes = [
+        ("Loader", None),
+        ("CodeArena", dict()),
+        ("CodeArena + huge pages", dict(huge_pages=True)),
+        ("CodeArena + huge pages, single mapping", dict(huge_pages=True, dual_mapping=False)),
+    ]
+    print("%-40s %10s %12s %14s" % ("Mode", "Chunks", "Huge chunks", "Call (ns)"))
+    for name, arena_options in modes:
+        if arena_options is None:
+            arena = None
+            loaded_kernels = [kernel.load() for kernel in kernels]
+        else:
+            arena = CodeArena(alignment=options.stride, numa_node=options.numa_node, **arena_options)
+            loaded_kernels = arena.load(kernels)
+
+        # Random order of calls defeats prefetching of page translations
+        addresses = [kernel_address(kernel) for kernel in loaded_kernels]
+        random.shuffle(addresses)
+        table = (ctypes.c_uint64 * len(addresses))(*addresses)
+
+        elapsed = min(timeit.repeat(lambda: driver(table, len(addresses), options.iterations),
+                                    number=1, repeat=options.repeat))
+        call_time = elapsed * 1.0e9 / (len(addresses) * options.iterations)
+        if arena is None:
+            chunks, huge_page_chunks = len(loaded_kernels), 0
+        else:
+            usage = arena.usage
+            chunks, huge_page_chunks = usage.chunks, usage.huge_page_chunks
+        print("%-40s %10d %12d %14.2f" % (name, chunks, huge_page_chunks, call_time))
+        del loaded_kernels[:]
+
+
+if __name__ == "__main__":
+    main()
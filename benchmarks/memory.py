@@ -0,0 +1,78 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures memory used by PeachPy x86-64 functions in every processing stage, in bytes per instruction"""
+
+from __future__ import print_function
+import argparse
+import gc
+import timeit
+import tracemalloc
+
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+parser = argparse.ArgumentParser(description="Benchmark of memory used by PeachPy x86-64 functions")
+parser.add_argument("-n", "--instructions", dest="instructions", type=int, nargs="+",
+                    default=[1000, 10000, 50000],
+                    help="Approximate number of instructions in the benchmarked functions")
+
+
+def build_function(instruction_count):
+    x = Argument(ptr(const_float_), name="x")
+    n = Argument(size_t, name="n")
+    with Function("kernel", (x, n), float_) as function:
+        reg_x = GeneralPurposeRegister64()
+        reg_n = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        LOAD.ARGUMENT(reg_n, n)
+
+        accumulators = [XMMRegister() for _ in range(4)]
+        for accumulator in accumulators:
+            XORPS(accumulator, accumulator)
+
+        with Loop() as loop:
+            for i in range(max(instruction_count // 4, 1)):
+                temp = XMMRegister()
+                MOVUPS(temp, [reg_x + (i % 64) * 16])
+                MULPS(temp, temp)
+                ADDPS(accumulators[i % len(accumulators)], temp)
+                ADD(reg_n, i % 8 + 1)
+            SUB(reg_n, 1)
+            JNZ(loop.begin)
+
+        for accumulator in accumulators[1:]:
+            ADDPS(accumulators[0], accumulator)
+        RETURN(accumulators[0])
+    return function
+
+
+def measure(constructor):
+    """Returns the object created by the constructor, and the number of bytes allocated and retained by it"""
+    gc.collect()
+    start = tracemalloc.get_traced_memory()[0]
+    result = constructor()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - start
+
+
+def main():
+    options = parser.parse_args()
+    tracemalloc.start()
+    print("%12s %16s %16s %16s %16s" %
+          ("Instructions", "Function (B/i)", "ABI (B/i)", "Encoded (B/i)", "Finalize (ms)"))
+    for instruction_count in options.instructions:
+        function, function_size = measure(lambda: build_function(instruction_count))
+        abi_function, abi_function_size = measure(lambda: function.finalize(abi.system_v_x86_64_abi))
+        encoded_function, encoded_function_size = measure(abi_function.encode)
+        finalize_time = min(timeit.repeat(lambda: function.finalize(abi.system_v_x86_64_abi),
+                                          number=1, repeat=3))
+        count = len(function._instructions)
+        print("%12d %16.1f %16.1f %16.1f %16.1f" %
+              (count, float(function_size) / count, float(abi_function_size) / count,
+               float(encoded_function_size) / count, finalize_time * 1000.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures scaling of a loaded kernel over large buffers with the number of threads in parallel_for"""
+
+from __future__ import print_function
+import argparse
+import array
+import timeit
+
+from peachpy import *
+from peachpy.x86_64 import *
+from peachpy.x86_64.parallel import ThreadPool, get_cpu_count
+
+
+parser = argparse.ArgumentParser(description="Benchmark of parallel_for scaling with the number of threads")
+parser.add_argument("-n", "--elements", dest="elements", type=int, default=16 * 1024 * 1024,
+                    help="Number of elements in the buffers (rounded up to a multiple of 4)")
+parser.add_argument("-d", "--degree", dest="degree", type=int, default=16,
+                    help="Degree of the evaluated polynomial, which controls the amount of computation per element")
+parser.add_argument("-t", "--threads", dest="threads", type=int, nargs="+",
+                    help="Numbers of threads to measure (powers of two up to the number of processors by default)")
+parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=5,
+                    help="Number of repetitions of every measurement (the best time is reported)")
+
+
+def build_kernel(degree):
+    """Builds a kernel which evaluates a polynomial on 4 elements per iteration. The length must be a multiple of 4."""
+    x = Argument(ptr(const_float_), name="x")
+    y = Argument(ptr(float_), name="y")
+    n = Argument(size_t, name="n")
+    with Function("EvaluatePolynomial", (x, y, n)) as function:
+        reg_x = GeneralPurposeRegister64()
+        reg_y = GeneralPurposeRegister64()
+        reg_n = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        LOAD.ARGUMENT(reg_y, y)
+        LOAD.ARGUMENT(reg_n, n)
+
+        done = Label("done")
+        TEST(reg_n, reg_n)
+        JZ(done)
+        with Loop() as loop:
+            xmm_x = XMMRegister()
+            MOVUPS(xmm_x, [reg_x])
+            xmm_y = XMMRegister()
+            MOVAPS(xmm_y, xmm_x)
+            for i in range(degree):
+                ADDPS(xmm_y, Constant.float32x4(1.0 / (i + 2)))
+                MULPS(xmm_y, xmm_x)
+            MOVUPS([reg_y], xmm_y)
+            ADD(reg_x, 16)
+            ADD(reg_y, 16)
+            SUB(reg_n, 4)
+            JNZ(loop.begin)
+        LABEL(done)
+        RETURN()
+    return function.finalize(abi.detect()).encode().load()
+
+
+def main():
+    options = parser.parse_args()
+    kernel = build_kernel(options.degree)
+    elements = (options.elements + 3) // 4 * 4
+    x = array.array("f", [float(i % 1024) / 1024.0 for i in range(elements)])
+    y = array.array("f", [0.0]) * elements
+
+    thread_counts = options.threads
+    if thread_counts is None:
+        thread_counts = [1]
+        while thread_counts[-1] * 2 <= get_cpu_count():
+            thread_counts.append(thread_counts[-1] * 2)
+        if thread_counts[-1] != get_cpu_count():
+            thread_counts.append(get_cpu_count())
+
+    serial_time = min(timeit.repeat(lambda: kernel(x, y, elements), number=1, repeat=options.repeat))
+    print("%8s %12s %10s %12s" % ("Threads", "Time (ms)", "Speedup", "GB/s"))
+    print("%8s %12.2f %10.2f %12.2f" % ("serial", serial_time * 1000.0, 1.0, elements * 8 / serial_time * 1.0e-9))
+    for threads in thread_counts:
+        with ThreadPool(threads) as pool:
+            elapsed = min(timeit.repeat(lambda: kernel.parallel_for((x, y, elements), pool=pool),
+                                        number=1, repeat=options.repeat))
+        print("%8d %12.2f %10.2f %12.2f" %
+              (threads, elapsed * 1000.0, serial_time / elapsed, elements * 8 / elapsed * 1.0e-9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Measures scaling of register allocation time with the number of virtual registers in a function"""
+
+from __future__ import print_function
+import argparse
+import timeit
+
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+parser = argparse.ArgumentParser(description="Benchmark of register allocation scaling with the number of registers")
+parser.add_argument("-n", "--registers", dest="registers", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000],
+                    help="Numbers of virtual vector registers in the measured functions")
+parser.add_argument("-w", "--window", dest="window", type=int, default=8,
+                    help="Number of vector registers simultaneously live in the function")
+parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3,
+                    help="Number of repetitions of every measurement (the best time is reported)")
+
+
+def build_function(registers, window):
+    """Builds a function which sums values through a sliding window of live virtual registers.
+
+    Every virtual register conflicts with about twice the window size other registers, and copies between registers
+    create opportunities for coalescing.
+    """
+    x = Argument(ptr(const_float_), name="x")
+    with Function("sum", (x,), float_) as function:
+        reg_x = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        xmm_sum = XMMRegister()
+        XORPS(xmm_sum, xmm_sum)
+        xmm_window = []
+        for i in range(registers):
+            xmm_value = XMMRegister()
+            if i % 4 == 3:
+                MOVAPS(xmm_value, xmm_window[-1])
+                ADDPS(xmm_value, xmm_value)
+            else:
+                MOVUPS(xmm_value, [reg_x + (i % 64) * 16])
+            xmm_window.append(xmm_value)
+            if len(xmm_window) > window:
+                ADDPS(xmm_sum, xmm_window.pop(0))
+        for xmm_value in xmm_window:
+            ADDPS(xmm_sum, xmm_value)
+        RETURN(xmm_sum)
+    return function
+
+
+def allocate_registers(function, target_abi):
+    """Allocates registers of all kinds in the same way as :meth:`peachpy.x86_64.function.Function.finalize`"""
+    for register_kind, register_allocator in function._register_allocators.items():
+        register_allocator = register_allocator.copy()
+        register_allocator.set_allocation_options(target_abi, register_kind)
+        register_allocator.allocate_registers()
+
+
+def main():
+    options = parser.parse_args()
+    target_abi = abi.system_v_x86_64_abi
+
+    print("%10s %12s %14s" % ("Registers", "Time (ms)", "us/register"))
+    for registers in options.registers:
+        function = build_function(registers, options.window)
+        elapsed = min(timeit.repeat(lambda: allocate_registers(function, target_abi),
+                                    number=1, repeat=options.repeat))
+        print("%10d %12.2f %14.2f" % (registers, elapsed * 1000.0, elapsed / registers * 1.0e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -238,6 +238,58 @@ class Flags:
     EVEX = 0x80
 
 
+class ConstantTable:
+    """Module-level table of immutable objects shared by all instances of instruction classes in the module.
+
+    Instructions refer to the objects in the table by index. Identical objects are stored only once.
+    """
+
+    def __init__(self, name, comment):
+        self.name = name
+        self.comment = comment
+        self.expressions = list()
+        self.indices = dict()
+
+    def reference(self, expression):
+        """Adds the expression to the table and returns the code that refers to its value"""
+        index = self.indices.get(expression)
+        if index is None:
+            index = len(self.expressions)
+            self.expressions.append(expression)
+            self.indices[expression] = index
+        return "%s[%d]" % (self.name, index)
+
+    def generate(self, code):
+        code.line("# " + self.comment)
+        code.line("%s = (" % self.name)
+        with CodeBlock():
+            for expression in self.expressions:
+                code.line(expression + ",")
+        code.line(")")
+
+
+class ModuleConstants:
+    """Tables of objects shared by instruction classes in a generated module.
+
+    :ivar ConstantTable encodings: encoding descriptors, i.e. (flags, encoding function) tuples.
+    :ivar ConstantTable isa_extensions: frozen sets of ISA extensions.
+    """
+
+    def __init__(self):
+        self.encodings = ConstantTable("_encodings",
+            "Encoding descriptors of instruction forms: (flags, encoding function) tuples")
+        self.isa_extensions = ConstantTable("_isa_extensions",
+            "Sets of ISA extensions required by instruction forms")
+
+    def encoding(self, flags, encoding_lambda):
+        return self.encodings.reference("(0x%02X, %s)" % (flags, encoding_lambda))
+
+    def generate(self, code):
+        self.isa_extensions.generate(code)
+        code.line()
+        self.encodings.generate(code)
+
+
 def generate_encoding_lambda(encoding, operands, use_off_argument=False):
     byte_sequence = []
     parts = []
@@ -703,7 +755,7 @@ def xmm_mode_init(code, instruction_form):
         code.line("self.avx_mode = " + str(avx_mode_map[instruction_form.xmm_mode]))
 
 
-def isa_extensions_init(code, instruction_form):
+def isa_extensions_init(code, constants, instruction_form):
     """Generates initialization code for isa_extensions attribute"""
 
     if instruction_form.isa_extensions:
@@ -717,11 +769,11 @@ def isa_extensions_init(code, instruction_form):
         }
         isa_extensions = ["peachpy.x86_64.isa." + isa_extensions_map.get(extension.name, extension.name.lower())
                           for extension in instruction_form.isa_extensions]
-        code.line("self.isa_extensions = frozenset([%s])" %
-                  ", ".join(isa_extensions))
+        code.line("self.isa_extensions = " +
+                  constants.isa_extensions.reference("frozenset([%s])" % ", ".join(isa_extensions)))
 
 
-def instruction_branch_label_form_init(code, instruction_form, instruction_subforms,
+def instruction_branch_label_form_init(code, constants, instruction_form, instruction_subforms,
                                        write_gas_name=True, write_in_regs=True):
     """Generates initialization code for a label operand form of a branch instruction"""
 
@@ -737,7 +789,7 @@ def instruction_branch_label_form_init(code, instruction_form, instruction_subfo
         assert form.operands[0].type in {"rel8", "rel32"}, \
             "Branch label operand type expected to be rel8 or rel32"
         flags |= {"rel8": Flags.Rel8Label, "rel32": Flags.Rel32Label}[form.operands[0].type]
-        code.line("self.encodings.append((0x%02X, %s))" % (flags, encoding_lambda))
+        code.line("self.encodings.append(%s)" % constants.encoding(flags, encoding_lambda))
 
     implicit_regs_init(code, instruction_form)
 
@@ -745,7 +797,7 @@ def instruction_branch_label_form_init(code, instruction_form, instruction_subfo
         in_regs_init(code, instruction_form)
 
 
-def instruction_form_init(code, instruction_form, instruction_subforms,
+def instruction_form_init(code, constants, instruction_form, instruction_subforms,
                           write_go_name=True, write_gas_name=True,
                           write_in_regs=True, write_out_regs=True, write_out_operands=True,
                           write_mmx_mode=True, write_xmm_mode=True,
@@ -779,12 +831,12 @@ def instruction_form_init(code, instruction_form, instruction_subforms,
                     "Expect that the accumulator is either the first or the second operand"
                 flags |= {0: Flags.AccumulatorOp0, 1: Flags.AccumulatorOp1}[operand_number]
             for encoding_flags, encoding_lambda in encoding_lambdas:
-                code.line("self.encodings.append((0x%02X, %s))" % (flags | encoding_flags, encoding_lambda))
+                code.line("self.encodings.append(%s)" % constants.encoding(flags | encoding_flags, encoding_lambda))
 
     # Record lambda functions that encode the most generic instruction form
     encodings = map(lambda e: generate_encoding_lambda(e, instruction_form.operands), instruction_form.encodings)
     for (flags, encoding_lambda) in encodings:
-        code.line("self.encodings.append((0x%02X, %s))" % (flags, encoding_lambda))
+        code.line("self.encodings.append(%s)" % constants.encoding(flags, encoding_lambda))
 
     implicit_regs_init(code, instruction_form)
 
@@ -803,7 +855,7 @@ def instruction_form_init(code, instruction_form, instruction_subforms,
         xmm_mode_init(code, instruction_form)
 
     if write_isa_extensions:
-        isa_extensions_init(code, instruction_form)
+        isa_extensions_init(code, constants, instruction_form)
 
     if instruction_form.cancelling_inputs:
         code.line("self._cancelling_inputs = " + str(instruction_form.cancelling_inputs))
@@ -949,21 +1001,61 @@ def is_label_branch(instruction_form):
     return len(instruction_form.operands) == 1 and instruction_form.operands[0].type in {"rel8", "rel32"}
 
 
+def generate_form_methods(code, constants, name, count, instruction_form_trees,
+                          form_init_options, label_form_init_options):
+    """Generates methods which select and initialize instruction forms with `count` operands.
+
+    The _match_form<count> method checks operands and returns the method which initializes the matching form. The
+    constructor calls _match_form<count> only once for every combination of operand kinds, and caches the result in the
+    _forms dictionary of the instruction class.
+    """
+    code.line()
+    code.line("def _match_form%d(self):" % count)
+    with CodeBlock():
+        for (form_index, (instruction_form, instruction_subforms)) in enumerate(instruction_form_trees):
+            is_avx512 = is_avx512_instruction_form(instruction_form)
+            operand_checks = map(
+                lambda o: generate_operand_check(o[0], o[1], evex_form=is_avx512),
+                enumerate(instruction_form.operands))
+            code.line("%s %s:" % ("if" if form_index == 0 else "elif", " and ".join(operand_checks)))
+            code.indent_line("return %s._form%d_%d" % (name, count, form_index))
+            # For branch instructions with rel32 operand additionally generate label form
+            if is_label_branch(instruction_form):
+                code.line("elif is_label(self.operands[0]):")
+                code.indent_line("return %s._form%d_%d_label" % (name, count, form_index))
+        code.line("else:")
+        with CodeBlock():
+            code.line("raise SyntaxError(\"Invalid operand types: " + name + " \" + \", \".join(map(format_operand_type, self.operands)))")
+
+    for (form_index, (instruction_form, instruction_subforms)) in enumerate(instruction_form_trees):
+        code.line()
+        code.line("def _form%d_%d(self):" % (count, form_index))
+        with CodeBlock():
+            instruction_form_init(code, constants, instruction_form, instruction_subforms, *form_init_options)
+        if is_label_branch(instruction_form):
+            code.line()
+            code.line("def _form%d_%d_label(self):" % (count, form_index))
+            with CodeBlock():
+                instruction_branch_label_form_init(code, constants, instruction_form, instruction_subforms,
+                                                   *label_form_init_options)
+
+
 def main(package_root="."):
+    # Map from instruction class name to the name of the module where the class is generated
+    instruction_modules = dict()
     for group, instruction_names in six.iteritems(instruction_groups):
         with open(os.path.join(package_root, "peachpy", "x86_64", group + ".py"), "w") as out:
+            constants = ModuleConstants()
             with CodeWriter() as code:
                 code.line("# This file is auto-generated by /codegen/x86_64.py")
                 code.line("# Instruction data is based on package opcodes %s" % opcodes.__version__)
                 code.line()
-                code.line("import inspect")
-                code.line()
                 code.line("import peachpy.stream")
                 code.line("import peachpy.x86_64.options")
                 code.line("import peachpy.x86_64.isa")
                 code.line("from peachpy.util import is_sint8, is_sint32")
                 code.line("from peachpy.x86_64.encoding import rex, optional_rex, vex2, vex3, evex, modrm_sib_disp")
-                code.line("from peachpy.x86_64.instructions import Instruction, BranchInstruction")
+                code.line("from peachpy.x86_64.instructions import Instruction, BranchInstruction, capture_origin")
                 code.line("from peachpy.x86_64.operand import is_al, is_ax, is_eax, is_rax, is_cl, is_xmm0, is_r8, is_r8rex, is_r16, is_r32, is_r64, \\")
                 code.indent_line("is_mm, is_xmm, is_ymm, is_m, is_m8, is_m16, is_m32, is_m64, is_m80, is_m128, is_m256, is_m512, \\")
                 code.indent_line("is_evex_xmm, is_xmmk, is_xmmkz, is_evex_ymm, is_ymmk, is_ymmkz, is_zmm, is_zmmk, is_zmmkz, is_k, is_kk, \\")
@@ -972,7 +1064,8 @@ def main(package_root="."):
                 code.indent_line("is_m128_m64bcst, is_m256_m64bcst, is_m512_m64bcst, \\")
                 code.indent_line("is_vmx, is_vmy, is_evex_vmx, is_evex_vmy, is_vmz, is_vmxk, is_vmyk, is_vmzk, \\")
                 code.indent_line("is_imm, is_imm4, is_imm8, is_imm16, is_imm32, is_imm64, \\")
-                code.indent_line("is_rel8, is_rel32, is_label, is_er, is_sae, check_operand, format_operand_type")
+                code.indent_line("is_rel8, is_rel32, is_label, is_er, is_sae, check_operand, format_operand_type, \\")
+                code.indent_line("get_operand_kind")
                 code.line()
                 code.line()
                 for name in instruction_names:
@@ -990,6 +1083,7 @@ def main(package_root="."):
                         continue
 
                     instruction_forms = aggregate_instruction_forms(instruction_forms)
+                    instruction_modules[name] = group
 
                     base_class = "Instruction"
                     if name in {
@@ -1019,6 +1113,14 @@ def main(package_root="."):
                         # Generate documentation comment for the class
                         code.line("\"\"\"%s\"\"\"" % name_instruction.summary)
                         code.line()
+                        code.line("__slots__ = ()")
+                        code.line()
+                        code.line("# Map from kinds of operands to the method which initializes the matching form")
+                        code.line("_forms = dict()")
+                        code.line()
+
+                        # Methods which select and initialize instruction forms with one or more operands
+                        form_methods = list()
 
                         # Generate constructor
                         code.line("def __init__(self, *args, **kwargs):")
@@ -1032,7 +1134,7 @@ def main(package_root="."):
                             code.line("origin = kwargs.get(\"origin\")")
                             code.line("prototype = kwargs.get(\"prototype\")")
                             code.line("if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:")
-                            code.indent_line("origin = inspect.stack()")
+                            code.indent_line("origin = capture_origin()")
                             code.line("super(%s, self).__init__(\"%s\", origin=origin, prototype=prototype)" % (name, name))
                             code.line("self.operands = tuple(map(check_operand, args))")
                             operand_count_options = sorted(set([len(instruction_form.operands)
@@ -1105,36 +1207,28 @@ def main(package_root="."):
                                         xmm_mode_init(code, count_operand_forms[0])
                                     if common_isa_extensions:
                                         # Initialize isa_extensions only once for all forms with `count` operands
-                                        isa_extensions_init(code, count_operand_forms[0])
+                                        isa_extensions_init(code, constants, count_operand_forms[0])
                                     if count > 0:
-                                        # Instruction form with one or more operands
-                                        for (form_index, (instruction_form, instruction_subforms)) \
-                                                in enumerate(count_operand_form_trees):
-                                            is_avx512 = is_avx512_instruction_form(instruction_form)
-                                            operand_checks = map(
-                                                lambda o: generate_operand_check(o[0], o[1], evex_form=is_avx512),
-                                                enumerate(instruction_form.operands))
-                                            code.line("%s %s:" % ("if" if form_index == 0 else "elif", " and ".join(operand_checks)))
-                                            with CodeBlock():
-                                                instruction_form_init(code, instruction_form, instruction_subforms,
-                                                                      not common_go_name, not common_gas_name,
-                                                                      not common_in_regs, not common_out_regs,
-                                                                      not common_out_operands,
-                                                                      not common_mmx_mode, not common_xmm_mode,
-                                                                      not common_isa_extensions)
-                                            # For branch instructions with rel32 operand additionally generate label form
-                                            if is_label_branch(instruction_form):
-                                                code.line("elif is_label(self.operands[0]):")
-                                                with CodeBlock():
-                                                    instruction_branch_label_form_init(code,
-                                                        instruction_form, instruction_subforms,
-                                                        not common_gas_name, not common_in_regs)
-                                        code.line("else:")
+                                        # Instruction forms with one or more operands are initialized in separate
+                                        # methods, which are selected by kinds of operands
+                                        code.line("operand_kinds = tuple(map(get_operand_kind, self.operands))")
+                                        code.line("form = %s._forms.get(operand_kinds)" % name)
+                                        code.line("if form is None:")
                                         with CodeBlock():
-                                            code.line("raise SyntaxError(\"Invalid operand types: " + name + " \" + \", \".join(map(format_operand_type, self.operands)))")
+                                            code.line("form = self._match_form%d()" % count)
+                                            code.line("%s._forms[operand_kinds] = form" % name)
+                                        code.line("form(self)")
+                                        form_methods.append((count, count_operand_form_trees,
+                                            (not common_go_name, not common_gas_name,
+                                             not common_in_regs, not common_out_regs,
+                                             not common_out_operands,
+                                             not common_mmx_mode, not common_xmm_mode,
+                                             not common_isa_extensions),
+                                            (not common_gas_name, not common_in_regs)))
                                     else:
                                         # Instruction form with no operands
-                                        instruction_form_init(code, count_operand_forms[0], count_operand_form_trees[0][1],
+                                        instruction_form_init(code, constants,
+                                                              count_operand_forms[0], count_operand_form_trees[0][1],
                                                               not common_go_name, not common_gas_name,
                                                               not common_in_regs, not common_out_regs,
                                                               not common_out_operands,
@@ -1145,11 +1239,32 @@ def main(package_root="."):
                                 code.indent_line("raise SyntaxError(\"Invalid number of operands for instruction \\\"" + name + "\\\"\")")
                             code.line("if peachpy.stream.active_stream is not None:")
                             code.line("peachpy.stream.active_stream.add_instruction(self)", indent=1)
-                            code.line()
-                            code.line()
+
+                        for (count, count_operand_form_trees, form_init_options, label_form_init_options) \
+                                in form_methods:
+                            generate_form_methods(code, constants, name, count, count_operand_form_trees,
+                                                  form_init_options, label_form_init_options)
+                        code.line()
+                        code.line()
+
+                constants.generate(code)
 
             print(str(code), file=out)
 
+    # Index of instruction classes for lazy import in peachpy.x86_64 package
+    with open(os.path.join(package_root, "peachpy", "x86_64", "instruction_index.py"), "w") as out:
+        with CodeWriter() as code:
+            code.line("# This file is auto-generated by /codegen/x86_64.py")
+            code.line("# Instruction data is based on package opcodes %s" % opcodes.__version__)
+            code.line()
+            code.line("# Map from instruction class name to the name of the peachpy.x86_64 submodule which defines it")
+            code.line("instruction_modules = {")
+            with CodeBlock():
+                for name in sorted(instruction_modules):
+                    code.line("\"%s\": \"%s\"," % (name, instruction_modules[name]))
+            code.line("}")
+        print(str(code), file=out)
+
 
 if __name__ == "__main__":
     main()
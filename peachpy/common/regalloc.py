@@ -4,14 +4,47 @@
 import six
 
 
+def _count_options(allocation_options):
+    """Returns the number of physical registers in a bitmask of allocation options"""
+    return bin(allocation_options).count("1")
+
+
 class RegisterAllocator:
     def __init__(self):
         # Map from virtual register id to internal id of conflicting registers (both virtual and physical)
         self.conflicting_registers = dict()
         # Map from virtual register id to physical register id
         self.register_allocations = dict()
-        # Map from virtual register id to a list of available physical ids for the allocation
+        # Map from virtual register id to a bitmask of available physical ids for the allocation
         self.allocation_options = dict()
+        # Map from virtual register id to the number of available physical ids for the allocation
+        self.allocation_options_count = dict()
+        # List of physical ids in the order of preference for the allocation
+        self.physical_registers = list()
+        # Map from virtual register id to internal ids of registers (both virtual and physical) it is copied to or from
+        self.move_related_registers = dict()
+        # Map from virtual register id to the id of virtual register it was coalesced with
+        self.coalesced_registers = dict()
+        # Priority queue of virtual registers with the number of allocation options as the key. The queue exists only
+        # during allocation, and may contain stale entries for registers whose number of options decreased.
+        self._allocation_queue = None
+        # Map from virtual register id to its position in the allocation options, which breaks ties in the queue
+        self._allocation_order = None
+
+    def copy(self):
+        """Returns a copy of the allocator for allocation of registers in an ABI-specific function.
+
+        The conflict and affinity graphs are not modified during allocation and are shared with the copy, while
+        allocation state is copied.
+        """
+        allocator = RegisterAllocator()
+        allocator.conflicting_registers = self.conflicting_registers
+        allocator.move_related_registers = self.move_related_registers
+        allocator.register_allocations = self.register_allocations.copy()
+        allocator.allocation_options = self.allocation_options.copy()
+        allocator.allocation_options_count = self.allocation_options_count.copy()
+        allocator.physical_registers = list(self.physical_registers)
+        return allocator
 
     def add_conflicts(self, virtual_id, conflict_internal_ids):
         self.conflicting_registers.setdefault(virtual_id, set())
@@ -22,6 +55,22 @@ class RegisterAllocator:
                 self.conflicting_registers.setdefault(conflict_virtual_id, set())
                 self.conflicting_registers[conflict_virtual_id].add(-virtual_id)
 
+    def add_affinity(self, virtual_id, internal_id):
+        """Records that a virtual register is copied to or from another register.
+
+        Allocation of both registers to the same physical register would make the copy instruction redundant.
+
+        :param int virtual_id: the id of the virtual register.
+        :param int internal_id: the internal id of the other register: negated virtual id for a virtual register, or
+            physical id for a physical register.
+        """
+        assert virtual_id > 0
+        if internal_id == -virtual_id:
+            return
+        self.move_related_registers.setdefault(virtual_id, set()).add(internal_id)
+        if internal_id < 0:
+            self.move_related_registers.setdefault(-internal_id, set()).add(-virtual_id)
+
     def set_allocation_options(self, abi, register_kind):
         physical_ids = \
             [reg.physical_id for reg in abi.volatile_registers if reg.kind == register_kind] + \
@@ -30,59 +79,220 @@ class RegisterAllocator:
         for reg in abi.restricted_registers:
             if reg.kind == register_kind and reg.physical_id in physical_ids:
                 physical_ids.remove(reg.physical_id)
+        self.physical_registers = physical_ids
         # TODO: account the pre-allocated registers in allocation options
+        all_options = sum(1 << physical_id for physical_id in physical_ids)
         for virtual_id, conflict_internal_ids in six.iteritems(self.conflicting_registers):
-            self.allocation_options[virtual_id] = \
-                [physical_id for physical_id in physical_ids if physical_id not in conflict_internal_ids]
+            allocation_options = all_options
+            for conflict_internal_id in conflict_internal_ids:
+                if conflict_internal_id >= 0:
+                    allocation_options &= ~(1 << conflict_internal_id)
+            self.allocation_options[virtual_id] = allocation_options
+            self.allocation_options_count[virtual_id] = _count_options(allocation_options)
+
+    def _get_physical_registers(self, allocation_options):
+        """Returns the list of physical ids in a bitmask of allocation options in the order of preference"""
+        return [physical_id for physical_id in self.physical_registers if allocation_options & (1 << physical_id)]
 
     def _bind_register(self, virtual_id, physical_id):
         assert virtual_id > 0
         assert physical_id >= 0
         # TODO: handle situation before allocation options are initialized
+        physical_mask = 1 << physical_id
         for conflict_internal_id in self.conflicting_registers[virtual_id]:
             if conflict_internal_id < 0:
                 conflict_virtual_id = -conflict_internal_id
-                try:
-                    self.allocation_options[conflict_virtual_id].remove(physical_id)
-                except ValueError:
-                    pass
-        self.allocation_options[virtual_id] = [physical_id]
+                if self.allocation_options[conflict_virtual_id] & physical_mask:
+                    self.allocation_options[conflict_virtual_id] &= ~physical_mask
+                    self.allocation_options_count[conflict_virtual_id] -= 1
+                    self._update_allocation_queue(conflict_virtual_id)
+        self.allocation_options[virtual_id] = physical_mask
+        self.allocation_options_count[virtual_id] = 1
         self.register_allocations[virtual_id] = physical_id
 
+    def _update_allocation_queue(self, virtual_id):
+        """Re-inserts an unallocated virtual register into the priority queue after its allocation options changed.
+
+        The previous entry for the register is left in the queue and skipped when popped.
+        """
+        if self._allocation_queue is not None and virtual_id not in self.register_allocations:
+            import heapq
+            heapq.heappush(self._allocation_queue,
+                           (self.allocation_options_count[virtual_id], self._allocation_order[virtual_id], virtual_id))
+
     def try_allocate_register(self, virtual_id, physical_id):
         assert virtual_id > 0
-        if physical_id in self.allocation_options[virtual_id]:
+        if self.allocation_options[virtual_id] & (1 << physical_id):
             self._bind_register(virtual_id, physical_id)
             return True
         else:
             return False
 
-    def _allocation_alternatives(self, virtual_id, physical_id):
-        return sum(1 for reg in self.allocation_options[virtual_id] if reg != physical_id)
+    def _most_alternatives_register(self, virtual_id, physical_ids):
+        """Chooses the physical register which leaves the most allocation alternatives to conflicting registers.
 
-    def _min_conflict_allocation_alternatives(self, virtual_id, physical_id):
-        try:
-            return min(self._allocation_alternatives(-conflict_internal_id, physical_id)
-                   for conflict_internal_id in self.conflicting_registers[virtual_id]
-                   if conflict_internal_id < 0)
-        except ValueError:
-            return 0
+        For every candidate physical register the number of alternatives is the minimum, over conflicting virtual
+        registers, of the number of their allocation options other than the candidate. The minimum is either the least
+        number of options among conflicting registers, or one less if the candidate is an option of any conflicting
+        register with the least number of options. Thus, a single pass over the conflicting registers suffices for all
+        candidates.
+
+        :param int virtual_id: the id of the virtual register to allocate.
+        :param list physical_ids: the candidate physical ids in the order of preference.
+        :returns: the first of the candidates with the most alternatives.
+        """
+        min_options_count = None
+        min_options_union = 0
+        for conflict_internal_id in self.conflicting_registers[virtual_id]:
+            if conflict_internal_id < 0:
+                conflict_virtual_id = -conflict_internal_id
+                options_count = self.allocation_options_count[conflict_virtual_id]
+                if min_options_count is None or options_count < min_options_count:
+                    min_options_count = options_count
+                    min_options_union = self.allocation_options[conflict_virtual_id]
+                elif options_count == min_options_count:
+                    min_options_union |= self.allocation_options[conflict_virtual_id]
+        for physical_id in physical_ids:
+            if not min_options_union & (1 << physical_id):
+                return physical_id
+        return physical_ids[0]
+
+    def _find_coalesced_register(self, virtual_id):
+        while virtual_id in self.coalesced_registers:
+            virtual_id = self.coalesced_registers[virtual_id]
+        return virtual_id
+
+    def _is_significant(self, conflicting_registers, virtual_id):
+        """Checks if a virtual register may fail to get a physical register because of conflicting virtual registers"""
+        conflicts_count = sum(1 for conflict_internal_id in conflicting_registers[virtual_id]
+                              if conflict_internal_id < 0 and conflict_internal_id != -virtual_id)
+        return conflicts_count >= self.allocation_options_count[virtual_id]
+
+    def _can_coalesce(self, conflicting_registers, virtual_id, other_virtual_id, allocation_options_count):
+        """Checks if two virtual registers can be coalesced without making the conflict graph harder to color.
+
+        Uses Briggs test (the coalesced register has fewer significant neighbours than allocation options) and George
+        test (every neighbour of one register either conflicts with the other register or is insignificant).
+        """
+        neighbours = set(-conflict_internal_id for conflict_internal_id
+                         in conflicting_registers[virtual_id] | conflicting_registers[other_virtual_id]
+                         if conflict_internal_id < 0) - {virtual_id, other_virtual_id}
+        significant_neighbours = sum(1 for neighbour in neighbours
+                                     if self._is_significant(conflicting_registers, neighbour))
+        if significant_neighbours < allocation_options_count:
+            return True
+
+        for (absorbing_id, absorbed_id) in [(virtual_id, other_virtual_id), (other_virtual_id, virtual_id)]:
+            if allocation_options_count == self.allocation_options_count[absorbing_id] and \
+                    all(neighbour_internal_id in conflicting_registers[absorbing_id] or
+                        not self._is_significant(conflicting_registers, -neighbour_internal_id)
+                        for neighbour_internal_id in conflicting_registers[absorbed_id]
+                        if neighbour_internal_id < 0 and neighbour_internal_id != -absorbed_id):
+                return True
+        return False
+
+    def coalesce_registers(self):
+        """Conservatively merges non-conflicting move-related virtual registers.
+
+        Coalesced registers are allocated to the same physical register, which turns the copy instructions between them
+        into moves of a register to itself. The merge is performed only if it does not make the conflict graph harder
+        to color (by Briggs or George test), so coalescing never causes allocation failure.
+        """
+        # Conflicts of coalesced registers are merged in a private copy of the conflict graph
+        conflicting_registers = {virtual_id: set(conflict_internal_ids) for (virtual_id, conflict_internal_ids)
+                                 in six.iteritems(self.conflicting_registers)}
+        for virtual_id in sorted(self.move_related_registers):
+            for related_internal_id in sorted(self.move_related_registers[virtual_id], reverse=True):
+                if related_internal_id >= 0:
+                    continue
+                coalesced_id = self._find_coalesced_register(virtual_id)
+                other_coalesced_id = self._find_coalesced_register(-related_internal_id)
+                if coalesced_id == other_coalesced_id or \
+                        coalesced_id not in self.allocation_options or \
+                        other_coalesced_id not in self.allocation_options or \
+                        coalesced_id in self.register_allocations or \
+                        other_coalesced_id in self.register_allocations or \
+                        -other_coalesced_id in conflicting_registers[coalesced_id]:
+                    continue
+                allocation_options = self.allocation_options[coalesced_id] & self.allocation_options[other_coalesced_id]
+                allocation_options_count = _count_options(allocation_options)
+                if not allocation_options or \
+                        not self._can_coalesce(conflicting_registers, coalesced_id, other_coalesced_id,
+                                               allocation_options_count):
+                    continue
+
+                # Merge the other register into the coalesced register
+                self.coalesced_registers[other_coalesced_id] = coalesced_id
+                self.allocation_options[coalesced_id] = allocation_options
+                self.allocation_options_count[coalesced_id] = allocation_options_count
+                del self.allocation_options[other_coalesced_id]
+                del self.allocation_options_count[other_coalesced_id]
+                for conflict_internal_id in conflicting_registers.pop(other_coalesced_id):
+                    if conflict_internal_id == -other_coalesced_id:
+                        # Registers are recorded as conflicting with themselves
+                        continue
+                    conflicting_registers[coalesced_id].add(conflict_internal_id)
+                    if conflict_internal_id < 0:
+                        conflict_registers = conflicting_registers[-conflict_internal_id]
+                        conflict_registers.discard(-other_coalesced_id)
+                        conflict_registers.add(-coalesced_id)
+        if self.coalesced_registers:
+            self.conflicting_registers = conflicting_registers
+
+    def _preferred_registers(self, coalesced_ids):
+        """Returns physical ids of registers which are copied to or from the coalesced virtual registers"""
+        preferred_registers = set()
+        for virtual_id in coalesced_ids:
+            for related_internal_id in self.move_related_registers.get(virtual_id, ()):
+                if related_internal_id >= 0:
+                    preferred_registers.add(related_internal_id)
+                else:
+                    related_virtual_id = self._find_coalesced_register(-related_internal_id)
+                    if related_virtual_id in self.register_allocations:
+                        preferred_registers.add(self.register_allocations[related_virtual_id])
+        return preferred_registers
 
     def allocate_registers(self):
-        unallocated_registers = [reg for reg in six.iterkeys(self.allocation_options)
-                                 if reg not in self.register_allocations]
-
-        while unallocated_registers:
-            # Choose the virtual register for which there are the least allocation options
-            virtual_id = min(unallocated_registers, key=lambda reg: len(self.allocation_options[reg]))
-            if not self.allocation_options[virtual_id]:
-                raise Exception("No physical registers for virtual register %d" % virtual_id)
-            if self.conflicting_registers[virtual_id]:
-                # Choose the physical register for which there are most alternatives
-                physical_id = max(self.allocation_options[virtual_id],
-                                  key=lambda reg: self._min_conflict_allocation_alternatives(virtual_id, reg))
-            else:
-                # Choose the first available physical register
-                physical_id = self.allocation_options[virtual_id].pop()
-            self._bind_register(virtual_id, physical_id)
-            unallocated_registers.remove(virtual_id)
+        import heapq
+
+        self.coalesce_registers()
+        coalesced_ids = {virtual_id: [virtual_id] for virtual_id in self.allocation_options}
+        for virtual_id in self.coalesced_registers:
+            coalesced_ids[self._find_coalesced_register(virtual_id)].append(virtual_id)
+
+        # Virtual registers with the least allocation options are allocated first. The ties are broken by the order of
+        # registers in allocation options.
+        self._allocation_order = {virtual_id: order for (order, virtual_id) in enumerate(self.allocation_options)}
+        self._allocation_queue = [(self.allocation_options_count[virtual_id], order, virtual_id)
+                                  for (virtual_id, order) in six.iteritems(self._allocation_order)
+                                  if virtual_id not in self.register_allocations]
+        heapq.heapify(self._allocation_queue)
+        try:
+            while self._allocation_queue:
+                options_count, _, virtual_id = heapq.heappop(self._allocation_queue)
+                if virtual_id in self.register_allocations or \
+                        options_count != self.allocation_options_count[virtual_id]:
+                    # Stale entry: the register is allocated or has less options now
+                    continue
+                if not options_count:
+                    raise Exception("No physical registers for virtual register %d" % virtual_id)
+                physical_ids = self._get_physical_registers(self.allocation_options[virtual_id])
+                # Prefer physical registers of move-related registers, so that the move instructions become redundant
+                preferred_registers = self._preferred_registers(coalesced_ids[virtual_id])
+                preferred_physical_ids = [reg for reg in physical_ids if reg in preferred_registers]
+                if preferred_physical_ids:
+                    physical_id = self._most_alternatives_register(virtual_id, preferred_physical_ids)
+                elif self.conflicting_registers[virtual_id]:
+                    # Choose the physical register for which there are most alternatives
+                    physical_id = self._most_alternatives_register(virtual_id, physical_ids)
+                else:
+                    # Choose the last available physical register
+                    physical_id = physical_ids[-1]
+                self._bind_register(virtual_id, physical_id)
+        finally:
+            self._allocation_queue = None
+            self._allocation_order = None
+
+        # Coalesced registers share the physical register
+        for virtual_id in self.coalesced_registers:
+            self.register_allocations[virtual_id] = self.register_allocations[self._find_coalesced_register(virtual_id)]
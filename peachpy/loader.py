@@ -2,6 +2,7 @@
 #    See license.rst for the full text of the license.
 
 import sys
+from collections import namedtuple
 
 
 class Loader:
@@ -151,3 +152,838 @@ class Loader:
             if self.data_address is not None:
                 self._release_memory((self.data_address, self.data_size))
                 self.data_address = None
+
+
+class _VirtualMemory(object):
+    """Platform-specific primitives for allocation and protection of executable memory.
+
+    On Linux the memory is backed by an anonymous file (memfd) which is mapped twice: a read-write view for writing code
+    and a read-execute view for running it, so no page is ever writable and executable at the same time. On other hosts
+    the memory is allocated read-write and sealed read-execute after the code is written.
+
+    :ivar bool dual_mapping: indicates whether writable and executable views are separate mappings of the same memory.
+    :ivar bool huge_pages: indicates whether allocations should be backed by huge pages, if the host supports them.
+    :ivar int numa_node: the NUMA node to bind the allocations to, or None to use the default memory policy.
+    """
+
+    # Size of huge pages on x86-64
+    huge_page_size = 2 * 1024 * 1024
+
+    # Linux-specific constants, some of them are not exported by the mmap module
+    _PROT_NONE = 0
+    _MAP_FIXED = 0x10
+    _MAP_NORESERVE = 0x4000
+    _MAP_HUGETLB = 0x40000
+    _MADV_HUGEPAGE = 14
+    _MPOL_BIND = 2
+    _MPOL_MF_STRICT = 1
+    _SYS_mbind = 237
+
+    def __init__(self, dual_mapping=None, huge_pages=False, numa_node=None):
+        import ctypes
+        import mmap
+        self.page_size = mmap.PAGESIZE
+        self.allocation_granularity = max(mmap.ALLOCATIONGRANULARITY, mmap.PAGESIZE)
+        self.huge_pages = bool(huge_pages)
+        self.numa_node = numa_node
+
+        osname = sys.platform.lower()
+        self._linux = osname.startswith("linux")
+        if numa_node is not None:
+            import platform
+            if not self._linux or platform.machine().lower() not in ["x86_64", "amd64"]:
+                raise ValueError("NUMA binding is only supported on x86-64 Linux")
+        if osname == "darwin" or osname.startswith("linux") or osname.startswith("freebsd"):
+            if osname == "darwin":
+                libc = ctypes.CDLL("libc.dylib", use_errno=True)
+            elif osname.startswith("freebsd"):
+                libc = ctypes.CDLL("libc.so.7", use_errno=True)
+            else:
+                libc = ctypes.CDLL("libc.so.6", use_errno=True)
+
+            # void* mmap(void* addr, size_t len, int prot, int flags, int fd, off_t offset)
+            self._mmap = libc.mmap
+            self._mmap.restype = ctypes.c_void_p
+            self._mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_int, ctypes.c_long]
+            # int munmap(void* addr, size_t len)
+            self._munmap = libc.munmap
+            self._munmap.restype = ctypes.c_int
+            self._munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+            # int mprotect(void* addr, size_t len, int prot)
+            self._mprotect = libc.mprotect
+            self._mprotect.restype = ctypes.c_int
+            self._mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+            # int madvise(void* addr, size_t len, int advice)
+            self._madvise = libc.madvise
+            self._madvise.restype = ctypes.c_int
+            self._madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+            # long syscall(long number, ...)
+            self._syscall = libc.syscall
+            self._syscall.restype = ctypes.c_long
+
+            self._map_failed = ctypes.c_void_p(-1).value
+            self._writable_protection = mmap.PROT_READ | mmap.PROT_WRITE
+            self._executable_protection = mmap.PROT_READ | mmap.PROT_EXEC
+            self._posix = True
+
+            import os
+            supports_dual_mapping = self._linux and hasattr(os, "memfd_create") and self._probe_dual_mapping()
+            if dual_mapping and not supports_dual_mapping:
+                raise ValueError("Dual mapping of code memory is not supported on this host")
+            self.dual_mapping = supports_dual_mapping if dual_mapping is None else bool(dual_mapping)
+        elif osname == "win32":
+            if dual_mapping:
+                raise ValueError("Dual mapping of code memory is not supported on this host")
+            self.dual_mapping = False
+
+            # From WinNT.h
+            PAGE_READWRITE = 0x04
+            PAGE_EXECUTE_READ = 0x20
+            self._writable_protection = PAGE_READWRITE
+            self._executable_protection = PAGE_EXECUTE_READ
+
+            # LPVOID WINAPI VirtualAlloc(LPVOID address, SIZE_T size, DWORD allocationType, DWORD protect)
+            self._VirtualAlloc = ctypes.windll.kernel32.VirtualAlloc
+            self._VirtualAlloc.restype = ctypes.c_void_p
+            self._VirtualAlloc.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_ulong, ctypes.c_ulong]
+            # BOOL WINAPI VirtualFree(LPVOID lpAddress, SIZE_T dwSize, DWORD  dwFreeType)
+            self._VirtualFree = ctypes.windll.kernel32.VirtualFree
+            self._VirtualFree.restype = ctypes.c_int
+            self._VirtualFree.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_ulong]
+            # BOOL WINAPI VirtualProtect(LPVOID lpAddress, SIZE_T dwSize, DWORD flNewProtect, PDWORD lpflOldProtect)
+            self._VirtualProtect = ctypes.windll.kernel32.VirtualProtect
+            self._VirtualProtect.restype = ctypes.c_int
+            self._VirtualProtect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_ulong,
+                                             ctypes.POINTER(ctypes.c_ulong)]
+            self._posix = False
+        else:
+            raise ValueError("Code arenas are not supported on host OS " + osname)
+
+        if self.huge_pages:
+            self.allocation_granularity = max(self.allocation_granularity, self.huge_page_size)
+
+    def _map_views(self, size, hugetlb, alignment):
+        """Maps the executable and writable views of memory and returns their addresses, or None if mapping failed"""
+        import mmap
+        if not self.dual_mapping:
+            flags = mmap.MAP_ANON | mmap.MAP_PRIVATE | (self._MAP_HUGETLB if hugetlb else 0)
+            address = self._map(size, self._writable_protection, flags, -1, alignment)
+            return None if address is None else (address, address)
+
+        import os
+        try:
+            fd = os.memfd_create("peachpy-code-arena", os.MFD_CLOEXEC | (os.MFD_HUGETLB if hugetlb else 0))
+        except (AttributeError, OSError):
+            return None
+        try:
+            os.ftruncate(fd, size)
+            write_address = self._map(size, self._writable_protection, mmap.MAP_SHARED, fd, alignment)
+            if write_address is None:
+                return None
+            address = self._map(size, self._executable_protection, mmap.MAP_SHARED, fd, alignment)
+            if address is None:
+                self._munmap(write_address, size)
+                return None
+            return address, write_address
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def _probe_dual_mapping(self):
+        """Checks that executable mappings of memory files are not prohibited by the security policy"""
+        import mmap
+        import os
+        fd = os.memfd_create("peachpy-code-arena", os.MFD_CLOEXEC)
+        try:
+            os.ftruncate(fd, self.page_size)
+            address = self._map(self.page_size, self._executable_protection, mmap.MAP_SHARED, fd)
+        finally:
+            os.close(fd)
+        if address is None:
+            return False
+        self._munmap(address, self.page_size)
+        return True
+
+    def _map(self, size, protection, flags, fd, alignment=None):
+        """Maps memory with the specified alignment and returns its address, or None if the mapping failed"""
+        if alignment is None or alignment <= self.page_size:
+            address = self._mmap(None, size, protection, flags, fd, 0)
+            return None if address in (None, self._map_failed) else address
+
+        # Reserve a larger address range and map the memory at its aligned part
+        import mmap
+        from peachpy.util import roundup
+        reservation_size = size + alignment
+        reservation = self._mmap(None, reservation_size, self._PROT_NONE,
+                                 mmap.MAP_ANON | mmap.MAP_PRIVATE | self._MAP_NORESERVE, -1, 0)
+        if reservation in (None, self._map_failed):
+            return None
+        aligned_address = roundup(reservation, alignment)
+        address = self._mmap(aligned_address, size, protection, flags | self._MAP_FIXED, fd, 0)
+        if address in (None, self._map_failed):
+            self._munmap(reservation, reservation_size)
+            return None
+        if aligned_address > reservation:
+            self._munmap(reservation, aligned_address - reservation)
+        if reservation + reservation_size > aligned_address + size:
+            self._munmap(aligned_address + size, reservation + reservation_size - aligned_address - size)
+        return address
+
+    @staticmethod
+    def _transparent_huge_pages_enabled(shared):
+        """Checks if the kernel backs madvise(MADV_HUGEPAGE) regions of anonymous (or shared) memory with huge pages"""
+        path = "/sys/kernel/mm/transparent_hugepage/" + ("shmem_enabled" if shared else "enabled")
+        try:
+            with open(path) as config_file:
+                config = config_file.read()
+        except (IOError, OSError):
+            return False
+        import re
+        mode = re.search(r"\[(\w+)\]", config)
+        return mode is not None and mode.group(1) not in ["never", "deny"]
+
+    def allocate(self, size):
+        """Allocates memory for code and returns a tuple of its executable address, writable address, protection
+        granularity, and an indicator whether the memory is backed by huge pages.
+
+        With dual mapping the two addresses are different views of the same memory. Otherwise both addresses are the
+        same, the memory is initially writable, and must be sealed with :meth:`protect_executable` before execution.
+        Protection of memory backed by huge pages can only change at huge page granularity.
+        """
+        if not self._posix:
+            MEM_COMMIT = 0x1000
+            MEM_RESERVE = 0x2000
+            address = self._VirtualAlloc(None, size, MEM_RESERVE | MEM_COMMIT, self._writable_protection)
+            if not address:
+                raise OSError("Failed to allocate memory for code arena chunk")
+            return address, address, self.page_size, False
+
+        alignment = self.huge_page_size if self.huge_pages and self._linux else None
+        # Pre-allocated huge pages (hugetlbfs pool) are often unavailable, so try them first and fall back
+        hugetlb_options = [True, False] if self.huge_pages and self._linux else [False]
+        for hugetlb in hugetlb_options:
+            views = self._map_views(size, hugetlb, alignment)
+            if views is not None:
+                address, write_address = views
+                huge_pages = hugetlb
+                break
+        else:
+            raise OSError("Failed to allocate memory for code arena chunk")
+
+        if self.huge_pages and not huge_pages and self._linux:
+            # Transparent huge pages are a hint: madvise succeeds even if the kernel can't find free huge pages
+            if self._madvise(write_address, size, self._MADV_HUGEPAGE) == 0:
+                huge_pages = self._transparent_huge_pages_enabled(shared=self.dual_mapping)
+            if address != write_address:
+                self._madvise(address, size, self._MADV_HUGEPAGE)
+
+        if self.numa_node is not None:
+            self._bind(write_address, size)
+
+        page_size = self.huge_page_size if huge_pages else self.page_size
+        return address, write_address, page_size, huge_pages
+
+    def _bind(self, address, size):
+        """Binds memory to the NUMA node with mbind(MPOL_BIND). Must be called before the memory is touched."""
+        import ctypes
+        import os
+        bits_per_word = ctypes.sizeof(ctypes.c_ulong) * 8
+        node_mask = (ctypes.c_ulong * (self.numa_node // bits_per_word + 1))()
+        node_mask[self.numa_node // bits_per_word] = 1 << (self.numa_node % bits_per_word)
+        max_node = len(node_mask) * bits_per_word + 1
+        result = self._syscall(ctypes.c_long(self._SYS_mbind), ctypes.c_void_p(address), ctypes.c_ulong(size),
+                               ctypes.c_int(self._MPOL_BIND), node_mask, ctypes.c_ulong(max_node),
+                               ctypes.c_uint(self._MPOL_MF_STRICT))
+        if result != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "Failed to bind code arena memory to NUMA node %d: %s" %
+                          (self.numa_node, os.strerror(errno)))
+
+    def release(self, address, write_address, size):
+        if self._posix:
+            assert self._munmap(address, size) == 0
+            if write_address != address:
+                assert self._munmap(write_address, size) == 0
+        else:
+            MEM_RELEASE = 0x8000
+            assert self._VirtualFree(address, 0, MEM_RELEASE) != 0
+
+    def _protect(self, address, size, protection):
+        if self._posix:
+            if self._mprotect(address, size, protection) != 0:
+                import ctypes
+                import os
+                errno = ctypes.get_errno()
+                raise OSError(errno, "Failed to change protection of code arena memory: " + os.strerror(errno))
+        else:
+            import ctypes
+            old_protection = ctypes.c_ulong()
+            if not self._VirtualProtect(address, size, protection, ctypes.byref(old_protection)):
+                raise OSError("Failed to change protection of code arena memory")
+
+    def protect_executable(self, address, size):
+        self._protect(address, size, self._executable_protection)
+
+    def protect_writable(self, address, size):
+        self._protect(address, size, self._writable_protection)
+
+
+class CodeArenaBlock(object):
+    """A range of code arena memory which holds the code and constants of one loaded function.
+
+    :ivar int offset: offset of the block in the chunk.
+    :ivar int size: size of the block, in bytes.
+    :ivar int alignment: alignment of the block, in bytes. Compaction preserves the alignment.
+    :ivar weakref owner: a weak reference to the object notified via its _relocate(address) method when compaction
+        moves the block to a new address.
+    """
+
+    __slots__ = ("chunk", "offset", "size", "alignment", "owner")
+
+    def __init__(self, chunk, offset, size, alignment):
+        self.chunk = chunk
+        self.offset = offset
+        self.size = size
+        self.alignment = alignment
+        self.owner = None
+
+    @property
+    def address(self):
+        """Executable address of the block"""
+        return self.chunk.address + self.offset
+
+    @property
+    def write_address(self):
+        """Writable address of the block. Same as :attr:`address` unless the arena uses dual mapping"""
+        return self.chunk.write_address + self.offset
+
+
+class _CodeArenaChunk(object):
+    __slots__ = ("address", "write_address", "size", "page_size", "huge_pages",
+                 "top", "sealed_size", "free_ranges", "blocks")
+
+    def __init__(self, address, write_address, size, page_size, huge_pages):
+        self.address = address
+        self.write_address = write_address
+        self.size = size
+        # Granularity of protection changes
+        self.page_size = page_size
+        self.huge_pages = huge_pages
+        # Offset of the first byte which was never allocated
+        self.top = 0
+        # Size of the sealed (executable) prefix of the chunk, used without dual mapping
+        self.sealed_size = 0
+        # Sorted list of (offset, size) tuples for freed ranges below top
+        self.free_ranges = []
+        self.blocks = []
+
+
+class CodeArenaUsage(namedtuple("CodeArenaUsage",
+                                ["chunks", "reserved_size", "allocated_size", "free_size", "blocks",
+                                 "huge_page_chunks"])):
+    """Statistics of code arena memory usage.
+
+    :ivar int chunks: number of memory chunks reserved by the arena.
+    :ivar int reserved_size: total size of reserved chunks, in bytes.
+    :ivar int allocated_size: total size of blocks of loaded functions, in bytes.
+    :ivar int free_size: size of reserved memory not occupied by blocks (including alignment padding), in bytes.
+    :ivar int blocks: number of blocks of loaded functions.
+    :ivar int huge_page_chunks: number of chunks backed by huge pages.
+    """
+
+    __slots__ = ()
+
+
+class CodeArena(object):
+    """Allocator which packs the code and constants of many loaded functions into shared memory chunks.
+
+    Every function occupies a single block with its code followed by its constants, so relocations between them stay
+    valid if the block is moved as a whole. Memory is mapped W^X: the code is written through a writable view, and
+    executed through a read-execute view (Linux), or from pages sealed read-execute after writing (other hosts).
+    Without dual mapping sealed pages are never made writable again, except by :meth:`compact`, so every load starts
+    on a fresh page; load many functions with a single :meth:`load` call to pack them together.
+
+    For long-running processes with many kernels the arena can back its chunks with 2 MiB pages to reduce iTLB misses:
+    it tries pre-allocated huge pages (MAP_HUGETLB) first, then transparent huge pages (madvise(MADV_HUGEPAGE)), and
+    falls back to regular pages. The chunks can also be bound to a NUMA node (x86-64 Linux only).
+
+    :ivar int chunk_size: size of memory chunks reserved by the arena, in bytes.
+    :ivar int alignment: minimum alignment of blocks, in bytes.
+    """
+
+    def __init__(self, chunk_size=256 * 1024, alignment=64, huge_pages=False, numa_node=None, dual_mapping=None):
+        """Creates an empty code arena.
+
+        :param int chunk_size: size of memory chunks reserved by the arena, in bytes. Rounded up to the allocation
+            granularity of the host, or to the huge page size if huge pages are requested.
+        :param int alignment: minimum alignment of blocks, in bytes.
+        :param bool huge_pages: indicates whether chunks should be backed by huge pages, if the host supports them.
+        :param int numa_node: the NUMA node to bind chunks to. By default chunks follow the memory policy of the
+            process.
+        :param bool dual_mapping: indicates whether code should be written through a separate writable view of the
+            executable memory. By default dual mapping is used if the host supports it. Transparent huge pages for dual
+            mappings depend on the kernel configuration for shared memory, so disabling dual mapping may be needed to
+            get huge pages on some systems.
+        """
+        from peachpy.util import is_int, roundup
+        if not is_int(chunk_size):
+            raise TypeError("chunk size must be an integer")
+        if chunk_size <= 0:
+            raise ValueError("chunk size must be positive")
+        if not is_int(alignment):
+            raise TypeError("alignment must be an integer")
+        if alignment <= 0 or alignment & (alignment - 1) != 0:
+            raise ValueError("alignment must be a power of 2")
+        if numa_node is not None:
+            if not is_int(numa_node):
+                raise TypeError("NUMA node must be an integer")
+            if numa_node < 0:
+                raise ValueError("NUMA node must be non-negative")
+
+        import threading
+        self._memory = _VirtualMemory(dual_mapping=dual_mapping, huge_pages=huge_pages, numa_node=numa_node)
+        self.chunk_size = roundup(chunk_size, self._memory.allocation_granularity)
+        self.alignment = alignment
+        self._chunks = []
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._unsealed_blocks = []
+
+    @property
+    def dual_mapping(self):
+        """Indicates whether the code is written through a separate writable view of the executable memory"""
+        return self._memory.dual_mapping
+
+    @property
+    def huge_pages(self):
+        """Indicates whether the arena backs its chunks with huge pages when the host supports them"""
+        return self._memory.huge_pages
+
+    @property
+    def numa_node(self):
+        """The NUMA node the chunks of the arena are bound to, or None"""
+        return self._memory.numa_node
+
+    @property
+    def usage(self):
+        """Statistics of arena memory usage as a :class:`CodeArenaUsage` tuple"""
+        with self._lock:
+            reserved_size = sum(chunk.size for chunk in self._chunks)
+            allocated_size = sum(block.size for chunk in self._chunks for block in chunk.blocks)
+            blocks = sum(len(chunk.blocks) for chunk in self._chunks)
+            huge_page_chunks = sum(1 for chunk in self._chunks if chunk.huge_pages)
+            return CodeArenaUsage(chunks=len(self._chunks), reserved_size=reserved_size,
+                                  allocated_size=allocated_size, free_size=reserved_size - allocated_size,
+                                  blocks=blocks, huge_page_chunks=huge_page_chunks)
+
+    def load(self, functions):
+        """Loads encoded functions into the arena and returns a list of executable functions.
+
+        :param list functions: a list of :class:`peachpy.x86_64.function.EncodedFunction` objects.
+        """
+        from peachpy.x86_64.function import ExecutableFuntion
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                return [ExecutableFuntion(function, arena=self) for function in functions]
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._seal()
+
+    def allocate(self, size, alignment=None):
+        """Allocates a writable block for the code and constants of a function.
+
+        Without dual mapping the block is not executable until the outermost :meth:`load` call returns, or until
+        :meth:`seal` is called.
+
+        :param int size: size of the block, in bytes.
+        :param int alignment: alignment of the block, in bytes. Defaults to the arena alignment.
+        """
+        from peachpy.util import roundup
+        if size <= 0:
+            raise ValueError("block size must be positive")
+        alignment = max(alignment or 1, self.alignment)
+        with self._lock:
+            for chunk in self._chunks:
+                block = self._allocate_in_chunk(chunk, size, alignment)
+                if block is not None:
+                    break
+            else:
+                chunk_size = max(self.chunk_size, roundup(size, self._memory.allocation_granularity))
+                address, write_address, page_size, huge_pages = self._memory.allocate(chunk_size)
+                chunk = _CodeArenaChunk(address, write_address, chunk_size, page_size, huge_pages)
+                self._chunks.append(chunk)
+                block = self._allocate_in_chunk(chunk, size, alignment)
+            chunk.blocks.append(block)
+            if not self.dual_mapping:
+                self._unsealed_blocks.append(block)
+            return block
+
+    def _allocate_in_chunk(self, chunk, size, alignment):
+        from peachpy.util import roundup
+        if self.dual_mapping:
+            # First fit in the freed ranges
+            for i, (range_offset, range_size) in enumerate(chunk.free_ranges):
+                offset = roundup(range_offset, alignment)
+                if offset + size <= range_offset + range_size:
+                    ranges = []
+                    if offset > range_offset:
+                        ranges.append((range_offset, offset - range_offset))
+                    if offset + size < range_offset + range_size:
+                        ranges.append((offset + size, range_offset + range_size - offset - size))
+                    chunk.free_ranges[i:i + 1] = ranges
+                    return CodeArenaBlock(chunk, offset, size, alignment)
+        # Sealed pages can't be written, so allocation starts after them
+        offset = roundup(max(chunk.top, chunk.sealed_size), alignment)
+        if offset + size > chunk.size:
+            return None
+        if offset > chunk.top and self.dual_mapping:
+            chunk.free_ranges.append((chunk.top, offset - chunk.top))
+        chunk.top = offset + size
+        return CodeArenaBlock(chunk, offset, size, alignment)
+
+    def write(self, block, offset, data):
+        """Copies data into a block which was not yet sealed.
+
+        :param CodeArenaBlock block: the destination block.
+        :param int offset: offset of the data in the block.
+        :param bytearray data: the data to copy.
+        """
+        import ctypes
+        assert offset + len(data) <= block.size
+        if data:
+            ctypes.memmove(block.write_address + offset, ctypes.c_char_p(bytes(data)), len(data))
+
+    def seal(self):
+        """Makes the blocks allocated since the last call executable"""
+        with self._lock:
+            self._seal()
+
+    def _seal(self):
+        from peachpy.util import roundup
+        for block in self._unsealed_blocks:
+            chunk = block.chunk
+            if chunk.blocks and block in chunk.blocks:
+                seal_begin = chunk.sealed_size
+                seal_end = min(roundup(block.offset + block.size, chunk.page_size), chunk.size)
+                if seal_end > seal_begin:
+                    self._memory.protect_executable(chunk.address + seal_begin, seal_end - seal_begin)
+                    chunk.sealed_size = seal_end
+        self._unsealed_blocks = []
+
+    def free(self, block):
+        """Releases the block of an unloaded function. Chunks without blocks are returned to the operating system.
+
+        :param CodeArenaBlock block: the block to release.
+        """
+        with self._lock:
+            chunk = block.chunk
+            if block not in chunk.blocks:
+                # The chunk was already released, e.g. by the finalizer of the arena
+                return
+            chunk.blocks.remove(block)
+            block.owner = None
+            if not chunk.blocks:
+                self._release_chunk(chunk)
+            elif self.dual_mapping:
+                if block.offset + block.size == chunk.top:
+                    chunk.top = block.offset
+                else:
+                    chunk.free_ranges.append((block.offset, block.size))
+                chunk.free_ranges = self._merge_ranges(chunk.free_ranges)
+                if chunk.free_ranges and sum(chunk.free_ranges[-1]) == chunk.top:
+                    chunk.top = chunk.free_ranges.pop()[0]
+
+    @staticmethod
+    def _merge_ranges(ranges):
+        merged_ranges = []
+        for (offset, size) in sorted(ranges):
+            if merged_ranges and sum(merged_ranges[-1]) == offset:
+                merged_ranges[-1] = (merged_ranges[-1][0], merged_ranges[-1][1] + size)
+            else:
+                merged_ranges.append((offset, size))
+        return merged_ranges
+
+    def _release_chunk(self, chunk):
+        self._chunks.remove(chunk)
+        self._unsealed_blocks = [block for block in self._unsealed_blocks if block.chunk is not chunk]
+        self._memory.release(chunk.address, chunk.write_address, chunk.size)
+        chunk.blocks = []
+
+    def compact(self):
+        """Moves the blocks of loaded functions towards the beginning of the arena and releases emptied chunks.
+
+        Loaded functions are updated to use the new addresses of their blocks. Functions of the arena must not be
+        running while the arena is compacted.
+        """
+        import ctypes
+        from peachpy.util import roundup
+        with self._lock:
+            self._seal()
+            if not self.dual_mapping:
+                for chunk in self._chunks:
+                    self._memory.protect_writable(chunk.address, chunk.size)
+
+            blocks = [block for chunk in self._chunks for block in sorted(chunk.blocks, key=lambda b: b.offset)]
+            moved_blocks = []
+            for chunk in self._chunks:
+                chunk.blocks = []
+                chunk.free_ranges = []
+                chunk.top = 0
+            target_chunks = iter(self._chunks)
+            target_chunk = next(target_chunks, None)
+            for block in blocks:
+                # Blocks are only moved towards the beginning of the arena, so they never overwrite unmoved blocks
+                while True:
+                    offset = roundup(target_chunk.top, block.alignment)
+                    if offset + block.size <= target_chunk.size:
+                        break
+                    target_chunk = next(target_chunks)
+                if target_chunk is not block.chunk or offset != block.offset:
+                    ctypes.memmove(target_chunk.write_address + offset, block.write_address, block.size)
+                    block.chunk = target_chunk
+                    block.offset = offset
+                    moved_blocks.append(block)
+                target_chunk.top = offset + block.size
+                target_chunk.blocks.append(block)
+
+            for chunk in list(self._chunks):
+                if not chunk.blocks:
+                    self._release_chunk(chunk)
+                elif not self.dual_mapping:
+                    chunk.sealed_size = min(roundup(chunk.top, chunk.page_size), chunk.size)
+                    self._memory.protect_executable(chunk.address, chunk.sealed_size)
+
+            for block in moved_blocks:
+                owner = block.owner() if block.owner is not None else None
+                if owner is not None:
+                    owner._relocate(block.address)
+
+    def __del__(self):
+        for chunk in list(self._chunks):
+            self._release_chunk(chunk)
+
+
+class _Buffer(object):
+    """A buffer exported by a Python object via the buffer protocol.
+
+    The memory of the buffer is not copied, and the exporting object keeps it valid until the buffer is released.
+    """
+
+    __slots__ = ("_view", "address", "size", "item_size", "format")
+
+    # Buffer request flags from object.h
+    PyBUF_WRITABLE = 0x0001
+    PyBUF_FORMAT = 0x0004
+    PyBUF_C_CONTIGUOUS = 0x0038
+
+    _PyBuffer = None
+    _PyObject_GetBuffer = None
+    _PyBuffer_Release = None
+    _char_from_buffer = None
+    _addressof = None
+    # Python 2 memoryview doesn't support array.array and doesn't report contiguity
+    _memoryview_export = sys.version_info[0] >= 3
+
+    @classmethod
+    def initialize(cls):
+        """Prepares the ctypes bindings of the Python C API. Called once, before the first buffer is acquired."""
+        if cls._PyBuffer is not None:
+            return
+
+        import ctypes
+
+        class PyBuffer(ctypes.Structure):
+            _fields_ = [
+                ("buf", ctypes.c_void_p),
+                ("obj", ctypes.c_void_p),
+                ("len", ctypes.c_ssize_t),
+                ("itemsize", ctypes.c_ssize_t),
+                ("readonly", ctypes.c_int),
+                ("ndim", ctypes.c_int),
+                ("format", ctypes.c_char_p),
+                ("shape", ctypes.c_void_p),
+                ("strides", ctypes.c_void_p),
+                ("suboffsets", ctypes.c_void_p),
+                # Python 2 has additional fields before the internal pointer
+                ("reserved", ctypes.c_void_p * 4),
+            ]
+
+        # int PyObject_GetBuffer(PyObject* exporter, Py_buffer* view, int flags)
+        get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+        get_buffer.restype = ctypes.c_int
+        get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(PyBuffer), ctypes.c_int]
+        # void PyBuffer_Release(Py_buffer* view)
+        release_buffer = ctypes.pythonapi.PyBuffer_Release
+        release_buffer.restype = None
+        release_buffer.argtypes = [ctypes.POINTER(PyBuffer)]
+
+        cls._PyObject_GetBuffer = get_buffer
+        cls._PyBuffer_Release = release_buffer
+        cls._char_from_buffer = ctypes.c_char.from_buffer
+        cls._addressof = ctypes.addressof
+        cls._PyBuffer = PyBuffer
+
+    def __init__(self, exporter, writable):
+        if _Buffer._memoryview_export:
+            view = memoryview(exporter)
+            if not view.c_contiguous:
+                raise BufferError("memoryview: underlying buffer is not C-contiguous")
+            if writable and view.readonly:
+                raise BufferError("Object is not writable.")
+            if not view.readonly and view.nbytes != 0:
+                # Fast path: ctypes object over the buffer memory keeps the buffer exported while it is alive
+                self._view = _Buffer._char_from_buffer(view)
+                self.address = _Buffer._addressof(self._view)
+                self.size = view.nbytes
+                self.item_size = view.itemsize
+                self.format = view.format
+                return
+
+        # Read-only and empty buffers can't be wrapped into ctypes objects
+        flags = _Buffer.PyBUF_C_CONTIGUOUS | _Buffer.PyBUF_FORMAT
+        if writable:
+            flags |= _Buffer.PyBUF_WRITABLE
+        view = _Buffer._PyBuffer()
+        # Raises an exception if the object doesn't support the buffer protocol or can't export the requested buffer
+        _Buffer._PyObject_GetBuffer(exporter, view, flags)
+        self._view = view
+        self.address = view.buf
+        self.size = view.len
+        self.item_size = view.itemsize
+        self.format = view.format.decode("ascii") if view.format is not None else "B"
+
+    def release(self):
+        if isinstance(self._view, _Buffer._PyBuffer):
+            _Buffer._PyBuffer_Release(self._view)
+        self._view = None
+
+
+class PointerArgumentConverter(object):
+    """Converts Python objects to the values of a pointer argument of a loaded function.
+
+    Objects which support the buffer protocol (bytearray, array.array, memoryview, numpy.ndarray) are passed by the
+    address of their memory without copying. The buffer must be C-contiguous, its items must match the pointed type in
+    size and kind, its address must be aligned on the item size, and it must be writable unless the pointed type is
+    const. None is passed as the NULL pointer, and ctypes objects and integer addresses are passed as is.
+
+    :ivar str name: the name of the argument, used in error messages.
+    :ivar bool writable: indicates whether the buffer must be writable.
+    :ivar int item_size: size of the pointed type, or None for void pointers.
+    :ivar str formats: struct module format characters compatible with the pointed type, or None if any format is
+        acceptable.
+    """
+
+    __slots__ = ("name", "writable", "item_size", "formats", "_buffer_formats")
+
+    # Integer addresses and ctypes pointers, which are passed to the function as is
+    _passthrough_types = None
+
+    def __init__(self, name, c_type, abi):
+        """Creates a converter for a pointer argument.
+
+        :param str name: the name of the argument.
+        :param peachpy.c.types.Type c_type: the type of the argument. Must be a pointer type.
+        :param peachpy.abi.ABI abi: the ABI of the function, which defines the size of the pointed type.
+        """
+        assert c_type.is_pointer
+        if PointerArgumentConverter._passthrough_types is None:
+            import ctypes
+            import six
+            PointerArgumentConverter._passthrough_types = six.integer_types + \
+                (ctypes._Pointer, ctypes.Array, ctypes.c_void_p, ctypes.c_char_p, type(ctypes.byref(ctypes.c_int())))
+        _Buffer.initialize()
+
+        self.name = name
+        base = c_type.base
+        self.writable = base is None or not base.is_const
+        self.item_size = None
+        self.formats = None
+        if base is not None and not base.is_pointer:
+            self.item_size = base.get_size(abi)
+            if base.is_floating_point:
+                self.formats = "efd"
+            elif base.is_char:
+                self.formats = "cbB"
+            elif base.is_bool:
+                self.formats = "?"
+            elif base.is_signed_integer:
+                self.formats = "bhilqn"
+            elif base.is_unsigned_integer:
+                self.formats = "BHILQN"
+        elif base is not None:
+            self.item_size = abi.pointer_size
+            self.formats = "P"
+        # Buffer format strings which pass the checks. x86-64 is little-endian, so explicit little-endian is native.
+        self._buffer_formats = None
+        if self.formats is not None:
+            self._buffer_formats = frozenset(prefix + format
+                                             for format in self.formats for prefix in ["", "@", "=", "<"])
+
+    def __call__(self, value, buffers):
+        """Returns the value to pass to the function for the Python object.
+
+        :param value: the Python object passed as the argument.
+        :param list buffers: the list to append the acquired buffer to. The caller must release the buffers after the
+            function returns.
+        """
+        if value is None or isinstance(value, PointerArgumentConverter._passthrough_types):
+            return value
+
+        try:
+            buffer = _Buffer(value, self.writable)
+        except BufferError as e:
+            raise TypeError("Argument %s requires a%s contiguous buffer: %s" %
+                            (self.name, " writable" if self.writable else "", str(e)))
+        except TypeError:
+            raise TypeError("Argument %s requires an object which supports the buffer protocol, got %s" %
+                            (self.name, type(value).__name__))
+        buffers.append(buffer)
+
+        if self.item_size is not None:
+            if buffer.item_size != self.item_size:
+                raise TypeError("Argument %s requires a buffer of %d-byte items, got %d-byte items" %
+                                (self.name, self.item_size, buffer.item_size))
+            if self._buffer_formats is not None and buffer.format not in self._buffer_formats:
+                raise TypeError("Argument %s requires a buffer with items of format %s, got format %s" %
+                                (self.name, "/".join(self.formats), buffer.format))
+            # Empty buffers are never accessed, and their address may be arbitrary
+            if buffer.size != 0 and buffer.address % self.item_size != 0:
+                raise ValueError("Argument %s requires a buffer aligned on %d bytes" % (self.name, self.item_size))
+        return buffer.address
+
+
+def compile_argument_conversion(function_pointer, argument_converters):
+    """Generates a function which converts the arguments with the specified converters and calls the function pointer.
+
+    The conversion plan is compiled into Python code once, when a function is loaded, so calls don't iterate over the
+    converters or check which arguments need conversion.
+
+    :param function_pointer: the ctypes function pointer to call.
+    :param list argument_converters: a converter for every argument, or None for arguments which are passed as is.
+    """
+    if all(converter is None for converter in argument_converters):
+        return function_pointer
+
+    import six
+    arguments = ["arg%d" % i for i in range(len(argument_converters))]
+    converted_arguments = [arg if converter is None else "convert%d(%s, buffers)" % (i, arg)
+                           for i, (arg, converter) in enumerate(zip(arguments, argument_converters))]
+    source = "\n".join([
+        "def call(%s):" % ", ".join(arguments),
+        "    buffers = []",
+        "    try:",
+        "        return function_pointer(%s)" % ", ".join(converted_arguments),
+        "    finally:",
+        "        for buffer in buffers:",
+        "            buffer.release()",
+    ])
+    namespace = {"function_pointer": function_pointer}
+    for i, converter in enumerate(argument_converters):
+        if converter is not None:
+            namespace["convert%d" % i] = converter
+    six.exec_(source, namespace)
+    return namespace["call"]
@@ -408,3 +408,324 @@ class CHeaderWriter(TextWriter):
         return_type = "void" if function.result_type is None else str(function.result_type)
         arguments = [str(arg.c_type) + " " + arg.name for arg in function.arguments]
         self.content.append(return_type + " " + function.mangled_name + "(" + ", ".join(arguments) + ");")
+
+
+class CPythonExtensionWriter(TextWriter):
+    """Writes C source of a CPython extension module which exposes the functions as Python functions.
+
+    The generated wrappers use METH_FASTCALL calling convention (METH_VARARGS before Python 3.7) and parse arguments
+    according to the C signatures of the functions: integer arguments are range-checked, floating-point arguments
+    accept any real number, and pointer arguments accept None or objects which support the buffer protocol, with
+    the same checks as :class:`peachpy.loader.PointerArgumentConverter`. The source must be compiled and linked with
+    the object file which PeachPy generates for the same functions, e.g.
+
+        cc -shared -fPIC $(python3-config --includes) module.c kernels.o -o module$(python3-config --extension-suffix)
+    """
+
+    def __init__(self, output_path, module_name=None, input_path=None):
+        """
+        :param str output_path: path to the generated C source file.
+        :param str module_name: name of the extension module. By default, the name of the output file without
+            extension.
+        :param str input_path: path to the PeachPy source file, which is mentioned in the comment on top of the output.
+        """
+        super(CPythonExtensionWriter, self).__init__(output_path)
+
+        import os
+        import re
+        if module_name is None:
+            module_name = os.path.splitext(os.path.basename(output_path))[0]
+        if not re.match("^[_a-zA-Z][_a-zA-Z0-9]*$", module_name):
+            raise ValueError("Module name %s is not a valid C identifier" % module_name)
+        self.module_name = module_name
+        self.methods = []
+
+        import peachpy
+        if input_path is not None:
+            self.prologue = ["/* Generated by PeachPy %s from %s */" % (peachpy.__version__, input_path)]
+        else:
+            self.prologue = ["/* Generated by PeachPy %s */" % peachpy.__version__]
+        self.prologue += [
+            "",
+            "#define PY_SSIZE_T_CLEAN",
+            "#include <Python.h>",
+            "",
+            "#include <limits.h>",
+            "#include <stddef.h>",
+            "#include <stdint.h>",
+            "#include <string.h>",
+            "",
+            "#if PY_VERSION_HEX >= 0x03070000",
+            "\t#define PEACHPY_WRAPPER(name) \\",
+            "\t\tstatic PyObject* name##_fastcall(PyObject* const* args, Py_ssize_t nargs); \\",
+            "\t\tstatic PyObject* name(PyObject* self, PyObject* const* args, Py_ssize_t nargs) { \\",
+            "\t\t\t(void) self; \\",
+            "\t\t\treturn name##_fastcall(args, nargs); \\",
+            "\t\t} \\",
+            "\t\tstatic PyObject* name##_fastcall(PyObject* const* args, Py_ssize_t nargs)",
+            "\t#define PEACHPY_CALLING_CONVENTION METH_FASTCALL",
+            "#else",
+            "\t/* METH_FASTCALL is not a part of the public API before Python 3.7 */",
+            "\t#define PEACHPY_WRAPPER(name) \\",
+            "\t\tstatic PyObject* name##_fastcall(PyObject* const* args, Py_ssize_t nargs); \\",
+            "\t\tstatic PyObject* name(PyObject* self, PyObject* args) { \\",
+            "\t\t\t(void) self; \\",
+            "\t\t\treturn name##_fastcall(&PyTuple_GET_ITEM(args, 0), PyTuple_GET_SIZE(args)); \\",
+            "\t\t} \\",
+            "\t\tstatic PyObject* name##_fastcall(PyObject* const* args, Py_ssize_t nargs)",
+            "\t#define PEACHPY_CALLING_CONVENTION METH_VARARGS",
+            "#endif",
+            "",
+            "static int peachpy_parse_signed(PyObject* object, long long min, long long max, long long* value,",
+            "\tconst char* name)",
+            "{",
+            "\t*value = PyLong_AsLongLong(object);",
+            "\tif (*value == -1 && PyErr_Occurred()) {",
+            "\t\treturn 0;",
+            "\t}",
+            "\tif (*value < min || *value > max) {",
+            "\t\tPyErr_Format(PyExc_OverflowError, \"Argument %s is out of range\", name);",
+            "\t\treturn 0;",
+            "\t}",
+            "\treturn 1;",
+            "}",
+            "",
+            "static int peachpy_parse_unsigned(PyObject* object, unsigned long long max, unsigned long long* value,",
+            "\tconst char* name)",
+            "{",
+            "\t*value = PyLong_AsUnsignedLongLong(object);",
+            "\tif (*value == (unsigned long long) -1 && PyErr_Occurred()) {",
+            "\t\treturn 0;",
+            "\t}",
+            "\tif (*value > max) {",
+            "\t\tPyErr_Format(PyExc_OverflowError, \"Argument %s is out of range\", name);",
+            "\t\treturn 0;",
+            "\t}",
+            "\treturn 1;",
+            "}",
+            "",
+            "static int peachpy_parse_buffer(PyObject* object, Py_buffer* buffer, int writable, Py_ssize_t item_size,",
+            "\tconst char* formats, const char* name)",
+            "{",
+            "\tconst char* format;",
+            "\tif (object == Py_None) {",
+            "\t\treturn 1;",
+            "\t}",
+            "\tif (PyObject_GetBuffer(object, buffer,",
+            "\t\tPyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0)) != 0)",
+            "\t{",
+            "\t\treturn 0;",
+            "\t}",
+            "\tif (item_size != 0) {",
+            "\t\tif (buffer->itemsize != item_size) {",
+            "\t\t\tPyErr_Format(PyExc_TypeError,",
+            "\t\t\t\t\"Argument %s requires a buffer of %zd-byte items, got %zd-byte items\",",
+            "\t\t\t\tname, item_size, buffer->itemsize);",
+            "\t\t\treturn 0;",
+            "\t\t}",
+            "\t\tif (formats != NULL) {",
+            "\t\t\t/* x86-64 is little-endian, so explicit little-endian is native */",
+            "\t\t\tformat = buffer->format != NULL ? buffer->format : \"B\";",
+            "\t\t\tif (*format == '@' || *format == '=' || *format == '<') {",
+            "\t\t\t\tformat++;",
+            "\t\t\t}",
+            "\t\t\tif (format[0] == '\\0' || format[1] != '\\0' || strchr(formats, format[0]) == NULL) {",
+            "\t\t\t\tPyErr_Format(PyExc_TypeError,",
+            "\t\t\t\t\t\"Argument %s requires a buffer with items of format %s, got format %s\",",
+            "\t\t\t\t\tname, formats, buffer->format);",
+            "\t\t\t\treturn 0;",
+            "\t\t\t}",
+            "\t\t}",
+            "\t\t/* Empty buffers are never accessed, and their address may be arbitrary */",
+            "\t\tif (buffer->len != 0 && (uintptr_t) buffer->buf % (uintptr_t) item_size != 0) {",
+            "\t\t\tPyErr_Format(PyExc_ValueError, \"Argument %s requires a buffer aligned on %zd bytes\",",
+            "\t\t\t\tname, item_size);",
+            "\t\t\treturn 0;",
+            "\t\t}",
+            "\t}",
+            "\treturn 1;",
+            "}",
+        ]
+
+    def add_function(self, function):
+        import peachpy.x86_64.function
+        assert isinstance(function, peachpy.x86_64.function.ABIFunction), \
+            "Function must be finalized with an ABI before its assembly can be used"
+        from peachpy.loader import PointerArgumentConverter
+
+        return_type = "void" if function.result_type is None else str(function.result_type)
+        arguments = [str(arg.c_type) + " " + arg.name for arg in function.arguments]
+        signature = return_type + " " + function.mangled_name + "(" + ", ".join(arguments) + ")"
+        wrapper_name = "peachpy_wrap_" + function.mangled_name
+
+        declarations = []
+        parsing = []
+        cleanup = []
+        for index, argument in enumerate(function.arguments):
+            c_type, name = argument.c_type, argument.name
+            # Arguments are stored in prefixed locals to avoid collisions with the locals of the wrapper
+            local_name = "arg_" + name
+            bits = c_type.get_size(function.abi) * 8
+            if c_type.is_pointer:
+                converter = PointerArgumentConverter(name, c_type, function.abi)
+                declarations.append("Py_buffer buffer_%s = { 0 };" % name)
+                parsing += [
+                    "if (!peachpy_parse_buffer(args[%d], &buffer_%s, %d, %d, %s, \"%s\")) {" %
+                    (index, name, int(converter.writable), converter.item_size or 0,
+                     "NULL" if converter.formats is None else "\"%s\"" % converter.formats, name),
+                    "\tgoto cleanup;",
+                    "}",
+                    "%s = (%s) buffer_%s.buf;" % (local_name, c_type, name),
+                ]
+                cleanup.append("PyBuffer_Release(&buffer_%s);" % name)
+            elif c_type.is_floating_point and bits in {32, 64}:
+                parsing += [
+                    "%s = (%s) PyFloat_AsDouble(args[%d]);" % (local_name, c_type, index),
+                    "if (%s == (%s) -1.0 && PyErr_Occurred()) {" % (local_name, c_type),
+                    "\tgoto cleanup;",
+                    "}",
+                ]
+            elif c_type.is_bool:
+                parsing += [
+                    "{",
+                    "\tconst int value = PyObject_IsTrue(args[%d]);" % index,
+                    "\tif (value == -1) {",
+                    "\t\tgoto cleanup;",
+                    "\t}",
+                    "\t%s = (%s) value;" % (local_name, c_type),
+                    "}",
+                ]
+            elif c_type.is_signed_integer or c_type.is_char:
+                minimum, maximum = ("CHAR_MIN", "CHAR_MAX") if c_type.is_char else \
+                    ("INT%d_MIN" % bits, "INT%d_MAX" % bits)
+                parsing += [
+                    "{",
+                    "\tlong long value;",
+                    "\tif (!peachpy_parse_signed(args[%d], %s, %s, &value, \"%s\")) {" %
+                    (index, minimum, maximum, name),
+                    "\t\tgoto cleanup;",
+                    "\t}",
+                    "\t%s = (%s) value;" % (local_name, c_type),
+                    "}",
+                ]
+            elif c_type.is_unsigned_integer or c_type.is_wchar:
+                parsing += [
+                    "{",
+                    "\tunsigned long long value;",
+                    "\tif (!peachpy_parse_unsigned(args[%d], UINT%d_MAX, &value, \"%s\")) {" % (index, bits, name),
+                    "\t\tgoto cleanup;",
+                    "\t}",
+                    "\t%s = (%s) value;" % (local_name, c_type),
+                    "}",
+                ]
+            else:
+                raise ValueError("Argument %s of type %s is not supported in CPython extensions" % (name, c_type))
+            declarations.append("%s %s;" % (c_type, local_name))
+
+        call = function.mangled_name + "(" + ", ".join("arg_" + arg.name for arg in function.arguments) + ")"
+        result_type = function.result_type
+        if result_type is None:
+            conversion = ["%s;" % call, "result = Py_None;", "Py_INCREF(result);"]
+        elif result_type.is_pointer:
+            conversion = ["result = PyLong_FromVoidPtr((void*) %s);" % call]
+        elif result_type.is_floating_point and result_type.get_size(function.abi) in {4, 8}:
+            conversion = ["result = PyFloat_FromDouble((double) %s);" % call]
+        elif result_type.is_bool:
+            conversion = ["result = PyBool_FromLong((long) %s);" % call]
+        elif result_type.is_signed_integer or result_type.is_char:
+            conversion = ["result = PyLong_FromLongLong((long long) %s);" % call]
+        elif result_type.is_unsigned_integer or result_type.is_wchar:
+            conversion = ["result = PyLong_FromUnsignedLongLong((unsigned long long) %s);" % call]
+        else:
+            raise ValueError("Result type %s is not supported in CPython extensions" % result_type)
+
+        argument_count = len(function.arguments)
+        self.content += [
+            "",
+            signature + ";",
+            "",
+            "PEACHPY_WRAPPER(%s) {" % wrapper_name,
+            "\tPyObject* result = NULL;",
+        ] + ["\t" + line for line in declarations] + [
+            "",
+            "\tif (nargs != %d) {" % argument_count,
+            "\t\tPyErr_Format(PyExc_TypeError, \"%s() takes %d argument%s (%%zd given)\", nargs);" %
+            (function.name, argument_count, "" if argument_count == 1 else "s"),
+            "\t\treturn NULL;",
+            "\t}",
+        ] + ["\t" + line for line in parsing] + [
+            "",
+        ] + ["\t" + line for line in conversion] + [
+            "",
+        ] + (["cleanup:"] if parsing else []) + ["\t" + line for line in cleanup] + [
+            "\treturn result;",
+            "}",
+        ]
+        self.methods.append((function.name, wrapper_name, signature))
+
+    def serialize(self):
+        self.epilogue = [
+            "static PyMethodDef peachpy_methods[] = {",
+        ] + [
+            "\t{ \"%s\", (PyCFunction) (void (*)(void)) %s, PEACHPY_CALLING_CONVENTION, \"%s\" }," %
+            (name, wrapper_name, signature)
+            for (name, wrapper_name, signature) in self.methods
+        ] + [
+            "\t{ NULL, NULL, 0, NULL }",
+            "};",
+            "",
+            "static struct PyModuleDef peachpy_module = {",
+            "\tPyModuleDef_HEAD_INIT,",
+            "\t\"%s\"," % self.module_name,
+            "\tNULL,",
+            "\t-1,",
+            "\tpeachpy_methods,",
+            "\tNULL,",
+            "\tNULL,",
+            "\tNULL,",
+            "\tNULL",
+            "};",
+            "",
+            "PyMODINIT_FUNC PyInit_%s(void) {" % self.module_name,
+            "\treturn PyModule_Create(&peachpy_module);",
+            "}",
+            "",
+        ]
+        return super(CPythonExtensionWriter, self).serialize()
+
+
+class LoopAnalysisWriter(TextWriter):
+    """Writes a report of static throughput analysis of the loops in the functions.
+
+    For every loop the report includes the estimated cycles per iteration, the bottleneck (execution ports, front-end,
+    or loop-carried dependencies), port pressure, and latency and execution ports of every instruction.
+    """
+
+    def __init__(self, output_path, target=None, input_path=None):
+        """Creates a writer of loop analysis reports.
+
+        :param str output_path: path to the report file.
+        :param peachpy.x86_64.uarch.Microarchitecture target: the microarchitecture to analyze the loops for. If not
+            specified, the target microarchitecture of every function is used.
+        :param str input_path: path to the PeachPy source of the functions.
+        """
+        super(LoopAnalysisWriter, self).__init__(output_path)
+        self.target = target
+
+        import peachpy
+        if input_path is not None:
+            self.prologue = ["Generated by PeachPy %s from %s" % (peachpy.__version__, input_path)]
+        else:
+            self.prologue = ["Generated by PeachPy %s" % peachpy.__version__]
+
+    def add_function(self, function):
+        import peachpy.x86_64.function
+        assert isinstance(function, peachpy.x86_64.function.ABIFunction), \
+            "Function must be finalized with an ABI before its loops can be analyzed"
+
+        import os
+        loop_analyses = function.analyze_loops(self.target)
+        self.content.append("Function %s: %d loops" % (function.mangled_name, len(loop_analyses)))
+        for loop_analysis in loop_analyses:
+            self.content += ["", loop_analysis.format(line_separator=os.linesep)]
+        self.content.append("")
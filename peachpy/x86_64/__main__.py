@@ -2,6 +2,7 @@
 #    See license.rst for the full text of the license.
 
 from __future__ import absolute_import
+from __future__ import print_function
 
 
 from peachpy import *
@@ -29,8 +30,30 @@ parser.add_argument("-emit-json-metadata", dest="json_metadata_file",
                     help="Path to output file for JSON metadata")
 parser.add_argument("-emit-c-header", dest="c_header_file",
                     help="Path to output file for C/C++ header")
+parser.add_argument("-emit-cpython-extension", dest="cpython_extension_file",
+                    help="Path to output file for C source of CPython extension module which wraps the functions. "
+                         "The module is named after the file")
+parser.add_argument("-emit-loop-analysis", dest="loop_analysis_file",
+                    help="Path to output file for static throughput analysis of loops on the target microarchitecture")
 parser.add_argument("-fname-mangling", dest="name_mangling",
                     help="Mangling of function names")
+parser.add_argument("-fregister-allocator", dest="register_allocator", choices=("greedy", "linear-scan"),
+                    help="Register allocation algorithm: greedy (fails on high register pressure) or linear-scan "
+                         "(spills registers on stack)")
+parser.add_argument("-finstruction-scheduler", dest="instruction_scheduler", choices=("none", "list"),
+                    help="Instruction scheduling: none (keep the order of instructions) or list (reorder instructions "
+                         "in basic blocks to hide latencies of the target microarchitecture)")
+peephole_group = parser.add_mutually_exclusive_group()
+peephole_group.add_argument("-fpeephole", dest="peephole", action="store_true", default=False,
+                            help="Optimize all instructions after register allocation: remove redundant moves and "
+                                 "comparisons, replace zero moves with XOR, and merge stack pointer adjustments")
+peephole_group.add_argument("-fno-peephole", dest="peephole", action="store_false",
+                            help="Only remove redundant copies of allocated registers, and keep other instructions as "
+                                 "written (default)")
+parser.add_argument("-fcache-dir", dest="cache_dir",
+                    help="Directory for the compilation cache. If the script and the modules it imports did not "
+                         "change, functions are loaded from the cache instead of executing the script. Cached files "
+                         "are loaded with pickle, so the directory must be writable only by trusted users")
 
 
 abi_map = {
@@ -193,19 +216,26 @@ def add_module_files(module_files, module, roots):
             add_module_files(module_files, variable, roots)
 
 
-def execute_script(writers, source_filename):
+def execute_script(writers, source_filename, namespace):
     if writers:
         writer = writers.pop()
         with writer:
-            execute_script(writers, source_filename)
+            execute_script(writers, source_filename, namespace)
     else:
         with open(source_filename) as input_file:
             code = compile(input_file.read(), source_filename, 'exec')
-            exec(code, globals())
+            exec(code, namespace)
 
 
-def main():
-    options = parser.parse_args()
+def run(options, namespace=None):
+    """Compiles a PeachPy script according to the parsed command-line options.
+
+    :param argparse.Namespace options: command-line options parsed with :data:`parser`.
+    :param dict namespace: the global namespace for execution of the script. If None, the script is executed in the
+        namespace of this module.
+    """
+    if namespace is None:
+        namespace = globals()
     import peachpy.x86_64.options
     peachpy.x86_64.options.debug_level = options.debug_level
     if options.abi == "native":
@@ -222,8 +252,16 @@ def main():
     peachpy.x86_64.options.generate_assembly = options.generate_assembly
     if options.name_mangling:
         peachpy.x86_64.options.name_mangling = options.name_mangling
-
-    from peachpy.writer import ELFWriter, MachOWriter, MSCOFFWriter, AssemblyWriter, JSONMetadataWriter, CHeaderWriter
+    if options.register_allocator:
+        peachpy.x86_64.options.register_allocator = options.register_allocator
+    if options.instruction_scheduler:
+        peachpy.x86_64.options.instruction_scheduler = options.instruction_scheduler
+    if options.peephole:
+        from peachpy.x86_64.peephole import default_rules
+        peachpy.x86_64.options.peephole_rules = default_rules
+
+    from peachpy.writer import ELFWriter, MachOWriter, MSCOFFWriter, AssemblyWriter, JSONMetadataWriter, \
+        CHeaderWriter, CPythonExtensionWriter, LoopAnalysisWriter
     writers = []
     if peachpy.x86_64.options.generate_assembly:
         assembly_format = options.assembly_format
@@ -256,6 +294,14 @@ def main():
         writers.append(CHeaderWriter(options.c_header_file, options.input[0]))
     if options.json_metadata_file:
         writers.append(JSONMetadataWriter(options.json_metadata_file))
+    if options.cpython_extension_file:
+        writers.append(CPythonExtensionWriter(options.cpython_extension_file, input_path=options.input[0]))
+    if options.loop_analysis_file:
+        from peachpy.x86_64.performance import get_performance_model
+        if get_performance_model(peachpy.x86_64.options.target) is None:
+            raise ValueError("Loop analysis requires a performance model of the target microarchitecture: "
+                             "specify a microarchitecture with a model with -mcpu option")
+        writers.append(LoopAnalysisWriter(options.loop_analysis_file, input_path=options.input[0]))
 
     # PeachPy sources can import other modules or files from the same directory
     import os
@@ -266,17 +312,160 @@ def main():
     # We would like to avoid situations where source file has changed, but Python uses its old precompiled version
     sys.dont_write_bytecode = True
 
-    execute_script(writers, options.input[0])
+    # The cache can not reproduce the side effects of script execution, such as RTL dump
+    compilation_cache = None
+    if options.cache_dir and not options.rtl_dump:
+        from peachpy.x86_64.cache import CompilationCache
+        compilation_cache = CompilationCache(options.cache_dir, options.input[0], {
+            "abi": options.abi,
+            "cpu": options.cpu,
+            "debug_level": options.debug_level,
+            "package": options.package,
+            "name_mangling": peachpy.x86_64.options.name_mangling,
+            "register_allocator": peachpy.x86_64.options.register_allocator,
+            "instruction_scheduler": peachpy.x86_64.options.instruction_scheduler,
+            "peephole": options.peephole,
+            "include": include_directories
+        })
+
+    cached_functions = None
+    if compilation_cache is not None:
+        cached_functions = compilation_cache.load()
+
+    if cached_functions is None:
+        if compilation_cache is not None:
+            from peachpy.x86_64.cache import FunctionRecorder
+            function_recorder = FunctionRecorder()
+            writers.append(function_recorder)
+
+        execute_script(writers, options.input[0], namespace)
 
-    if options.generate_dependencies_makefile:
         module_files = set()
-        for module in sys.modules.values():
-            add_module_files(module_files, module, include_directories)
+        if options.generate_dependencies_makefile or compilation_cache is not None:
+            for module in sys.modules.values():
+                add_module_files(module_files, module, include_directories)
 
+        if compilation_cache is not None:
+            compilation_cache.store(function_recorder.functions, module_files)
+    else:
+        from peachpy.x86_64.cache import replay_functions
+        functions, module_files = cached_functions
+        replay_functions(writers, functions)
+
+    if options.generate_dependencies_makefile:
         dependencies = list(sorted(module_files))
         dependencies.insert(0, options.input[0])
         with open(dependencies_makefile_path, "w") as dependencies_makefile:
             dependencies_makefile.write(options.output + ": \\\n  " + " \\\n  ".join(dependencies) + "\n")
 
+batch_parser = argparse.ArgumentParser(
+    prog=parser.prog + " -batch",
+    description="PeachPy: compile multiple PeachPy scripts in a single process. "
+                "Each line of the jobs file specifies the command-line arguments for one script")
+batch_parser.add_argument("-batch", dest="jobs_file", required=True,
+                          help="Path to the jobs file, or - to read jobs from standard input")
+batch_parser.add_argument("-j", dest="workers", type=int, default=1,
+                          help="Number of worker processes. Workers are forked after PeachPy modules are imported")
+
+
+# Default values of peachpy.x86_64.options, restored before each job in batch mode
+default_options = {name: value for name, value in six.iteritems(vars(peachpy.x86_64.options))
+                   if not name.startswith("_") and not callable(value)}
+
+
+def reset_state():
+    """Restores the global state of PeachPy modified by compilation of a script"""
+    import peachpy.writer
+    import peachpy.stream
+    import peachpy.common.function
+    import peachpy.x86_64.options
+    if peachpy.x86_64.options.rtl_dump_file is not None:
+        peachpy.x86_64.options.rtl_dump_file.close()
+    for name, value in six.iteritems(default_options):
+        setattr(peachpy.x86_64.options, name, value)
+    del peachpy.writer.active_writers[:]
+    peachpy.stream.active_stream = None
+    peachpy.common.function.active_function = None
+
+
+def run_job(arguments):
+    """Compiles a single PeachPy script in batch mode.
+
+    Modules imported by the script from its include directories are unloaded after the job, so that the next jobs
+    import their own (possibly modified) versions of these modules.
+
+    :param list arguments: the command-line arguments for the script.
+    :returns: None if the script was compiled successfully, or an error message otherwise.
+    """
+    import os
+    import traceback
+    system_path = list(sys.path)
+    system_modules = set(sys.modules)
+    try:
+        reset_state()
+        options = parser.parse_args(arguments)
+        run(options, namespace=dict(globals()))
+    except SystemExit as e:
+        if e.code:
+            return "invalid arguments: " + " ".join(arguments)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        include_directories = [path for path in sys.path if path not in system_path]
+        sys.path[:] = system_path
+        for module_name in set(sys.modules) - system_modules:
+            module_file = getattr(sys.modules[module_name], "__file__", None)
+            if module_file is not None and \
+                    any(module_file.startswith(root + os.sep) for root in include_directories):
+                del sys.modules[module_name]
+        reset_state()
+
+
+def batch_main(arguments):
+    import shlex
+    options = batch_parser.parse_args(arguments)
+    if options.workers < 1:
+        batch_parser.error("the number of workers must be positive")
+
+    if options.jobs_file == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(options.jobs_file) as jobs_file:
+            lines = jobs_file.readlines()
+    jobs = [shlex.split(line, comments=True) for line in lines]
+    jobs = [job for job in jobs if job]
+
+    if options.workers == 1 or len(jobs) <= 1:
+        errors = map(run_job, jobs)
+    else:
+        import multiprocessing
+        # Forked workers inherit the imported PeachPy modules. Start methods are configurable only since Python 3.4,
+        # and older versions always fork on POSIX systems.
+        context = multiprocessing
+        if hasattr(multiprocessing, "get_context") and "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        pool = context.Pool(options.workers)
+        try:
+            errors = pool.map(run_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    failed_jobs = 0
+    for job, error in zip(jobs, errors):
+        if error is not None:
+            failed_jobs += 1
+            print("Failed job: %s" % " ".join(job), file=sys.stderr)
+            print(error, file=sys.stderr)
+    return failed_jobs
+
+
+def main():
+    if sys.argv[1:2] == ["-batch"]:
+        failed_jobs = batch_main(sys.argv[1:])
+        sys.exit(1 if failed_jobs else 0)
+    else:
+        run(parser.parse_args())
+
 if __name__ == "__main__":
     main()
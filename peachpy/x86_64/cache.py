@@ -0,0 +1,172 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+import os
+import sys
+import json
+import hashlib
+
+import peachpy.writer
+
+
+def _hash_file(path):
+    """Returns SHA-256 hash of the file content as a hex string, or None if the file does not exist"""
+    try:
+        with open(path, "rb") as source_file:
+            return hashlib.sha256(source_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def _hash_peachpy_sources():
+    """Returns SHA-256 hash of the source files of the installed PeachPy package, including the instruction encoders"""
+    import peachpy
+    package_directory = os.path.dirname(os.path.abspath(peachpy.__file__))
+    source_paths = []
+    for directory, subdirectories, filenames in os.walk(package_directory):
+        subdirectories.sort()
+        source_paths.extend(os.path.join(directory, filename) for filename in sorted(filenames)
+                            if filename.endswith(".py"))
+    sources_hash = hashlib.sha256()
+    for source_path in source_paths:
+        sources_hash.update(os.path.relpath(source_path, package_directory).encode("utf-8"))
+        sources_hash.update(str(_hash_file(source_path)).encode("utf-8"))
+    return sources_hash.hexdigest()
+
+
+def _is_private_directory(directory):
+    """Checks that the directory is owned by the current user and other users can not write to it"""
+    import stat
+    if not hasattr(os, "getuid"):
+        return True
+    directory_stat = os.stat(directory)
+    return directory_stat.st_uid == os.getuid() and not directory_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+class CompilationCache(object):
+    """Content-addressed on-disk cache of functions compiled by PeachPy command-line driver.
+
+    The cache stores finalized functions (:class:`peachpy.x86_64.function.ABIFunction` objects, together with
+    their encoded code and data sections) produced by a PeachPy script, so that on the next build with unchanged
+    inputs the writers can replay them without executing the script.
+
+    Cache lookup involves two files:
+
+    - A manifest, identified by the hash of the script content, compilation options, versions of PeachPy and Python,
+      and the hash of PeachPy source files (so that changes in instruction encoders invalidate the cache). The manifest
+      lists the dependencies of the script, i.e. Python modules imported from the include directories.
+    - An entry, identified by the manifest hash and the hashes of the dependencies. The entry contains the pickled
+      finalized functions and is written atomically.
+
+    Modules imported from outside of the include directories (e.g. installed packages) are not tracked.
+
+    Entries are loaded with pickle, which can execute arbitrary code, so the cache directory must be writable only by
+    trusted users. The cache creates the directory with owner-only permissions, and on POSIX systems ignores the
+    cache if the directory is owned by another user or is writable by group or others.
+
+    :ivar str directory: path to the cache directory.
+    """
+
+    def __init__(self, directory, source_path, options):
+        """
+        :param str directory: path to the cache directory. The directory is created if it does not exist.
+        :param str source_path: path to the PeachPy script.
+        :param dict options: compilation options which affect the generated functions, e.g. ABI, target
+            microarchitecture, and name mangling.
+        """
+        import peachpy
+        self.directory = directory
+        self.source_path = source_path
+        manifest_key = json.dumps(sorted(options.items()) + [
+            ("source", os.path.abspath(source_path)),
+            ("source_hash", _hash_file(source_path)),
+            ("peachpy", peachpy.__version__),
+            ("peachpy_sources", _hash_peachpy_sources()),
+            ("python", sys.version)
+        ])
+        self._manifest_hash = hashlib.sha256(manifest_key.encode("utf-8")).hexdigest()
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, self._manifest_hash + ".manifest")
+
+    def _entry_path(self, dependencies):
+        entry_key = json.dumps([self._manifest_hash] +
+                               [(dependency, _hash_file(dependency)) for dependency in dependencies])
+        entry_hash = hashlib.sha256(entry_key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, entry_hash + ".functions")
+
+    def _write_file(self, path, content):
+        import tempfile
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, "wb") as temporary_file:
+                temporary_file.write(content)
+            getattr(os, "replace", os.rename)(temporary_path, path)
+        except Exception:
+            os.unlink(temporary_path)
+            raise
+
+    def load(self):
+        """Looks up the functions in the cache.
+
+        :returns: a tuple of the list of finalized functions and the list of dependencies of the script, or None if
+            the cache does not contain the functions for the current content of the script and its dependencies.
+        """
+        import pickle
+        try:
+            if not _is_private_directory(self.directory):
+                return None
+            with open(self._manifest_path, "r") as manifest_file:
+                dependencies = json.load(manifest_file)["dependencies"]
+            with open(self._entry_path(dependencies), "rb") as entry_file:
+                functions = pickle.load(entry_file)
+        except (IOError, OSError, ValueError, KeyError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            return None
+        return functions, dependencies
+
+    def store(self, functions, dependencies):
+        """Adds the functions to the cache.
+
+        :param list functions: the list of finalized functions produced by the script, in order of generation.
+        :param list dependencies: the list of paths to Python source files imported by the script.
+        """
+        import pickle
+        dependencies = list(sorted(dependencies))
+        self._write_file(self._entry_path(dependencies), pickle.dumps(functions, pickle.HIGHEST_PROTOCOL))
+        self._write_file(self._manifest_path, json.dumps({"dependencies": dependencies}).encode("utf-8"))
+
+
+class FunctionRecorder(object):
+    """Writer which records finalized functions for :class:`CompilationCache`.
+
+    The recorder collects the functions passed to active writers. Writers which generate object files encode the
+    functions, and the encoded sections are stored with the functions in the cache.
+    """
+
+    def __init__(self):
+        self.functions = []
+
+    def __enter__(self):
+        peachpy.writer.active_writers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        peachpy.writer.active_writers.remove(self)
+
+    def add_function(self, function):
+        self.functions.append(function)
+
+
+def replay_functions(writers, functions):
+    """Passes cached finalized functions to the writers as if they were generated by the script"""
+    if writers:
+        writer = writers.pop()
+        with writer:
+            replay_functions(writers, functions)
+    else:
+        for function in functions:
+            for writer in peachpy.writer.active_writers:
+                writer.add_function(function)
@@ -3,8 +3,14 @@
 
 from __future__ import print_function
 import os
+import re
+import sys
 import operator
 import bisect
+import itertools
+import functools
+import array
+import binascii
 import collections
 import six
 
@@ -13,9 +19,23 @@ import peachpy.writer
 import peachpy.name
 import peachpy.x86_64.instructions
 import peachpy.x86_64.registers
-import peachpy.x86_64.avx
 import peachpy.x86_64.options
 import peachpy.x86_64.meta
+from peachpy.x86_64.instructions import EncodingCache
+
+
+# Instructions which copy the full value of a register to another register of the same type
+_register_copy_instructions = frozenset([
+    "MOV", "MOVAPS", "MOVAPD", "MOVUPS", "MOVUPD", "MOVDQA", "MOVDQU",
+    "VMOVAPS", "VMOVAPD", "VMOVUPS", "VMOVUPD", "VMOVDQA", "VMOVDQU", "VMOVDQA32", "VMOVDQA64", "VMOVDQU32",
+    "VMOVDQU64", "KMOVB", "KMOVW", "KMOVD", "KMOVQ"
+])
+
+
+def _is_allocated_copy(instruction):
+    """Checks if the instruction is a register copy which involves registers allocated by the register allocator"""
+    return instruction.name in _register_copy_instructions and len(instruction.operands) == 2 and \
+        any(register.virtual_id is not None for register in instruction.register_objects)
 
 
 class Function:
@@ -30,7 +50,9 @@ class Function:
     def __init__(self, name, arguments, result_type=None,
                  package=None,
                  target=None,
-                 debug_level=None):
+                 debug_level=None,
+                 register_allocator=None,
+                 instruction_scheduler=None):
         """
         :param str name: name of the function without mangling (as in C language).
         :param tuple arguments: a tuple of :class:`peachpy.Argument` objects.
@@ -39,7 +61,16 @@ class Function:
         :param Microarchitecture target: the target microarchitecture for this function.
         :param int debug_level: the verbosity level for debug information collected for instructions. 0 means no
             debug information, 1 and above enables information about the lines of Python code that originated an
-            instruction. Collecting debug information increases processing time by several times.
+            instruction. Only the file name and the line number are recorded when an instruction is created, and the
+            source code is read on demand.
+        :param str register_allocator: the register allocation mode for this function. "greedy" (default) fails with
+            RegisterAllocationError if the number of live virtual registers exceeds the number of physical registers.
+            "linear-scan" scans the instruction stream and spills the virtual registers with the most distant next use
+            (weighted by loop depth) to local variables on stack, then allocates the remaining registers as "greedy".
+        :param str instruction_scheduler: the instruction scheduling mode for this function. "none" (default) keeps
+            instructions in the order they were generated. "list" reorders instructions within basic blocks to hide
+            latencies of the target microarchitecture, while respecting dependencies on registers, flags and memory, and
+            the number of physical registers.
         :ivar Label entry: a label that marks the entry point of the function. A user can place the entry point in any
             place in the function by defining this label with LABEL pseudo-instruction. If this label is not defined
             by the user, it will be placed automatically before the first instruction of the function.
@@ -71,6 +102,16 @@ class Function:
             self.debug_level = peachpy.x86_64.options.debug_level
         else:
             self.debug_level = int(debug_level)
+        if register_allocator is None:
+            register_allocator = peachpy.x86_64.options.register_allocator
+        if register_allocator not in {"greedy", "linear-scan"}:
+            raise ValueError("Unsupported register allocator: %s" % str(register_allocator))
+        self.register_allocator = register_allocator
+        if instruction_scheduler is None:
+            instruction_scheduler = peachpy.x86_64.options.instruction_scheduler
+        if instruction_scheduler not in {"none", "list"}:
+            raise ValueError("Unsupported instruction scheduler: %s" % str(instruction_scheduler))
+        self.instruction_scheduler = instruction_scheduler
 
         from peachpy.x86_64.pseudo import Label
         from peachpy.name import Name
@@ -98,6 +139,9 @@ class Function:
         self.avx_environment = any([arg.c_type in avx_types for arg in self.arguments]) or self.result_type in avx_types
         self._avx_prolog = None
 
+        self._reset_register_allocators()
+
+    def _reset_register_allocators(self):
         from peachpy.x86_64.registers import GeneralPurposeRegister, MMXRegister, XMMRegister, KRegister
         from peachpy.common import RegisterAllocator
         self._register_allocators = {
@@ -190,6 +234,10 @@ class Function:
             self._check_undefined_labels()
             self._remove_unused_labels()
             self._analize()
+            if self.instruction_scheduler == "list":
+                self._schedule_instructions()
+            if self.register_allocator == "linear-scan":
+                self._spill_registers()
             if peachpy.x86_64.options.rtl_dump_file:
                 peachpy.x86_64.options.rtl_dump_file.write(self.format_instructions())
             self._check_live_registers()
@@ -308,6 +356,17 @@ class Function:
             raise TypeError("%s is not an ABI object" % str(abi))
         return ABIFunction(self, abi)
 
+    def finalize_many(self, abis, encode=False, max_workers=None):
+        """Finalizes the function for multiple ABIs in parallel.
+
+        :param list abis: a list of :class:`peachpy.x86_64.abi.ABI` objects to finalize the function for.
+        :param bool encode: indicates if the finalized functions should also be encoded. If True, the method returns
+            :class:`EncodedFunction` objects instead of :class:`ABIFunction` objects.
+        :param int max_workers: the maximum number of worker processes. None means the number of processors.
+        :returns: a list of finalized functions, in the same order as the ABIs.
+        """
+        return finalize_functions([self], abis, encode=encode, max_workers=max_workers)[0]
+
     def _add_default_labels(self):
         """Adds default labels if they are not defined"""
 
@@ -387,23 +446,72 @@ class Function:
         basic_block_bounds = [(start, basic_block_ends[bisect.bisect_right(basic_block_ends, start)])
                               for start in basic_block_starts]
 
+        # Liveness and availability of registers across basic blocks are tracked on dense bit-vectors: every register id
+        # is assigned a 16-bit slot (enough to hold any register mask) in a Python integer, and a set of (register id,
+        # mask) pairs is represented by a single integer, so that union and difference of register sets in the dataflow
+        # solver are single operations.
+        register_slots = dict()
+        for registers_masks in itertools.chain(input_registers, output_registers):
+            for reg_id in registers_masks:
+                if reg_id not in register_slots:
+                    register_slots[reg_id] = len(register_slots)
+        slot_register_ids = [None] * len(register_slots)
+        for (reg_id, slot) in six.iteritems(register_slots):
+            slot_register_ids[slot] = reg_id
+
+        def pack(registers_masks):
+            return _pack_registers_masks(registers_masks, register_slots)
+
+        def unpack(bits):
+            return _unpack_registers_masks(bits, slot_register_ids)
+
+        def update_live_registers(live_registers, input_registers, output_registers):
+            if not input_registers and not output_registers:
+                return live_registers
+            live_registers = live_registers.copy()
+            # Mark register written by the instruction as non-live
+            for (output_register_id, output_register_mask) in six.iteritems(output_registers):
+                if output_register_id in live_registers:
+                    new_live_register_mask = live_registers[output_register_id] & ~output_register_mask
+                    if new_live_register_mask != 0:
+                        live_registers[output_register_id] = new_live_register_mask
+                    else:
+                        del live_registers[output_register_id]
+            # Mark registers read by the instruction as live
+            for (input_register_id, input_register_mask) in six.iteritems(input_registers):
+                live_registers[input_register_id] = live_registers.get(input_register_id, 0) | input_register_mask
+            return live_registers
+
         class BasicBlock:
-            def __init__(self, start_position, end_position, input_registers_list, output_registers_list):
+            def __init__(self, start_position, end_position):
                 self.start_position = start_position
                 self.end_position = end_position
-                self.input_registers_list = input_registers_list
-                self.output_registers_list = output_registers_list
-
-                self.consumed_register_masks = collections.defaultdict(int)
-                self.produced_register_masks = collections.defaultdict(int)
 
-                self.live_register_masks = collections.defaultdict(int)
-                self.available_register_masks = collections.defaultdict(int)
+                # Mark consumed and produced registers:
+                # - If a register is consumed by an instruction but not produced by preceding instructions of the basic
+                #   block, the register is consumed by the basic block
+                # - If a register is produced by an instruction, it counts as produced by the basic block
+                consumed_register_masks = dict()
+                produced_register_masks = dict()
+                for position in range(start_position, end_position):
+                    for (input_register_id, input_register_mask) in six.iteritems(input_registers[position]):
+                        consumed_mask = input_register_mask & ~produced_register_masks.get(input_register_id, 0)
+                        if consumed_mask != 0:
+                            consumed_register_masks[input_register_id] = \
+                                consumed_register_masks.get(input_register_id, 0) | consumed_mask
+                    for (output_register_id, output_register_mask) in six.iteritems(output_registers[position]):
+                        produced_register_masks[output_register_id] = \
+                            produced_register_masks.get(output_register_id, 0) | output_register_mask
+                self.consumed_registers_bits = pack(consumed_register_masks)
+                self.produced_registers_bits = pack(produced_register_masks)
+
+                self.live_in_registers_bits = 0
+                self.live_out_registers_bits = 0
+                self.available_in_registers_bits = 0
+                self.available_out_registers_bits = 0
 
                 self.is_reachable = False
-
-                self.liveness_analysis_passes = 0
-                self.availability_analysis_passes = 0
+                self.is_queued = False
 
                 self.input_blocks = list()
                 self.output_blocks = list()
@@ -411,58 +519,29 @@ class Function:
                 self.processed_input_blocks = set()
                 self.processed_output_blocks = set()
 
-                # Mark available and consumed registers:
-                # - If a register is consumed by an instruction but not produced by preceding instructions of the basic
-                #   block, the register is consumed by the basic block
-                # - If a register is produced by an instruction, it becomes available for the subsequent instructions
-                #   of the basic block and counts as produced by the basic block
-                for (input_registers, output_registers) in zip(input_registers_list, output_registers_list):
-                    for (input_register_id, input_register_mask) in six.iteritems(input_registers):
-                        consumed_mask = input_register_mask & ~self.produced_register_masks[input_register_id]
-                        if consumed_mask != 0:
-                            self.consumed_register_masks[input_register_id] |= consumed_mask
-                    for (output_register_id, output_register_mask) in six.iteritems(output_registers):
-                        self.produced_register_masks[output_register_id] |= output_register_mask
-
             def reset_processed_blocks(self):
                 self.processed_input_blocks = set()
                 self.processed_output_blocks = set()
 
             @property
-            def available_registers_list(self):
-                from peachpy.x86_64.registers import Register
-                available_registers_list = []
-                available_registers_masks = self.available_register_masks.copy()
-                for output_registers in self.output_registers_list:
-                    # Record available registers for current instruction
-                    available_registers_list.append(available_registers_masks.copy())
-                    # Update with output registers for current instruction
-                    for (output_register_id, output_register_mask) in six.iteritems(output_registers):
-                        available_registers_masks[output_register_id] = \
-                            available_registers_masks.get(output_register_id, 0) | output_register_mask
-                return available_registers_list
+            def available_registers_loaders(self):
+                # Available registers are needed only for a few instructions (e.g. LOAD.ARGUMENT) and debug listings,
+                # and are reconstructed on demand from the registers available at the start of the basic block
+                reconstructor = _AvailableRegistersReconstructor(
+                    self.available_in_registers_bits, slot_register_ids,
+                    output_registers[self.start_position:self.end_position])
+                return [functools.partial(reconstructor, count)
+                        for count in range(self.end_position - self.start_position)]
 
             @property
             def live_registers_list(self):
-                from peachpy.x86_64.registers import Register
                 live_registers_list = []
-                live_registers_masks = self.live_register_masks.copy()
-                for (input_registers, output_registers) in \
-                        reversed(list(zip(self.input_registers_list, self.output_registers_list))):
-                    # Mark register written by the instruction as non-live
-                    for (output_register_id, output_register_mask) in six.iteritems(output_registers):
-                        if output_register_id in live_registers_masks:
-                            new_live_register_mask = live_registers_masks[output_register_id] & ~output_register_mask
-                            if new_live_register_mask != 0:
-                                live_registers_masks[output_register_id] = new_live_register_mask
-                            else:
-                                del live_registers_masks[output_register_id]
-                    # Mark registers read by the instruction as live
-                    for (input_register_id, input_register_mask) in six.iteritems(input_registers):
-                        live_registers_masks[input_register_id] = \
-                            live_registers_masks.get(input_register_id, 0) | input_register_mask
-                    # Record available registers for current instruction
-                    live_registers_list.append(live_registers_masks.copy())
+                live_registers = unpack(self.live_out_registers_bits)
+                for position in reversed(range(self.start_position, self.end_position)):
+                    live_registers = \
+                        update_live_registers(live_registers, input_registers[position], output_registers[position])
+                    # Record live registers for current instruction
+                    live_registers_list.append(live_registers)
                 live_registers_list.reverse()
                 return live_registers_list
 
@@ -472,95 +551,55 @@ class Function:
             def __repr__(self):
                 return str(self)
 
-            def analyze_availability(self, extra_available_registers):
-                self.availability_analysis_passes += 1
-
-                if self.availability_analysis_passes == 1:
-                    # First pass: add registers produced by the block and propagate further
-                    self.available_register_masks.update(extra_available_registers)
-                    if self.output_blocks:
-                        # Add registers produced by this block
-                        for (produced_reg_id, produced_reg_mask) in six.iteritems(self.produced_register_masks):
-                            extra_available_registers[produced_reg_id] =\
-                                extra_available_registers.get(produced_reg_id, 0) | produced_reg_mask
-                else:
-                    # Subsequent passes: compute and propagate only the input registers that were not processed before
-                    for (reg_id, extra_reg_mask) in list(six.iteritems(extra_available_registers)):
-                        old_reg_mask = self.available_register_masks[reg_id]
-                        update_reg_mask = extra_reg_mask & ~old_reg_mask
-                        if update_reg_mask != 0:
-                            self.available_register_masks[reg_id] |= extra_reg_mask
-                        if self.output_blocks:
-                            if update_reg_mask != 0:
-                                extra_available_registers[reg_id] = update_reg_mask
-                            else:
-                                del extra_available_registers[reg_id]
-
-                if self.output_blocks and (extra_available_registers or self.availability_analysis_passes == 1):
-                    for output_block in self.output_blocks[1:]:
-                        # The dict needs to be copied because output blocks can change it
-                        output_block.analyze_availability(extra_available_registers.copy())
-                    # Optimization: do not create a copy of the dict
-                    self.output_blocks[0].analyze_availability(extra_available_registers)
-
-            def analyze_liveness(self, extra_live_registers):
-                # Update in liveness analysis consists of three steps:
-                # 1. Update live registers for this basic block.
-                # 2. Mark registers which are produced to by the basic block as non-live.
-                # 3. Mark registers which are consumed by the basic block as live (only on first pass).
-
-                self.liveness_analysis_passes += 1
-
-                # Steps 1 and 2
-                for (reg_id, extra_reg_mask) in list(six.iteritems(extra_live_registers)):
-                    old_reg_mask = self.live_register_masks[reg_id]
-                    update_reg_mask = extra_reg_mask & ~old_reg_mask
-                    if update_reg_mask != 0:
-                        self.live_register_masks[reg_id] |= extra_reg_mask
-                    if self.input_blocks:
-                        # On the first pass do not modify the extra live registers masks that are passed to input blocks
-                        # On subsequent passes only the novel live registers need to be passed further
-                        if self.liveness_analysis_passes == 1:
-                            update_reg_mask = extra_reg_mask
-                        update_reg_mask &= ~self.produced_register_masks.get(reg_id, 0)
-                        if update_reg_mask != 0:
-                            extra_live_registers[reg_id] = update_reg_mask
-                        else:
-                            del extra_live_registers[reg_id]
-
-                # Step 3
-                if self.input_blocks:
-                    if self.liveness_analysis_passes == 1:
-                        for (consumed_reg_id, consumed_reg_mask) in six.iteritems(self.consumed_register_masks):
-                            extra_live_registers[consumed_reg_id] =\
-                                extra_live_registers.get(consumed_reg_id, 0) | consumed_reg_mask
-
-                if self.input_blocks and (extra_live_registers or self.liveness_analysis_passes == 1):
-                    for input_block in self.input_blocks[1:]:
-                        # The dict needs to be copied because input blocks can change it
-                        input_block.analyze_liveness(extra_live_registers.copy())
-                    # Optimization: do not create a copy of the dict
-                    self.input_blocks[0].analyze_liveness(extra_live_registers)
-
-            def analyze_reachability(self):
-                if not self.is_reachable:
-                    self.is_reachable = True
-                    for output_block in self.output_blocks:
-                        output_block.analyze_reachability()
+            def analyze_availability(self):
+                self.available_in_registers_bits = 0
+                for input_block in self.input_blocks:
+                    if input_block.is_reachable:
+                        self.available_in_registers_bits |= input_block.available_out_registers_bits
+                available_out_registers_bits = self.available_in_registers_bits | self.produced_registers_bits
+                is_updated = available_out_registers_bits != self.available_out_registers_bits
+                self.available_out_registers_bits = available_out_registers_bits
+                return is_updated
+
+            def analyze_liveness(self):
+                self.live_out_registers_bits = 0
+                for output_block in self.output_blocks:
+                    self.live_out_registers_bits |= output_block.live_in_registers_bits
+                live_in_registers_bits = self.consumed_registers_bits | \
+                    (self.live_out_registers_bits & ~self.produced_registers_bits)
+                is_updated = live_in_registers_bits != self.live_in_registers_bits
+                self.live_in_registers_bits = live_in_registers_bits
+                return is_updated
 
             def forward_pass(self, processing_function, instructions, input_state):
+                # Depth-first traversal with an explicit stack: recursion would overflow on functions with many blocks
                 output_state = processing_function(self, instructions, input_state)
-                for output_block in self.output_blocks:
-                    if output_block.start_position not in self.processed_output_blocks:
-                        self.processed_output_blocks.add(output_block.start_position)
-                        output_block.forward_pass(processing_function, instructions, output_state)
+                stack = [(self, output_state, iter(self.output_blocks))]
+                while stack:
+                    block, state, output_blocks = stack[-1]
+                    for output_block in output_blocks:
+                        if output_block.start_position not in block.processed_output_blocks:
+                            block.processed_output_blocks.add(output_block.start_position)
+                            output_state = processing_function(output_block, instructions, state)
+                            stack.append((output_block, output_state, iter(output_block.output_blocks)))
+                            break
+                    else:
+                        stack.pop()
 
             def backward_pass(self, processing_function, instructions, input_state):
+                # Depth-first traversal with an explicit stack: recursion would overflow on functions with many blocks
                 output_state = processing_function(self, instructions, input_state)
-                for input_block in self.input_blocks:
-                    if input_block.start_position not in self.processed_input_blocks:
-                        self.processed_input_blocks.add(input_block.start_position)
-                        input_block.backward_pass(processing_function, instructions, output_state)
+                stack = [(self, output_state, iter(self.input_blocks))]
+                while stack:
+                    block, state, input_blocks = stack[-1]
+                    for input_block in input_blocks:
+                        if input_block.start_position not in block.processed_input_blocks:
+                            block.processed_input_blocks.add(input_block.start_position)
+                            output_state = processing_function(input_block, instructions, state)
+                            stack.append((input_block, output_state, iter(input_block.input_blocks)))
+                            break
+                    else:
+                        stack.pop()
 
             def propogate_sse_avx_state_forward(self, instructions, is_avx_environment):
                 from peachpy.x86_64.avx import VZEROALL, VZEROUPPER
@@ -616,11 +655,7 @@ class Function:
                 self.backward_pass(propogate_avx_backward, instructions, avx_state)
 
 
-        basic_blocks = list(map(lambda start_end:
-                           BasicBlock(start_end[0], start_end[1],
-                                      input_registers[start_end[0]:start_end[1]],
-                                      output_registers[start_end[0]:start_end[1]]),
-                           basic_block_bounds))
+        basic_blocks = [BasicBlock(start, end) for (start, end) in basic_block_bounds]
         # Map from block start position to BasicBlock object
         basic_blocks_map = {basic_block_start: basic_block
                             for (basic_block_start, basic_block) in zip(basic_block_starts, basic_blocks)}
@@ -643,16 +678,47 @@ class Function:
                 basic_block.output_blocks = [basic_blocks[i+1]]
         # Set input basic blocks for each basic block object
         for basic_block in basic_blocks:
-            basic_block.input_blocks = list(filter(lambda bb: basic_block in bb.output_blocks, basic_blocks))
-
-        # Analyze which blocks can be reached from the entry point
-        basic_blocks_map[entry_position].analyze_reachability()
+            for output_block in basic_block.output_blocks:
+                if basic_block not in output_block.input_blocks:
+                    output_block.input_blocks.append(basic_block)
+
+        # Analyze which blocks can be reached from the entry point and order them in reverse post-order
+        entry_block = basic_blocks_map[entry_position]
+        entry_block.is_reachable = True
+        postorder_blocks = list()
+        stack = [(entry_block, iter(entry_block.output_blocks))]
+        while stack:
+            block, output_blocks = stack[-1]
+            for output_block in output_blocks:
+                if not output_block.is_reachable:
+                    output_block.is_reachable = True
+                    stack.append((output_block, iter(output_block.output_blocks)))
+                    break
+            else:
+                postorder_blocks.append(block)
+                stack.pop()
         exit_positions = [block.start_position for block in basic_blocks if not block.output_blocks]
 
-        # Analyze register lifetime
-        basic_blocks_map[entry_position].analyze_availability(dict())
-        for exit_position in exit_positions:
-            basic_blocks_map[exit_position].analyze_liveness(dict())
+        # Analyze register lifetime with worklist solvers: availability is a forward problem, and converges fastest when
+        # blocks are processed in reverse post-order, while liveness is a backward problem and is best processed in
+        # post-order. Unreachable blocks do not contribute to availability, but still participate in liveness analysis.
+        def solve(ordered_blocks, analyze_block, get_dependent_blocks):
+            worklist = collections.deque(ordered_blocks)
+            for block in ordered_blocks:
+                block.is_queued = True
+            while worklist:
+                block = worklist.popleft()
+                block.is_queued = False
+                if analyze_block(block):
+                    for dependent_block in get_dependent_blocks(block):
+                        if not dependent_block.is_queued:
+                            dependent_block.is_queued = True
+                            worklist.append(dependent_block)
+
+        solve(list(reversed(postorder_blocks)), BasicBlock.analyze_availability,
+              lambda block: [output_block for output_block in block.output_blocks if output_block.is_reachable])
+        solve(postorder_blocks + [block for block in basic_blocks if not block.is_reachable],
+              BasicBlock.analyze_liveness, operator.attrgetter("input_blocks"))
 
         # Analyze SSE/AVX mode
         basic_blocks_map[entry_position].propogate_sse_avx_state_forward(self._instructions, self.avx_environment)
@@ -666,11 +732,11 @@ class Function:
 
         # Reconstruct live and available registers for the whole instruction sequence
         for basic_block in basic_blocks:
-            for (instruction, available_registers, live_registers) in \
+            for (instruction, available_registers_loader, live_registers) in \
                     zip(self._instructions[basic_block.start_position:basic_block.end_position],
-                        basic_block.available_registers_list, basic_block.live_registers_list):
+                        basic_block.available_registers_loaders, basic_block.live_registers_list):
                 instruction._live_registers = live_registers
-                instruction._available_registers = available_registers
+                instruction._load_available_registers = available_registers_loader
             # Remove referenced to input/output blocks to avoid memory leaks due to cycles in ref graph
             basic_block.input_blocks = None
             basic_block.output_blocks = None
@@ -702,16 +768,35 @@ class Function:
                         live_virtual_register.virtual_id, conflict_internal_ids)
             output_registers = instruction.output_registers
 
-    def _check_live_registers(self):
-        """Checks that the number of live registers does not exceed the number of physical registers for each insruction
-        """
+        # Analyze move-related registers: allocating them to the same physical register makes the move redundant
+        from peachpy.x86_64.registers import Register
+        for instruction in self._instructions:
+            if instruction.name in _register_copy_instructions and len(instruction.operands) == 2:
+                destination, source = instruction.operands
+                if isinstance(destination, Register) and isinstance(source, Register) and \
+                        destination.kind == source.kind and destination.size == source.size:
+                    if destination.is_virtual:
+                        self._register_allocators[destination.kind].add_affinity(
+                            destination.virtual_id, source._internal_id)
+                    elif source.is_virtual:
+                        self._register_allocators[source.kind].add_affinity(
+                            source.virtual_id, destination._internal_id)
+
+    @staticmethod
+    def _max_live_registers():
+        """Returns a map from register kind to the number of physical registers available for allocation"""
         from peachpy.x86_64.registers import GeneralPurposeRegister, MMXRegister, XMMRegister, KRegister
-        max_live_registers = {
+        return {
             GeneralPurposeRegister._kind: 15,
             MMXRegister._kind: 8,
             XMMRegister._kind: 16,
             KRegister._kind: 8
         }
+
+    def _check_live_registers(self):
+        """Checks that the number of live registers does not exceed the number of physical registers for each insruction
+        """
+        max_live_registers = self._max_live_registers()
         for instruction in self._instructions:
             live_registers = max_live_registers.copy()
             for reg in instruction.live_registers:
@@ -725,6 +810,174 @@ class Function:
                     raise peachpy.RegisterAllocationError(
                         "The number of live virtual registers exceeds physical constraints %s" % str(instruction))
 
+    def _select_spill_candidates(self):
+        """Scans the instruction stream and selects virtual registers to spill on stack.
+
+        At each instruction where the number of live registers of some kind exceeds the number of physical registers,
+        the live virtual registers which are not referenced by the instruction are considered for spilling. Among them
+        the registers with the most distant next use, relative to their loop-depth-weighted number of references, are
+        spilled until the register pressure at the instruction fits the physical constraints.
+
+        :returns: a map from register kind to the set of virtual register ids selected for spilling.
+        """
+        from peachpy.x86_64.registers import GeneralPurposeRegister, XMMRegister, GeneralPurposeRegister64, \
+            ZMMRegister
+        kind_masks = {
+            GeneralPurposeRegister._kind: GeneralPurposeRegister64._mask,
+            XMMRegister._kind: ZMMRegister._mask
+        }
+        max_live_registers = self._max_live_registers()
+
+        # Map from (kind, virtual id) to the sorted list of positions of instructions which reference the register
+        reference_positions = collections.defaultdict(list)
+        # Map from (kind, virtual id) to the spill cost of the register
+        spill_costs = collections.defaultdict(int)
+        # List of sets of (kind, virtual id) referenced by each instruction
+        instruction_references = []
+        for (position, instruction) in enumerate(self._instructions):
+            references = set()
+            for register in instruction.register_objects:
+                if register.is_virtual and register.kind in kind_masks:
+                    references.add((register.kind, register.virtual_id))
+            for reference in references:
+                reference_positions[reference].append(position)
+                # Registers referenced inside loops are more expensive to spill
+                spill_costs[reference] += 10 ** min(max(instruction._indent_level - 1, 0), 6)
+            instruction_references.append(references)
+
+        spilled_registers = {kind: set() for kind in kind_masks}
+        for (position, (instruction, references)) in enumerate(zip(self._instructions, instruction_references)):
+            for (kind, kind_mask) in six.iteritems(kind_masks):
+                physical_count = 0
+                live_virtual_ids = []
+                for (reg_id, reg_mask) in six.iteritems(instruction._live_registers):
+                    if reg_mask & kind_mask != 0:
+                        if reg_id >= 0:
+                            physical_count += 1
+                        elif -reg_id not in spilled_registers[kind]:
+                            live_virtual_ids.append(-reg_id)
+                surplus = physical_count + len(live_virtual_ids) - max_live_registers[kind]
+                if surplus <= 0:
+                    continue
+
+                def spill_priority(virtual_id):
+                    positions = reference_positions[(kind, virtual_id)]
+                    next_index = bisect.bisect_right(positions, position)
+                    if next_index < len(positions):
+                        distance = positions[next_index] - position
+                    else:
+                        distance = len(self._instructions)
+                    return float(distance) / spill_costs[(kind, virtual_id)], virtual_id
+
+                candidates = [virtual_id for virtual_id in live_virtual_ids
+                              if (kind, virtual_id) not in references and (kind, virtual_id) in reference_positions]
+                candidates.sort(key=spill_priority, reverse=True)
+                spilled_registers[kind].update(candidates[:surplus])
+        return {kind: virtual_ids for (kind, virtual_ids) in six.iteritems(spilled_registers) if virtual_ids}
+
+    def _insert_spill_code(self, spilled_registers):
+        """Replaces spilled virtual registers with short-lived temporary registers.
+
+        Each spilled virtual register gets a local variable on stack. For every instruction which references a spilled
+        register, its references are renamed to a new temporary virtual register, which is reloaded from the local
+        variable before the instruction if the instruction reads (or partially writes) the register, and stored to
+        the local variable after the instruction if the instruction writes the register.
+
+        :param dict spilled_registers: a map from register kind to the set of virtual register ids to spill.
+        """
+        from peachpy.x86_64.registers import GeneralPurposeRegister, XMMRegister, GeneralPurposeRegister64, \
+            YMMRegister, ZMMRegister
+        from peachpy.x86_64.lower import load_spilled_register, store_spilled_register
+        kind_masks = {
+            GeneralPurposeRegister._kind: GeneralPurposeRegister64._mask,
+            XMMRegister._kind: ZMMRegister._mask
+        }
+
+        # Compute the full mask of every spilled register to choose the size of its spill slot
+        spill_masks = collections.defaultdict(int)
+        for instruction in self._instructions:
+            for register in instruction.register_objects:
+                if register.is_virtual and register.virtual_id in spilled_registers.get(register.kind, ()):
+                    spill_masks[(register.kind, register.virtual_id)] |= register.mask
+        spill_slots = dict()
+        for ((kind, virtual_id), mask) in six.iteritems(spill_masks):
+            if kind == GeneralPurposeRegister._kind:
+                spill_masks[(kind, virtual_id)] = GeneralPurposeRegister64._mask
+                spill_slots[(kind, virtual_id)] = LocalVariable(GeneralPurposeRegister64.size)
+            elif mask & ZMMRegister._mask == ZMMRegister._mask:
+                spill_masks[(kind, virtual_id)] = ZMMRegister._mask
+                spill_slots[(kind, virtual_id)] = LocalVariable(ZMMRegister.size)
+            elif mask & YMMRegister._mask == YMMRegister._mask:
+                spill_masks[(kind, virtual_id)] = YMMRegister._mask
+                spill_slots[(kind, virtual_id)] = LocalVariable(YMMRegister.size)
+            else:
+                spill_masks[(kind, virtual_id)] = XMMRegister._mask
+                spill_slots[(kind, virtual_id)] = LocalVariable(XMMRegister.size)
+
+        has_avx_instructions = any(bool(instruction.avx_mode) for instruction in self._instructions)
+        instructions = list()
+        for instruction in self._instructions:
+            spilled_references = collections.defaultdict(list)
+            for register in instruction.register_objects:
+                if register.is_virtual and register.virtual_id in spilled_registers.get(register.kind, ()):
+                    spilled_references[(register.kind, register.virtual_id)].append(register)
+            if not spilled_references:
+                instructions.append(instruction)
+                continue
+
+            avx_mode = instruction.avx_mode
+            if avx_mode is None:
+                avx_mode = has_avx_instructions
+            input_registers_masks = instruction.input_registers_masks
+            output_registers_masks = instruction.output_registers_masks
+            reloads, spills = list(), list()
+            for ((kind, virtual_id), registers) in six.iteritems(spilled_references):
+                kind_mask = kind_masks[kind]
+                full_mask = spill_masks[(kind, virtual_id)]
+                input_mask = input_registers_masks.get(-virtual_id, 0) & kind_mask
+                output_mask = output_registers_masks.get(-virtual_id, 0) & kind_mask
+                if kind == GeneralPurposeRegister._kind:
+                    temporary_id = self._allocate_general_purpose_register_id()
+                else:
+                    temporary_id = self._allocate_xmm_register_id()
+                    if not avx_mode:
+                        # SSE instructions do not modify the upper part of ymm/zmm registers
+                        full_mask = XMMRegister._mask
+                for register in registers:
+                    register.virtual_id = temporary_id
+                slot = spill_slots[(kind, virtual_id)]
+                if input_mask != 0 or output_mask & full_mask != full_mask:
+                    reloads.append(load_spilled_register(kind, temporary_id, full_mask, slot, avx_mode,
+                                                         prototype=instruction))
+                if output_mask != 0:
+                    spills.append(store_spilled_register(kind, temporary_id, full_mask, slot, avx_mode,
+                                                         prototype=instruction))
+            instructions.extend(reloads)
+            instructions.append(instruction)
+            instructions.extend(spills)
+        self._instructions = instructions
+
+    def _spill_registers(self):
+        """Spills virtual registers on stack until the number of live registers fits the physical constraints"""
+
+        while True:
+            spilled_registers = self._select_spill_candidates()
+            if not spilled_registers:
+                break
+            self._insert_spill_code(spilled_registers)
+            # Liveness and conflicts need to be recomputed for the new instruction stream
+            self._reset_register_allocators()
+            self._analize()
+
+    def _schedule_instructions(self):
+        """Reorders instructions within basic blocks to hide latencies of the target microarchitecture"""
+
+        from peachpy.x86_64.scheduler import schedule_instructions
+        self._instructions = schedule_instructions(self._instructions, self.target, self._max_live_registers())
+        # Liveness and conflicts need to be recomputed for the new instruction stream
+        self._reset_register_allocators()
+        self._analize()
+
     def _preallocate_registers(self):
         """Allocates registers that can be binded only to a single virtual register.
 
@@ -886,6 +1139,70 @@ class Function:
             return str(line_separator).join(code)
 
 
+# Options which are read during finalization of functions. Worker processes of finalize_functions do not necessarily
+# inherit the options of the calling process, and receive their values with every task.
+_finalization_options = ("name_mangling", "peephole_rules", "debug_level")
+
+
+def _finalize_function(function, abi, encode, options):
+    saved_options = {name: getattr(peachpy.x86_64.options, name) for name in _finalization_options}
+    try:
+        for name, value in six.iteritems(options):
+            setattr(peachpy.x86_64.options, name, value)
+        abi_function = function.finalize(abi)
+        if encode:
+            return abi_function.encode()
+        else:
+            return abi_function
+    finally:
+        for name, value in six.iteritems(saved_options):
+            setattr(peachpy.x86_64.options, name, value)
+
+
+def finalize_functions(functions, abis, encode=False, max_workers=None):
+    """Finalizes multiple functions for multiple ABIs using a pool of worker processes.
+
+    Functions and their finalized versions are sent between processes via :mod:`pickle`. The results do not depend on
+    the number of workers or on the order in which the workers complete. The options which affect finalization (name
+    mangling, peephole rules, and debug level) are taken from the calling process, so custom peephole rules must be
+    picklable.
+
+    :param list functions: a list of :class:`Function` objects, e.g. versions of a kernel for different targets.
+    :param list abis: a list of :class:`peachpy.x86_64.abi.ABI` objects to finalize each function for.
+    :param bool encode: indicates if the finalized functions should also be encoded. If True, the results are
+        :class:`EncodedFunction` objects instead of :class:`ABIFunction` objects.
+    :param int max_workers: the maximum number of worker processes. None means the number of processors. If 1, the
+        functions are finalized in the calling process.
+    :returns: a list of lists of finalized functions: the element [i][j] is functions[i] finalized for abis[j].
+    """
+    from peachpy.x86_64.abi import ABI
+    functions = list(functions)
+    abis = list(abis)
+    for function in functions:
+        if not isinstance(function, Function):
+            raise TypeError("%s is not a Function object" % str(function))
+    for abi in abis:
+        if not isinstance(abi, ABI):
+            raise TypeError("%s is not an ABI object" % str(abi))
+    if max_workers is not None and max_workers < 1:
+        raise ValueError("The number of workers must be positive")
+
+    tasks = [(function, abi) for function in functions for abi in abis]
+    task_functions = [function for (function, abi) in tasks]
+    task_abis = [abi for (function, abi) in tasks]
+    task_encode = [encode] * len(tasks)
+    options = {name: getattr(peachpy.x86_64.options, name) for name in _finalization_options}
+    task_options = [options] * len(tasks)
+    if max_workers == 1 or len(tasks) <= 1:
+        results = list(map(_finalize_function, task_functions, task_abis, task_encode, task_options))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Executor.map returns the results in the order of tasks
+            results = list(executor.map(_finalize_function, task_functions, task_abis, task_encode, task_options))
+    return [results[i:i + len(abis)] for i in range(0, len(results), len(abis))]
+
+
 class Argument(peachpy.Argument):
     def __init__(self, argument, abi):
         """Extends generic Argument object with x86-64 specific attributes required for stack frame construction
@@ -931,7 +1248,6 @@ class ABIFunction:
         from peachpy.x86_64.abi import ABI, \
             microsoft_x64_abi, system_v_x86_64_abi, linux_x32_abi, native_client_x86_64_abi, \
             gosyso_amd64_abi, gosyso_amd64p32_abi, goasm_amd64_abi, goasm_amd64p32_abi
-        from copy import deepcopy
         assert isinstance(function, Function), "Function object expected"
         assert isinstance(abi, ABI), "ABI object expected"
         self.name = function.name
@@ -954,8 +1270,11 @@ class ABIFunction:
         self._stack_frame_alignment = self.abi.stack_alignment
         self._local_variables_size = 0
 
-        self._instructions = deepcopy(function._instructions)
-        self._register_allocators = deepcopy(function._register_allocators)
+        # Register binding and address layout modify operands, so they need to be copied
+        memo = dict()
+        self._instructions = [instruction._copy(memo) for instruction in function._instructions]
+        self._register_allocators = {kind: register_allocator.copy() for (kind, register_allocator)
+                                     in six.iteritems(function._register_allocators)}
 
         if abi == microsoft_x64_abi:
             self._setup_windows_arguments()
@@ -979,10 +1298,13 @@ class ABIFunction:
 
         self._lower_argument_loads()
         self._lower_pseudoinstructions()
+        self._optimize_peephole()
         self._filter_instruction_encodings()
 
         self.mangled_name = self.mangle_name()
 
+        self._encoded_function = None
+
     def _update_argument_loads(self, arguments):
         from peachpy.x86_64.pseudo import LOAD
         for instruction in self._instructions:
@@ -1373,6 +1695,24 @@ class ABIFunction:
                 instructions.append(instruction)
         self._instructions = instructions
 
+    def _optimize_peephole(self):
+        """Removes redundant instructions left by register allocation and lowering of pseudo-instructions.
+
+        The cleanup rules (removal of self-moves and round-trip moves) are always applied, but only to the copies of
+        allocated registers, and never change instructions with physical registers written by the user. The rules from
+        peachpy.x86_64.options.peephole_rules, which is empty by default and is set by -fpeephole, are then applied to
+        all instructions. The number of times every rule was applied is recorded in the peephole_hits attribute.
+        """
+        from peachpy.x86_64.peephole import PeepholeOptimizer, cleanup_rules
+        optimizer = PeepholeOptimizer(cleanup_rules)
+        self._instructions = optimizer.optimize(self._instructions, _is_allocated_copy)
+        self.peephole_hits = optimizer.hits
+        if peachpy.x86_64.options.peephole_rules:
+            optimizer = PeepholeOptimizer(peachpy.x86_64.options.peephole_rules)
+            self._instructions = optimizer.optimize(self._instructions)
+            for rule_name, rule_hits in optimizer.hits.items():
+                self.peephole_hits[rule_name] = self.peephole_hits.get(rule_name, 0) + rule_hits
+
     def _filter_instruction_encodings(self):
         for instruction in self._instructions:
             instruction.encodings = instruction._filter_encodings()
@@ -1433,13 +1773,30 @@ class ABIFunction:
             self._argument_stack_base = rsp + return_address_size + self._stack_frame_size + self._local_variables_size
 
     def _bind_registers(self):
-        """Iterates through the list of instructions and assigns physical IDs to allocated registers"""
+        """Iterates through the list of instructions and assigns physical IDs to allocated registers.
+
+        Copies between virtual registers which were coalesced by the register allocator become moves of a register to
+        itself. Such moves are removed unless they have side effects (e.g. 32-bit MOV clears the high 32 bits).
+        """
+        from peachpy.x86_64.peephole import _is_noop_move, _get_vector_size
 
+        allocated_copies = list()
         for instruction in self._instructions:
             for register in instruction.register_objects:
                 if register.is_virtual:
                     register.physical_id = \
                         self._register_allocators[register.kind].register_allocations[register.virtual_id]
+            if _is_allocated_copy(instruction):
+                allocated_copies.append(instruction)
+
+        if allocated_copies:
+            vector_size = _get_vector_size(self._instructions)
+            redundant_copies = set(id(instruction) for instruction in allocated_copies
+                                   if _is_noop_move(instruction, instruction.operands[0], instruction.operands[1],
+                                                    vector_size))
+            if redundant_copies:
+                self._instructions = [instruction for instruction in self._instructions
+                                      if id(instruction) not in redundant_copies]
 
     def format_code(self, assembly_format="peachpy", line_separator=os.linesep, indent=True, line_number=1):
         """Returns code of assembly instructions comprising the function"""
@@ -1468,6 +1825,17 @@ class ABIFunction:
         else:
             return str(line_separator).join(code)
 
+    def analyze_loops(self, target=None):
+        """Statically estimates throughput of every loop in the function.
+
+        :param peachpy.x86_64.uarch.Microarchitecture target: the microarchitecture to analyze the loops for. If not
+            specified, the target microarchitecture of the function is used.
+        :returns: a list of :class:`peachpy.x86_64.performance.LoopAnalysis` objects with cycles per iteration,
+            bottleneck ports, and critical path latency of every loop.
+        """
+        from peachpy.x86_64.performance import analyze_loops
+        return analyze_loops(self, target)
+
     def format(self, assembly_format="peachpy", line_separator=os.linesep, line_number=1):
         """Formats assembly listing of the function according to specified parameters"""
 
@@ -1533,7 +1901,10 @@ class ABIFunction:
             return str(line_separator).join(code)
 
     def encode(self):
-        return EncodedFunction(self)
+        # ABIFunction is not modified after construction, so the encoded function can be reused by all writers
+        if self._encoded_function is None:
+            self._encoded_function = EncodedFunction(self)
+        return self._encoded_function
 
     @property
     def metadata(self):
@@ -1666,6 +2037,38 @@ class InstructionBundle:
         return self.size
 
 
+# Cache of encoded functions: maps ABI and signatures of instructions to the encoded code and data sections
+function_encoding_cache = EncodingCache(capacity=256)
+
+
+def _get_instructions_signature(instructions):
+    """Returns a hashable object that identifies encoding of the instruction stream, or None if some of the
+    instructions can not be described by a signature.
+
+    Unlike :attr:`Instruction._encoding_signature`, the signature covers label names and content of literal constants.
+    """
+    from peachpy.x86_64.pseudo import Label
+    from peachpy.x86_64.operand import MemoryOperand, get_operand_signature
+    from peachpy.literal import Constant
+    instruction_signatures = []
+    for instruction in instructions:
+        operand_signatures = []
+        for operand in instruction.operands:
+            operand_signature = get_operand_signature(operand)
+            if operand_signature is None:
+                if isinstance(operand, Label):
+                    operand_signature = Label, str(operand)
+                else:
+                    return None
+            elif isinstance(operand, MemoryOperand) and isinstance(operand.symbol, Constant):
+                constant = operand.symbol
+                operand_signature = operand_signature, ".".join(map(str, constant.name)), \
+                    constant.size, constant.repeats, str(constant.element_ctype), tuple(constant.data)
+            operand_signatures.append(operand_signature)
+        instruction_signatures.append((type(instruction), instruction.name, tuple(operand_signatures)))
+    return tuple(instruction_signatures)
+
+
 class EncodedFunction:
     """ABI-specific x86-64 assembly function.
 
@@ -1695,11 +2098,32 @@ class EncodedFunction:
 
         self.const_section = Section(SectionType.const_data)
 
-        self._instructions = deepcopy(function._instructions)
+        # Encoding does not modify operands, so they can be shared with the ABIFunction
+        memo = dict()
+        self._instructions = [instruction._copy(memo, copy_operands=False) for instruction in function._instructions]
 
         self._constant_symbol_map = dict()
-        self._layout_literal_constants()
-        self._encode()
+
+        # Native Client functions are not cached because bundling changes the instruction stream
+        signature = None
+        if function_encoding_cache.capacity > 0 and self.abi != native_client_x86_64_abi:
+            instructions_signature = _get_instructions_signature(self._instructions)
+            if instructions_signature is not None:
+                signature = self.abi.name, instructions_signature
+
+        cached_encoding = function_encoding_cache.get(signature) if signature is not None else None
+        if cached_encoding is None:
+            self._layout_literal_constants()
+            self._encode()
+            if signature is not None:
+                bytecodes = tuple(bytes(instruction.bytecode) if instruction.bytecode is not None else None
+                                  for instruction in self._instructions)
+                function_encoding_cache.put(signature, (deepcopy((self.code_section, self.const_section)), bytecodes))
+        else:
+            sections, bytecodes = cached_encoding
+            self.code_section, self.const_section = deepcopy(sections)
+            for instruction, bytecode in zip(self._instructions, bytecodes):
+                instruction.bytecode = bytearray(bytecode) if bytecode is not None else None
 
     def _layout_literal_constants(self):
         from peachpy.encoder import Encoder
@@ -1830,29 +2254,7 @@ class EncodedFunction:
                     else:
                         self.code_section.content += self._encode_abort(bundle.capacity - bundle.size)
         else:
-            has_updated_branches = True
-            has_unresolved_labels = True
-            while has_updated_branches or has_unresolved_labels:
-                code_address = 0
-                has_updated_branches = False
-                has_unresolved_labels = False
-                for (i, instruction) in enumerate(self._instructions):
-                    if isinstance(instruction, LABEL):
-                        label_address_map[instruction.identifier] = code_address
-                    elif isinstance(instruction, BranchInstruction) and instruction.label_name:
-                        label_address = label_address_map.get(instruction.label_name)
-                        if label_address is None:
-                            has_unresolved_labels = True
-                        was_long = i in long_branches
-                        is_long, instruction.bytecode = instruction._encode_label_branch(code_address, label_address,
-                                                                                         long_encoding=was_long)
-                        if is_long and not was_long:
-                            long_branches.add(i)
-                            has_updated_branches = True
-                    else:
-                        instruction.bytecode = instruction.encode()
-                    if instruction.bytecode:
-                        code_address += len(instruction.bytecode)
+            self._relax_branches()
 
             for instruction in self._instructions:
                 constant = instruction.constant
@@ -1868,6 +2270,84 @@ class EncodedFunction:
                 if instruction.bytecode:
                     self.code_section.content += instruction.bytecode
 
+    def _relax_branches(self):
+        """Encodes instructions and chooses between short (rel8) and long (rel32) encodings of label branches.
+
+        Instructions other than label branches do not depend on their address, and are encoded only once. Then the
+        relaxation iterates only over branches: all branches start with the shortest encoding, and on each pass the
+        branches with offsets that do not fit into their current encoding are promoted to long encoding. As branches
+        only grow, the process converges to the smallest consistent layout. Addresses are computed from a prefix sum of
+        the sizes of non-branch instructions and a prefix sum of the sizes of branches, so a pass takes time
+        proportional to the number of branches and labels rather than the number of instructions.
+        """
+        from peachpy.x86_64.pseudo import LABEL
+        from peachpy.x86_64.instructions import BranchInstruction
+        from peachpy.x86_64.encoding import Flags
+        from peachpy.util import is_sint8
+
+        # Positions of label branch instructions in the instruction stream
+        branch_positions = list()
+        # Map from label name to its position in the instruction stream
+        label_positions = dict()
+        # Prefix sums of the sizes of non-branch instructions
+        fixed_size_prefix = [0]
+        for (i, instruction) in enumerate(self._instructions):
+            if isinstance(instruction, LABEL):
+                label_positions[instruction.identifier] = i
+            elif isinstance(instruction, BranchInstruction) and instruction.label_name:
+                branch_positions.append(i)
+            else:
+                instruction.bytecode = instruction.encode()
+                if instruction.bytecode:
+                    fixed_size_prefix.append(fixed_size_prefix[-1] + len(instruction.bytecode))
+                    continue
+            fixed_size_prefix.append(fixed_size_prefix[-1])
+
+        # For each branch: the number of branches before its target label, and the lengths of short and long encodings
+        branch_targets = list()
+        short_sizes = list()
+        long_sizes = list()
+        for position in branch_positions:
+            branch = self._instructions[position]
+            label_position = label_positions[branch.label_name]
+            branch_targets.append((label_position, bisect.bisect_left(branch_positions, label_position)))
+            rel8_sizes = [len(encode(0)) for (flags, encode) in branch.encodings if flags & Flags.Rel8Label != 0]
+            rel32_sizes = [len(encode(0)) for (flags, encode) in branch.encodings if flags & Flags.Rel32Label != 0]
+            short_sizes.append(min(rel8_sizes) if rel8_sizes else None)
+            long_sizes.append(max(rel32_sizes) if rel32_sizes else None)
+        # Start with short encoding for all branches which have it
+        is_long = [short_size is None for short_size in short_sizes]
+
+        has_updated_branches = True
+        while has_updated_branches:
+            has_updated_branches = False
+            branch_sizes = [long_size if long else short_size
+                            for (long, short_size, long_size) in zip(is_long, short_sizes, long_sizes)]
+            branch_size_prefix = [0]
+            for branch_size in branch_sizes:
+                branch_size_prefix.append(branch_size_prefix[-1] + branch_size)
+            for (j, position) in enumerate(branch_positions):
+                if is_long[j]:
+                    continue
+                branch_end_address = fixed_size_prefix[position] + branch_size_prefix[j + 1]
+                label_position, label_branch_index = branch_targets[j]
+                label_address = fixed_size_prefix[label_position] + branch_size_prefix[label_branch_index]
+                if not is_sint8(label_address - branch_end_address):
+                    if long_sizes[j] is None:
+                        raise ValueError("Can not encode offset to label %s" %
+                                         self._instructions[position].label_name)
+                    is_long[j] = True
+                    has_updated_branches = True
+
+        # Encode branches with the final layout
+        for (j, position) in enumerate(branch_positions):
+            branch = self._instructions[position]
+            branch_address = fixed_size_prefix[position] + branch_size_prefix[j]
+            label_position, label_branch_index = branch_targets[j]
+            label_address = fixed_size_prefix[label_position] + branch_size_prefix[label_branch_index]
+            _, branch.bytecode = branch._encode_label_branch(branch_address, label_address, long_encoding=is_long[j])
+            assert len(branch.bytecode) == branch_sizes[j]
+
     def _encode_nops(self, length):
         assert 1 <= length <= 31
         from peachpy.x86_64.encoding import nop
@@ -1925,12 +2405,19 @@ class EncodedFunction:
         else:
             return str(line_separator).join(filter(bool, code))
 
-    def load(self):
+    def load(self, arena=None):
+        """Loads the function into the memory of the current process and returns a callable object for it.
+
+        :param peachpy.loader.CodeArena arena: an optional code arena to load the function into. If not specified,
+            the function gets its own memory mapping.
+        """
+        if arena is not None:
+            return arena.load([self])[0]
         return ExecutableFuntion(self)
 
 
 class ExecutableFuntion:
-    def __init__(self, function):
+    def __init__(self, function, arena=None):
         assert isinstance(function, EncodedFunction), "EncodedFunction object expected"
         import peachpy.x86_64.abi
         process_abi = peachpy.x86_64.abi.detect()
@@ -1940,9 +2427,28 @@ class ExecutableFuntion:
 
         self.code_segment = bytearray(function.code_section.content)
         self.const_segment = bytearray(function.const_section.content)
+        self._encoded_function = function
+        self._argument_record_type = None
 
-        import peachpy.loader
-        self.loader = peachpy.loader.Loader(len(self.code_segment), len(self.const_segment))
+        self.loader = None
+        self.arena = None
+        self.arena_block = None
+        if arena is None:
+            import peachpy.loader
+            self.loader = peachpy.loader.Loader(len(self.code_segment), len(self.const_segment))
+            code_address, data_address = self.loader.code_address, self.loader.data_address
+        else:
+            # Constants follow the code in the same arena block
+            from peachpy.util import roundup
+            import weakref
+            const_offset = roundup(len(self.code_segment), function.const_section.alignment)
+            self.arena = arena
+            self.arena_block = arena.allocate(const_offset + len(self.const_segment),
+                                              max(function.code_section.alignment,
+                                                  function.const_section.alignment))
+            self.arena_block.owner = weakref.ref(self)
+            code_address = self.arena_block.address
+            data_address = code_address + const_offset
 
         # Apply relocations
         from peachpy.x86_64.meta import RelocationType
@@ -1955,8 +2461,8 @@ class ExecutableFuntion:
                 (self.code_segment[relocation.offset + 2] << 16) | \
                 (self.code_segment[relocation.offset + 3] << 24)
             new_value = old_value + \
-                (self.loader.data_address + relocation.symbol.offset) - \
-                (self.loader.code_address + relocation.program_counter)
+                (data_address + relocation.symbol.offset) - \
+                (code_address + relocation.program_counter)
             assert is_sint32(new_value)
             self.code_segment[relocation.offset] = new_value & 0xFF
             self.code_segment[relocation.offset + 1] = (new_value >> 8) & 0xFF
@@ -1964,25 +2470,211 @@ class ExecutableFuntion:
             self.code_segment[relocation.offset + 3] = (new_value >> 24) & 0xFF
         assert not function.const_section.relocations
 
-        self.loader.copy_code(self.code_segment)
-        self.loader.copy_data(self.const_segment)
+        if arena is None:
+            self.loader.copy_code(self.code_segment)
+            self.loader.copy_data(self.const_segment)
+        else:
+            arena.write(self.arena_block, 0, self.code_segment)
+            arena.write(self.arena_block, data_address - code_address, self.const_segment)
 
         import ctypes
+        from peachpy.loader import PointerArgumentConverter
+        # Argument conversion plan: a converter for every pointer argument, and None for arguments passed as is
+        self.argument_converters = [
+            PointerArgumentConverter(arg.name, arg.c_type, function.abi) if arg.c_type.is_pointer else None
+            for arg in function.arguments]
+        # Pointer arguments are passed as addresses, ctypes converts them to pointers without type checks
         result_type = None if function.result_type is None else function.result_type.as_ctypes_type
-        argument_types = [arg.c_type.as_ctypes_type for arg in function.arguments]
+        argument_types = [ctypes.c_void_p if arg.c_type.is_pointer else arg.c_type.as_ctypes_type
+                          for arg in function.arguments]
         self.function_type = ctypes.CFUNCTYPE(result_type, *argument_types)
-        self.function_pointer = self.function_type(self.loader.code_address)
+        self._set_function_pointer(code_address)
+
+    def _set_function_pointer(self, code_address):
+        from peachpy.loader import compile_argument_conversion
+        self.code_address = code_address
+        self.function_pointer = self.function_type(code_address)
+        self._call = compile_argument_conversion(self.function_pointer, self.argument_converters)
+
+    def _relocate(self, code_address):
+        """Updates the function pointer after the code arena moved the code of the function"""
+        self._set_function_pointer(code_address)
 
     def __call__(self, *args):
-        return self.function_pointer(*args)
+        return self._call(*args)
+
+    @property
+    def argument_record_type(self):
+        """ctypes structure type which packs the arguments of one call in :meth:`call_many`.
+
+        The structure has a field for every argument, named as the argument, and pointer arguments are stored as
+        addresses.
+        """
+        if self._argument_record_type is None:
+            from peachpy.x86_64.trampoline import get_argument_record_type
+            self._argument_record_type = get_argument_record_type(self._encoded_function.arguments)
+        return self._argument_record_type
+
+    def call_many(self, arguments, results=None):
+        """Calls the function for every set of arguments with a single transition from Python to native code.
+
+        A generated trampoline iterates over packed argument records and calls the function natively.
+
+        :param arguments: the sets of arguments. Either a buffer of packed argument records, e.g. a ctypes array of
+            :attr:`argument_record_type` structures or a NumPy array with a matching structured dtype, or a sequence of
+            argument tuples, which are converted like the arguments of a regular call.
+        :param results: an optional writable buffer for the results, with at least as many items as the number of
+            argument records. If not specified, a ctypes array for the results is allocated.
+        :returns: the buffer with results, or None if the function doesn't return a value.
+        """
+        import ctypes
+        from peachpy.loader import _Buffer
+        from peachpy.x86_64.trampoline import get_call_many_trampoline
+        trampoline = get_call_many_trampoline(self._encoded_function)
+        record_type = self.argument_record_type
+        record_size = ctypes.sizeof(record_type)
+
+        buffers = []
+        try:
+            if isinstance(arguments, (list, tuple)):
+                records = (record_type * len(arguments))()
+                field_names = [name for name, _ in record_type._fields_]
+                for record, record_arguments in zip(records, arguments):
+                    if len(record_arguments) != len(field_names):
+                        raise TypeError("Function takes %d arguments (%d given)" %
+                                        (len(field_names), len(record_arguments)))
+                    for name, converter, value in zip(field_names, self.argument_converters, record_arguments):
+                        if converter is not None:
+                            value = converter(value, buffers)
+                            if isinstance(value, (ctypes._Pointer, ctypes.Array)):
+                                value = ctypes.addressof(value) if isinstance(value, ctypes.Array) else \
+                                    ctypes.cast(value, ctypes.c_void_p).value
+                        setattr(record, name, value)
+                records_address, count = ctypes.addressof(records), len(arguments)
+            else:
+                records_buffer = _Buffer(arguments, False)
+                buffers.append(records_buffer)
+                if records_buffer.item_size != record_size:
+                    raise TypeError("Argument records must be %d-byte items, got %d-byte items" %
+                                    (record_size, records_buffer.item_size))
+                records_address, count = records_buffer.address, records_buffer.size // record_size
+
+            result_type = self._encoded_function.result_type
+            if result_type is None:
+                results_address = None
+            else:
+                result_size = result_type.get_size(self._encoded_function.abi)
+                if results is None:
+                    results = (result_type.as_ctypes_type * count)()
+                results_buffer = _Buffer(results, True)
+                buffers.append(results_buffer)
+                if results_buffer.item_size != result_size:
+                    raise TypeError("Results must be %d-byte items, got %d-byte items" %
+                                    (result_size, results_buffer.item_size))
+                if results_buffer.size < count * result_size:
+                    raise ValueError("Results buffer has space for %d results, %d needed" %
+                                     (results_buffer.size // result_size, count))
+                results_address = results_buffer.address
+
+            trampoline(records_address, count, results_address, self.code_address)
+        finally:
+            for buffer in buffers:
+                buffer.release()
+        return results
+
+    def parallel_for(self, arguments, length_argument=None, chunk_size=None, pool=None):
+        """Splits the buffers passed to the function into chunks and calls the function for the chunks on a thread pool.
+
+        See :func:`peachpy.x86_64.parallel.parallel_for` for the description of the parameters.
+
+        :returns: the list of results of the calls for every chunk, or None if the function doesn't return a value.
+        """
+        from peachpy.x86_64.parallel import parallel_for
+        return parallel_for(self, arguments, length_argument=length_argument, chunk_size=chunk_size, pool=pool)
 
     def __del__(self):
-        del self.loader
+        if self.arena_block is not None:
+            self.arena.free(self.arena_block)
+            self.arena_block = None
         self.loader = None
         self.function_pointer = None
+        self._call = None
+
+
+def _pack_registers_masks(registers_masks, register_slots):
+    """Packs a map from register id to register mask into a bit-vector with a 16-bit slot for each register id
+
+    :param dict registers_masks: a map from register id to register mask.
+    :param dict register_slots: a map from register id to its slot in the bit-vector.
+    """
+    if not registers_masks:
+        return 0
+    slots_masks = array.array("H", [0]) * len(register_slots)
+    for (reg_id, reg_mask) in six.iteritems(registers_masks):
+        slots_masks[register_slots[reg_id]] = reg_mask
+    # Slot 0 corresponds to the least significant bits
+    slots_masks.reverse()
+    if sys.byteorder == "little":
+        slots_masks.byteswap()
+    return int(binascii.hexlify(slots_masks.tostring() if six.PY2 else slots_masks.tobytes()), 16)
+
+
+_nonzero_register_slot_regex = re.compile("(?:0000)*([0-9a-f]{4})")
+
+
+def _unpack_registers_masks(bits, slot_register_ids):
+    """Unpacks a bit-vector with a 16-bit slot for each register id into a map from register id to register mask
+
+    :param int bits: the bit-vector.
+    :param list slot_register_ids: a list of register ids indexed by slot in the bit-vector.
+    """
+    registers_masks = dict()
+    if bits:
+        hex_digits = "%x" % bits
+        hex_digits = "0" * (-len(hex_digits) % 4) + hex_digits
+        top_slot = len(hex_digits) // 4 - 1
+        for match in _nonzero_register_slot_regex.finditer(hex_digits):
+            reg_mask = int(match.group(1), 16)
+            if reg_mask != 0:
+                registers_masks[slot_register_ids[top_slot - match.start(1) // 4]] = reg_mask
+    return registers_masks
+
+
+class _AvailableRegistersReconstructor(object):
+    """Computes registers available before instructions of a basic block from the registers available at the start of
+    the basic block and the output registers of the preceding instructions in the basic block.
+
+    Available registers are usually requested for consecutive instructions, so the reconstructor caches the registers
+    available before the last requested instruction and continues from them.
+    """
 
+    __slots__ = ("available_registers_bits", "slot_register_ids", "output_registers_list",
+                 "_last_count", "_last_available_registers")
+
+    def __init__(self, available_registers_bits, slot_register_ids, output_registers_list):
+        self.available_registers_bits = available_registers_bits
+        self.slot_register_ids = slot_register_ids
+        self.output_registers_list = output_registers_list
+        self._last_count = None
+        self._last_available_registers = None
+
+    def __call__(self, count):
+        if self._last_count is None or count < self._last_count:
+            self._last_count = 0
+            self._last_available_registers = \
+                _unpack_registers_masks(self.available_registers_bits, self.slot_register_ids)
+        available_registers = self._last_available_registers
+        for output_registers in self.output_registers_list[self._last_count:count]:
+            for (output_register_id, output_register_mask) in six.iteritems(output_registers):
+                available_registers[output_register_id] = \
+                    available_registers.get(output_register_id, 0) | output_register_mask
+        self._last_count = count
+        return available_registers.copy()
+
+
+class LocalVariable(object):
+    __slots__ = ("alignment", "size", "_address", "_offset", "parent")
 
-class LocalVariable:
     def __init__(self, size_option, alignment=None):
         from peachpy.util import is_int
         if alignment is not None and not is_int(alignment):
@@ -1,27 +1,230 @@
 # This file is part of PeachPy package and is licensed under the Simplified BSD license.
 #    See license.rst for the full text of the license.
 
+import os
+import sys
+import collections
+
+import six
+
+
+class EncodingCache(object):
+    """Bounded cache of instruction encodings.
+
+    The same combinations of instruction and operands tend to repeat many times in generated code. The cache maps
+    instruction class, name, and operand signatures to the encoding results, and evicts the least recently used entries
+    when the number of entries exceeds the capacity.
+
+    :ivar int capacity: the maximum number of entries in the cache. Zero capacity disables the cache.
+    :ivar int hits: the number of lookups which found the entry in the cache.
+    :ivar int misses: the number of lookups which did not find the entry in the cache.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Removes all entries from the cache and resets hit/miss counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value for the key and marks it as recently used, or returns None if it is not cached"""
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """Adds the value to the cache, evicting the least recently used entries if the cache is full"""
+        if self.capacity <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+encoding_cache = EncodingCache()
+
+
+# Maps code objects of encoding functions to their serialized representation
+_encoding_function_codes = dict()
+# Maps serialized encoding functions to the deserialized function objects
+_encoding_functions = dict()
+
+
+def _reduce_encoding_function(function):
+    """Converts an encoding function (a lambda function generated for an instruction form) to a picklable tuple.
+
+    Encoding functions do not capture variables and depend only on their code, default arguments, and globals of the
+    module where they are defined, so they can be serialized via :mod:`marshal` and recreated in another process.
+    """
+    assert function.__closure__ is None, "Encoding functions must not capture variables"
+    code = _encoding_function_codes.get(function.__code__)
+    if code is None:
+        import marshal
+        code = marshal.dumps(function.__code__)
+        _encoding_function_codes[function.__code__] = code
+    return function.__module__, function.__name__, code, function.__defaults__
+
+
+# Maps shared encoding descriptors to their (module name, index) in the module's table of encodings
+_encoding_descriptor_indices = dict()
+# Names of modules whose tables of encodings are indexed in _encoding_descriptor_indices
+_indexed_encoding_modules = set()
+
+
+def _reduce_encoding(encoding):
+    """Converts an encoding, i.e. a (flags, encoding function) tuple, to a picklable tuple.
+
+    Instructions generated from the instruction set description use shared encoding descriptors from the _encodings
+    table of the module where the instruction class is defined. Such encodings are represented by the module name and
+    the index in the table. Other encodings, e.g. created by pseudo-instructions, are serialized with the code of the
+    encoding function.
+    """
+    import sys
+    flags, function = encoding
+    module_name = function.__module__
+    if module_name not in _indexed_encoding_modules:
+        _indexed_encoding_modules.add(module_name)
+        encodings = getattr(sys.modules.get(module_name), "_encodings", ())
+        for (index, descriptor) in enumerate(encodings):
+            _encoding_descriptor_indices[descriptor] = module_name, index
+    descriptor_index = _encoding_descriptor_indices.get(encoding)
+    if descriptor_index is not None:
+        return descriptor_index
+    return flags, _reduce_encoding_function(function)
+
+
+def _restore_encoding(reduced_encoding):
+    """Recreates an encoding from the tuple produced by :func:`_reduce_encoding`"""
+    if isinstance(reduced_encoding[0], str):
+        import importlib
+        module_name, index = reduced_encoding
+        return importlib.import_module(module_name)._encodings[index]
+    flags, reduced_function = reduced_encoding
+    return flags, _restore_encoding_function(reduced_function)
+
+
+def _restore_encoding_function(reduced_function):
+    """Recreates an encoding function from the tuple produced by :func:`_reduce_encoding_function`"""
+    function = _encoding_functions.get(reduced_function)
+    if function is None:
+        import marshal
+        import types
+        import importlib
+        module, name, code, defaults = reduced_function
+        function = types.FunctionType(marshal.loads(code), importlib.import_module(module).__dict__, name, defaults)
+        _encoding_functions[reduced_function] = function
+    return function
+
+
+class Origin(object):
+    """Location in Python source code where an instruction was created.
+
+    Only the file name and the line number are recorded when the instruction is created. The line of source code is
+    read when it is requested, e.g. for an error message or an assembly listing.
+
+    :ivar str source_file: path to the Python source file.
+    :ivar int line_number: the number of the line in the source file.
+    """
+
+    __slots__ = ("source_file", "line_number")
+
+    def __init__(self, source_file, line_number):
+        self.source_file = source_file
+        self.line_number = line_number
+
+    @property
+    def source_code(self):
+        """The line of source code with leading and trailing whitespace removed, or None if it is not available"""
+        import linecache
+        source_code = linecache.getline(self.source_file, self.line_number).strip()
+        return source_code or None
+
+    def __getstate__(self):
+        return self.source_file, self.line_number
+
+    def __setstate__(self, state):
+        self.source_file, self.line_number = state
+
+
+# Path of the peachpy package directory with a trailing separator
+_package_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "")
+# Maps file names of code objects to a boolean flag which indicates if the file belongs to the peachpy package
+_package_files = dict()
+
+
+def capture_origin():
+    """Returns the origin of an instruction that is being created.
+
+    The origin is the location of the innermost call on the stack from outside of the peachpy package. Unlike
+    :func:`inspect.stack`, this function neither creates frame records for the whole stack nor reads source files.
+
+    :returns: an :class:`Origin` object, or None if the stack does not contain calls from outside of peachpy.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        source_file = frame.f_code.co_filename
+        is_package_file = _package_files.get(source_file)
+        if is_package_file is None:
+            is_package_file = os.path.abspath(source_file).startswith(_package_directory)
+            _package_files[source_file] = is_package_file
+        if not is_package_file:
+            return Origin(source_file, frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+def _get_slot_names(cls):
+    """Returns the names of all slots defined by the class and its base classes"""
+    slot_names = _slot_names.get(cls)
+    if slot_names is None:
+        slot_names = tuple(name for base in cls.__mro__ for name in base.__dict__.get("__slots__", ()))
+        _slot_names[cls] = slot_names
+    return slot_names
+
+
+# Maps classes to the names of the slots defined by the class and its base classes
+_slot_names = dict()
+# Empty map from register ids to register masks, shared by instructions without implicit registers and by instructions
+# which were not analysed yet. Instructions replace register masks dictionaries, but never modify them in place.
+_no_registers_masks = dict()
+
 
 class Instruction(object):
+    # Instructions are the most numerous objects in PeachPy functions, and use slots to save memory. Subclasses which
+    # do not define __slots__, e.g. pseudo-instructions, can have extra attributes in the instance dictionary.
+    __slots__ = ("name", "origin", "operands", "_implicit_in_regs", "_implicit_out_regs", "in_regs", "out_regs",
+                 "out_operands", "encodings", "bytecode", "_gas_name", "go_name", "isa_extensions", "mmx_mode",
+                 "avx_mode", "_cancelling_inputs", "_load_available_registers", "_available_registers_masks",
+                 "_live_registers", "_indent_level")
+
     def __init__(self, name, origin=None, prototype=None):
         super(Instruction, self).__init__()
         self.name = name
 
-        self.line_number = None
-        self.source_file = None
-        self.source_code = None
-        if origin is not None:
-            self.line_number = origin[1][2]
-            self.source_file = origin[1][1]
-            self.source_code = origin[1][4][0].strip()
-        elif prototype is not None:
-            self.line_number = prototype.line_number
-            self.source_file = prototype.source_file
-            self.source_code = prototype.source_code
+        if isinstance(origin, list):
+            # A list of frame records from inspect.stack(), where the first record refers to the constructor
+            origin = Origin(origin[1][1], origin[1][2])
+        elif origin is None and prototype is not None:
+            origin = prototype.origin
+        self.origin = origin
 
         self.operands = ()
-        self._implicit_in_regs = dict()
-        self._implicit_out_regs = dict()
+        self._implicit_in_regs = _no_registers_masks
+        self._implicit_out_regs = _no_registers_masks
         self.in_regs = ()
         self.out_regs = ()
         self.out_operands = ()
@@ -35,21 +238,74 @@ class Instruction(object):
         self.mmx_mode = None
         self.avx_mode = None
         self._cancelling_inputs = False
+        self._load_available_registers = None
         if prototype is None:
-            self._available_registers = dict()
-            self._live_registers = dict()
+            self._available_registers = _no_registers_masks
+            self._live_registers = _no_registers_masks
             self._indent_level = 0
         else:
             self._available_registers = prototype._available_registers.copy()
             self._live_registers = prototype._available_registers.copy()
             self._indent_level = prototype._indent_level
 
+    def _copy(self, memo, copy_operands=True):
+        """Returns a copy of the instruction for the next processing stage of a function.
+
+        The copy shares immutable parts with the original instruction (encodings, results of register analysis, labels,
+        constants), but has its own bytecode and, optionally, its own register and memory operands.
+
+        :param dict memo: a memo dictionary for :func:`copy.deepcopy`, shared between all copied instructions.
+        :param bool copy_operands: indicates if register and memory operands should be copied. Operands need to be
+            copied if they are modified in the next processing stage, e.g. in register binding.
+        """
+        from copy import copy
+        from peachpy.x86_64.operand import copy_operand
+        instruction = copy(self)
+        if copy_operands:
+            instruction.operands = tuple(copy_operand(operand, memo) for operand in self.operands)
+        if self.bytecode is not None:
+            instruction.bytecode = bytearray(self.bytecode)
+        return instruction
+
+    def __copy__(self):
+        cls = type(self)
+        instruction = object.__new__(cls)
+        for name in _get_slot_names(cls):
+            setattr(instruction, name, getattr(self, name))
+        if hasattr(self, "__dict__"):
+            instruction.__dict__.update(self.__dict__)
+        return instruction
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in _get_slot_names(type(self)))
+        if hasattr(self, "__dict__"):
+            state.update(self.__dict__)
+        state["encodings"] = list(map(_reduce_encoding, self.encodings))
+        return state
+
+    def __setstate__(self, state):
+        for (name, value) in six.iteritems(state):
+            setattr(self, name, value)
+        self.encodings = list(map(_restore_encoding, self.encodings))
+
     def __str__(self):
         if self.operands:
             return str(self.name) + " " + ", ".join(map(str, self.operands))
         else:
             return str(self.name)
 
+    @property
+    def source_file(self):
+        return self.origin.source_file if self.origin is not None else None
+
+    @property
+    def line_number(self):
+        return self.origin.line_number if self.origin is not None else None
+
+    @property
+    def source_code(self):
+        return self.origin.source_code if self.origin is not None else None
+
     @property
     def gas_name(self):
         if self._gas_name is None:
@@ -112,6 +368,19 @@ class Instruction(object):
         from peachpy.x86_64.operand import get_operand_registers
         return sum(map(get_operand_registers, self.operands), [])
 
+    @property
+    def _available_registers(self):
+        # Liveness analysis may defer reconstruction of available registers until they are needed
+        if self._load_available_registers is not None:
+            self._available_registers_masks = self._load_available_registers()
+            self._load_available_registers = None
+        return self._available_registers_masks
+
+    @_available_registers.setter
+    def _available_registers(self, available_registers):
+        self._available_registers_masks = available_registers
+        self._load_available_registers = None
+
     @property
     def available_registers(self):
         from peachpy.x86_64.registers import Register
@@ -197,13 +466,30 @@ class Instruction(object):
                 "x86-64 instructions can not have more than 1 explicit memory operand"
             return memory_operands[0].address
 
+    @property
+    def _encoding_signature(self):
+        """Returns a hashable object that identifies encodings of the instruction, or None if it can not be cached"""
+        from peachpy.x86_64.operand import get_operand_signature
+        operand_signatures = tuple(map(get_operand_signature, self.operands))
+        if any(operand_signature is None for operand_signature in operand_signatures):
+            return None
+        return type(self), self.name, operand_signatures
+
     def encode(self):
+        signature = self._encoding_signature if encoding_cache.capacity > 0 else None
+        if signature is not None:
+            bytecode = encoding_cache.get(("encode", signature))
+            if bytecode is not None:
+                return bytearray(bytecode)
         encodings = self._filter_encodings()
         if encodings:
             bytecodes = [encoding(self.operands) for (_, encoding) in encodings]
-            return min(bytecodes, key=len)
+            bytecode = min(bytecodes, key=len)
         else:
-            return bytearray()
+            bytecode = bytearray()
+        if signature is not None:
+            encoding_cache.put(("encode", signature), bytes(bytecode))
+        return bytecode
 
     def encode_options(self):
         if self.encodings:
@@ -214,6 +500,18 @@ class Instruction(object):
             return bytearray()
 
     def encode_length_options(self):
+        signature = self._encoding_signature if encoding_cache.capacity > 0 else None
+        if signature is not None:
+            length_encoding_map = encoding_cache.get(("encode_length_options", signature))
+            if length_encoding_map is not None:
+                return {length: bytearray(bytecode) for (length, bytecode) in length_encoding_map.items()}
+        length_encoding_map = self._encode_length_options()
+        if signature is not None:
+            encoding_cache.put(("encode_length_options", signature),
+                               {length: bytes(bytecode) for (length, bytecode) in length_encoding_map.items()})
+        return length_encoding_map
+
+    def _encode_length_options(self):
         from peachpy.x86_64.encoding import Flags, Options
         length_encoding_map = {}
         encode_options = []
@@ -374,6 +672,8 @@ class Instruction(object):
 
 
 class BranchInstruction(Instruction):
+    __slots__ = ("is_conditional",)
+
     def __init__(self, name, origin=None, prototype=None):
         super(BranchInstruction, self).__init__(name, origin=origin, prototype=prototype)
         self.is_conditional = name != "JMP"
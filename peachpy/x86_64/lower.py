@@ -1,7 +1,8 @@
-from peachpy.x86_64.registers import GeneralPurposeRegister, MMXRegister, XMMRegister, YMMRegister
+from peachpy.x86_64.registers import GeneralPurposeRegister, MMXRegister, XMMRegister, YMMRegister, ZMMRegister, \
+    GeneralPurposeRegister64
 from peachpy.x86_64.generic import MOV, MOVZX, MOVSX, MOVSXD
-from peachpy.x86_64.mmxsse import MOVQ, MOVAPS, MOVAPD, MOVSS, MOVSD, MOVDQA
-from peachpy.x86_64.avx import VMOVAPS, VMOVAPD, VMOVSS, VMOVSD, VMOVDQA
+from peachpy.x86_64.mmxsse import MOVQ, MOVAPS, MOVAPD, MOVSS, MOVSD, MOVDQA, MOVUPS
+from peachpy.x86_64.avx import VMOVAPS, VMOVAPD, VMOVSS, VMOVSD, VMOVDQA, VMOVUPS
 from peachpy.x86_64.operand import dword, word, byte
 from peachpy.stream import NullStream
 from peachpy.x86_64 import m128, m128d, m128i, m256, m256d, m256i
@@ -123,3 +124,43 @@ def load_memory(dst_reg, src_address, src_type, prototype):
                         return VMOVDQA(dst_reg, [src_address], prototype=prototype)
                     else:
                         return MOVDQA(dst_reg, [src_address], prototype=prototype)
+
+
+def _spill_operands(kind, virtual_id, mask, local_variable, avx_mode):
+    if kind == GeneralPurposeRegister._kind:
+        return GeneralPurposeRegister64(virtual_id=virtual_id), local_variable
+    else:
+        assert kind == XMMRegister._kind
+        if not avx_mode:
+            # Legacy SSE instructions access only the low 16 bytes of the register
+            mask = XMMRegister._mask
+        register_class = {
+            XMMRegister._mask: XMMRegister,
+            YMMRegister._mask: YMMRegister,
+            ZMMRegister._mask: ZMMRegister
+        }[mask]
+        while local_variable.size > register_class.size:
+            local_variable = local_variable.lo
+        return register_class(virtual_id=virtual_id), local_variable
+
+
+def load_spilled_register(kind, virtual_id, mask, local_variable, avx_mode, prototype):
+    register, local_variable = _spill_operands(kind, virtual_id, mask, local_variable, avx_mode)
+    with NullStream():
+        if isinstance(register, GeneralPurposeRegister):
+            return MOV(register, local_variable, prototype=prototype)
+        elif avx_mode:
+            return VMOVUPS(register, local_variable, prototype=prototype)
+        else:
+            return MOVUPS(register, local_variable, prototype=prototype)
+
+
+def store_spilled_register(kind, virtual_id, mask, local_variable, avx_mode, prototype):
+    register, local_variable = _spill_operands(kind, virtual_id, mask, local_variable, avx_mode)
+    with NullStream():
+        if isinstance(register, GeneralPurposeRegister):
+            return MOV(local_variable, register, prototype=prototype)
+        elif avx_mode:
+            return VMOVUPS(local_variable, register, prototype=prototype)
+        else:
+            return MOVUPS(local_variable, register, prototype=prototype)
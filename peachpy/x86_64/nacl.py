@@ -1,11 +1,8 @@
 # This file is part of PeachPy package and is licensed under the Simplified BSD license.
 #    See license.rst for the full text of the license.
 
-
-import inspect
-
 import peachpy.stream
-from peachpy.x86_64.instructions import Instruction
+from peachpy.x86_64.instructions import Instruction, capture_origin
 from peachpy.x86_64.operand import check_operand, format_operand_type, is_r32, is_imm32
 
 
@@ -82,7 +79,7 @@ class NACLJMP(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(NACLJMP, self).__init__("NACLJMP", origin=origin, prototype=prototype)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) != 1:
@@ -123,7 +120,7 @@ class NACLASP(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(NACLASP, self).__init__("NACLASP", origin=origin, prototype=prototype)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) != 1:
@@ -163,7 +160,7 @@ class NACLSSP(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(NACLSSP, self).__init__("NACLSSP", origin=origin, prototype=prototype)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) != 1:
@@ -202,7 +199,7 @@ class NACLRESTSP(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(NACLRESTSP, self).__init__("NACLRESTSP", origin=origin, prototype=prototype)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) != 1:
@@ -243,7 +240,7 @@ class NACLRESTBP(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(NACLRESTBP, self).__init__("NACLRESTBP", origin=origin, prototype=prototype)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) != 1:
@@ -13,7 +13,7 @@ def check_operand(operand):
     from peachpy.util import is_int, is_int64
     from copy import copy, deepcopy
     if isinstance(operand, Register):
-        return copy(operand)
+        return copy(operand) if operand.is_virtual else operand._intern()
     elif isinstance(operand, (MaskedRegister, MemoryOperand)):
         return deepcopy(operand)
     elif isinstance(operand, (Argument, RIPRelativeOffset, Label)):
@@ -63,6 +63,188 @@ def get_operand_registers(operand):
         return list()
 
 
+def copy_operand(operand, memo):
+    """Returns a copy of the operand which can be modified without affecting the original operand.
+
+    Virtual register objects and memory addresses are copied because they are modified in register allocation and
+    address layout. Physical registers are replaced with the shared (interned) register objects. Immutable operands
+    (immediates, labels, constants, arguments) are shared with the original operand.
+
+    :param dict memo: a memo dictionary for :func:`copy.deepcopy`, which must be shared between all operands of all
+        instructions being copied to preserve identity of local variables.
+    """
+
+    from peachpy.x86_64.registers import Register, MaskedRegister, RegisterMask
+    from peachpy.x86_64.function import LocalVariable
+    from copy import copy, deepcopy
+    if isinstance(operand, Register):
+        return copy(operand) if operand.is_virtual else operand._intern()
+    elif isinstance(operand, MaskedRegister):
+        operand = copy(operand)
+        operand.register = copy_operand(operand.register, memo)
+        operand.mask = copy_operand(operand.mask, memo)
+        return operand
+    elif isinstance(operand, RegisterMask):
+        operand = copy(operand)
+        operand.mask_register = copy_operand(operand.mask_register, memo)
+        return operand
+    elif isinstance(operand, MemoryOperand):
+        operand = copy(operand)
+        operand.address = copy_operand(operand.address, memo)
+        if operand.mask is not None:
+            operand.mask = copy_operand(operand.mask, memo)
+        if isinstance(operand.symbol, LocalVariable):
+            operand.symbol = deepcopy(operand.symbol, memo)
+        return operand
+    elif isinstance(operand, MemoryAddress):
+        operand = copy(operand)
+        if operand.base is not None:
+            operand.base = copy_operand(operand.base, memo)
+        if operand.index is not None:
+            operand.index = copy_operand(operand.index, memo)
+        return operand
+    else:
+        return operand
+
+
+def get_operand_signature(operand):
+    """Returns a hashable object that uniquely identifies the encoding-relevant content of the operand.
+
+    Operands with equal signatures produce identical encodings. Returns None for operands which can not be described by
+    a signature, e.g. virtual registers or labels.
+    """
+
+    operand_type = type(operand)
+    try:
+        signature_function = _operand_signature_functions[operand_type]
+    except KeyError:
+        signature_function = _get_operand_signature_function(operand_type)
+        _operand_signature_functions[operand_type] = signature_function
+    return signature_function(operand)
+
+
+# Map from operand type to the function that computes signatures of operands of this type
+_operand_signature_functions = dict()
+
+
+def _get_operand_signature_function(operand_type):
+    from peachpy.x86_64.registers import Register, MaskedRegister, RegisterMask
+    import six
+
+    def get_register_signature(register):
+        if register.physical_id is None:
+            return None
+        return operand_type, register.physical_id, register.mask
+
+    def get_masked_register_signature(masked_register):
+        register_signature = get_operand_signature(masked_register.register)
+        mask_signature = get_operand_signature(masked_register.mask)
+        if register_signature is None or mask_signature is None:
+            return None
+        return operand_type, register_signature, mask_signature
+
+    def get_register_mask_signature(register_mask):
+        mask_register_signature = get_operand_signature(register_mask.mask_register)
+        if mask_register_signature is None:
+            return None
+        return operand_type, mask_register_signature, register_mask.is_zeroing
+
+    def get_memory_operand_signature(memory_operand):
+        address_signature = get_operand_signature(memory_operand.address)
+        if address_signature is None:
+            return None
+        mask_signature = None
+        if memory_operand.mask is not None:
+            mask_signature = get_operand_signature(memory_operand.mask)
+            if mask_signature is None:
+                return None
+        return operand_type, address_signature, memory_operand.size, mask_signature, memory_operand.broadcast
+
+    def get_memory_address_signature(memory_address):
+        base_signature = index_signature = None
+        if memory_address.base is not None:
+            base_signature = get_operand_signature(memory_address.base)
+            if base_signature is None:
+                return None
+        if memory_address.index is not None:
+            index_signature = get_operand_signature(memory_address.index)
+            if index_signature is None:
+                return None
+        return operand_type, base_signature, index_signature, memory_address.scale, memory_address.displacement
+
+    if issubclass(operand_type, Register):
+        return get_register_signature
+    elif issubclass(operand_type, MaskedRegister):
+        return get_masked_register_signature
+    elif issubclass(operand_type, RegisterMask):
+        return get_register_mask_signature
+    elif issubclass(operand_type, MemoryOperand):
+        return get_memory_operand_signature
+    elif issubclass(operand_type, MemoryAddress):
+        return get_memory_address_signature
+    elif issubclass(operand_type, RIPRelativeOffset):
+        return lambda offset: (operand_type, offset.offset)
+    elif issubclass(operand_type, RoundingControl):
+        return lambda rounding_control: (operand_type, rounding_control.name, rounding_control.code)
+    elif issubclass(operand_type, SuppressAllExceptions):
+        return lambda suppress_all_exceptions: (operand_type, suppress_all_exceptions.name)
+    elif issubclass(operand_type, six.integer_types) and not issubclass(operand_type, bool):
+        return lambda immediate: (int, int(immediate))
+    else:
+        return lambda operand: None
+
+
+def get_operand_kind(operand):
+    """Returns a hashable object that determines which instruction forms match the operand.
+
+    The results of all operand checks used to select an instruction form (e.g. is_r64, is_xmm, is_m128) are the same for
+    operands of the same kind. Thus, instruction constructors can map the kinds of operands to the matching instruction
+    form and check operands only once for every combination of operand kinds. Immediate operands are of the same kind
+    unless they can match an instruction form with an implicit immediate (1 or 3): checks of immediate size are done
+    after the form is selected.
+    """
+
+    operand_type = type(operand)
+    try:
+        kind_function = _operand_kind_functions[operand_type]
+    except KeyError:
+        kind_function = _get_operand_kind_function(operand_type)
+        _operand_kind_functions[operand_type] = kind_function
+    return kind_function(operand)
+
+
+# Map from operand type to the function that computes kinds of operands of this type
+_operand_kind_functions = dict()
+
+
+def _get_operand_kind_function(operand_type):
+    from peachpy.x86_64.registers import Register, MaskedRegister
+    from peachpy.util import is_sint8, is_sint32
+    import six
+
+    def get_memory_operand_kind(memory_operand):
+        address = memory_operand.address
+        index = getattr(address, "index", None)
+        mask = memory_operand.mask
+        return operand_type, memory_operand.size, memory_operand.broadcast, \
+            None if mask is None else mask.is_zeroing, type(address), \
+            type(index), getattr(index, "physical_id", None)
+
+    if issubclass(operand_type, Register):
+        return lambda register: (operand_type, register.physical_id, register.mask)
+    elif issubclass(operand_type, MaskedRegister):
+        return lambda masked_register: (operand_type, get_operand_kind(masked_register.register),
+                                         masked_register.mask.is_zeroing)
+    elif issubclass(operand_type, MemoryOperand):
+        return get_memory_operand_kind
+    elif issubclass(operand_type, RIPRelativeOffset):
+        return lambda offset: (operand_type, is_sint8(offset.offset), is_sint32(offset.offset))
+    elif issubclass(operand_type, six.integer_types):
+        return lambda immediate: (operand_type, immediate == 1, immediate == 3)
+    else:
+        return lambda operand: (operand_type,)
+
+
 def format_operand(operand, assembly_format):
     assert assembly_format in {"peachpy", "gas", "nasm", "go"}, \
         "Supported assembly formats are 'peachpy', 'gas', 'nasm', 'go'"
@@ -149,9 +331,11 @@ def format_operand_type(operand):
         return operand.__class__.__name__
 
 
-class MemoryAddress:
+class MemoryAddress(object):
     """An address expression involving a register, e.g. rax - 10, r8d * 4."""
 
+    __slots__ = ("base", "index", "scale", "displacement")
+
     def __init__(self, base=None, index=None, scale=None, displacement=0):
         from peachpy.x86_64.registers import GeneralPurposeRegister64, \
             XMMRegister, YMMRegister, ZMMRegister, MaskedRegister
@@ -237,7 +421,9 @@ class MemoryAddress:
         return str(self)
 
 
-class MemoryOperand:
+class MemoryOperand(object):
+    __slots__ = ("address", "symbol", "size", "mask", "broadcast")
+
     def __init__(self, address, size=None, mask=None, broadcast=None):
         from peachpy.x86_64.registers import GeneralPurposeRegister64, \
             XMMRegister, YMMRegister, ZMMRegister, MaskedRegister
@@ -416,7 +602,9 @@ class BroadcastSpecification:
         return MemoryOperand(address, self.size, broadcast=self.broadcast)
 
 
-class RIPRelativeOffset:
+class RIPRelativeOffset(object):
+    __slots__ = ("offset",)
+
     def __init__(self, offset):
         import peachpy.util
         if not peachpy.util.is_sint32(offset):
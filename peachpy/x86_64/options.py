@@ -10,6 +10,9 @@ assembly_format = "go"
 generate_assembly = None
 rtl_dump_file = None
 name_mangling = "${Name}"
+register_allocator = "greedy"
+instruction_scheduler = "none"
+peephole_rules = ()
 
 
 def get_debug_level():
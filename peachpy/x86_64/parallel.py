@@ -0,0 +1,264 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Parallel execution of loaded functions over chunks of large buffers"""
+
+import threading
+
+
+# Chunk boundaries are aligned at least on the cache line size to avoid false sharing of results between threads
+cache_line_size = 64
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_cpu_count():
+    """Returns the number of logical processors available to the current process"""
+    import os
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+
+def get_default_pool():
+    """Returns the shared thread pool with a worker thread for every logical processor available to the process"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ThreadPool()
+        return _default_pool
+
+
+class _Batch(object):
+    """Results of the tasks submitted to a thread pool in a single :meth:`ThreadPool.map` call"""
+
+    __slots__ = ("results", "pending", "exception", "lock", "done")
+
+    def __init__(self, count):
+        self.results = [None] * count
+        self.pending = count
+        self.exception = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def complete(self, index, result, exception):
+        with self.lock:
+            self.results[index] = result
+            if exception is not None and self.exception is None:
+                self.exception = exception
+            self.pending -= 1
+            if self.pending == 0:
+                self.done.set()
+
+
+def _run_worker(queue):
+    while True:
+        task = queue.get()
+        if task is None:
+            return
+        batch, index, function, item = task
+        try:
+            result = function(item)
+        except Exception as e:
+            batch.complete(index, None, e)
+        else:
+            batch.complete(index, result, None)
+
+
+class ThreadPool(object):
+    """A pool of worker threads which call loaded functions.
+
+    ctypes releases the GIL for the duration of a foreign function call, so functions called from different worker
+    threads run in parallel. Worker threads are daemon threads, and they are started on the first use of the pool.
+
+    :ivar int threads: the number of worker threads.
+    """
+
+    def __init__(self, threads=None):
+        """Creates a thread pool.
+
+        :param int threads: the number of worker threads. If not specified, the pool has a worker thread for every
+            logical processor available to the process.
+        """
+        from six.moves import queue
+        if threads is None:
+            threads = get_cpu_count()
+        if threads < 1:
+            raise ValueError("Thread pool must have at least one thread")
+        self.threads = threads
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.threads:
+                worker = threading.Thread(target=_run_worker, args=(self._queue,), name="peachpy-worker")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def map(self, function, items):
+        """Calls the function for every item on the worker threads and returns the list of results.
+
+        If any of the calls raises an exception, the exception is re-raised after all calls complete.
+        """
+        items = list(items)
+        if not items:
+            return []
+        if len(self._workers) < self.threads:
+            self._start()
+        batch = _Batch(len(items))
+        for index, item in enumerate(items):
+            self._queue.put((batch, index, function, item))
+        batch.done.wait()
+        if batch.exception is not None:
+            raise batch.exception
+        return batch.results
+
+    def close(self):
+        """Stops the worker threads after they complete the submitted tasks"""
+        with self._lock:
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_vector_width(function):
+    """Returns the size in bytes of the widest vector register used in the encoded function, or 0 if the function
+    doesn't use vector registers.
+
+    :param peachpy.x86_64.function.EncodedFunction function: the function to analyze.
+    """
+    from peachpy.x86_64.registers import MMXRegister, XMMRegister, YMMRegister, ZMMRegister, MaskedRegister
+    vector_width = 0
+    for instruction in function._instructions:
+        for operand in instruction.operands:
+            if isinstance(operand, MaskedRegister):
+                operand = operand.register
+            if isinstance(operand, (MMXRegister, XMMRegister, YMMRegister, ZMMRegister)):
+                vector_width = max(vector_width, operand.size)
+    return vector_width
+
+
+def _get_address(value, name):
+    """Returns the address passed to a function for a converted pointer argument"""
+    import ctypes
+    import six
+    if value is None or isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, ctypes.Array):
+        return ctypes.addressof(value)
+    if isinstance(value, (ctypes._Pointer, ctypes.c_void_p, ctypes.c_char_p)):
+        return ctypes.cast(value, ctypes.c_void_p).value
+    raise TypeError("Argument %s of type %s can not be split into chunks" % (name, type(value).__name__))
+
+
+def parallel_for(function, arguments, length_argument=None, chunk_size=None, pool=None):
+    """Splits the buffers passed to a loaded function into chunks and calls the function for the chunks in parallel.
+
+    The function must take the number of elements to process as an integer argument, and the buffers as typed pointer
+    arguments. Every call gets a chunk of elements with the same indices from all typed pointer arguments, and the
+    number of elements in the chunk as the length argument. Void pointer arguments and scalar arguments are passed to
+    every call unchanged.
+
+    Chunk boundaries are aligned on the larger of the cache line size and the width of vector registers used in the
+    function, relative to the start of every buffer, so chunks keep the alignment of the buffers, vector loops
+    process all but the last chunk without remainder, and threads don't write to the same cache lines.
+
+    :param peachpy.x86_64.function.ExecutableFuntion function: the loaded function to call.
+    :param tuple arguments: the arguments of the function. The length argument is the total number of elements.
+        Pointer arguments are converted as in a regular call, and buffers must have at least as many items as the
+        total number of elements.
+    :param str length_argument: the name of the length argument. If not specified, the function must have a single
+        size_t argument, or a single integer argument.
+    :param int chunk_size: the number of elements in a chunk. It is rounded up to keep chunk boundaries aligned. If not
+        specified, the elements are split into about four chunks per thread for load balancing.
+    :param ThreadPool pool: the thread pool to run the calls on. If not specified, the shared default pool is used.
+    :returns: the list of results of the calls for every chunk in the order of chunks, or None if the function doesn't
+        return a value.
+    """
+    from peachpy.util import roundup
+    encoded_function = function._encoded_function
+    function_arguments = encoded_function.arguments
+    if len(arguments) != len(function_arguments):
+        raise TypeError("Function takes %d arguments (%d given)" % (len(function_arguments), len(arguments)))
+
+    if length_argument is not None:
+        length_indices = [i for i, argument in enumerate(function_arguments) if argument.name == length_argument]
+        if not length_indices:
+            raise ValueError("Function has no argument %s" % length_argument)
+    else:
+        length_indices = [i for i, argument in enumerate(function_arguments)
+                          if argument.is_size_integer and not argument.is_pointer]
+        if len(length_indices) != 1:
+            length_indices = [i for i, argument in enumerate(function_arguments) if argument.is_integer]
+        if len(length_indices) != 1:
+            raise ValueError("Function %s has no unique length argument, length_argument must be specified" %
+                             encoded_function.name)
+    length_index = length_indices[0]
+    if not function_arguments[length_index].is_integer:
+        raise ValueError("Length argument %s must be an integer" % function_arguments[length_index].name)
+    length = arguments[length_index]
+    if length < 0:
+        raise ValueError("Length argument %s must be non-negative" % function_arguments[length_index].name)
+
+    buffers = []
+    try:
+        # Typed pointer arguments are split into chunks: their base addresses and the sizes of their elements
+        call_arguments = list(arguments)
+        split_arguments = []
+        for index, (argument, converter, value) in \
+                enumerate(zip(function_arguments, function.argument_converters, arguments)):
+            if converter is None:
+                continue
+            buffer_count = len(buffers)
+            call_arguments[index] = address = _get_address(converter(value, buffers), argument.name)
+            if converter.item_size is None or address is None:
+                continue
+            if len(buffers) != buffer_count and buffers[-1].size < length * converter.item_size:
+                raise ValueError("Argument %s has %d elements, %d needed" %
+                                 (argument.name, buffers[-1].size // converter.item_size, length))
+            split_arguments.append((index, address, converter.item_size))
+
+        # Element sizes of C types are powers of two, and so is the alignment
+        alignment = max(cache_line_size, get_vector_width(encoded_function))
+        granularity = max([alignment // min(alignment, item_size) for _, _, item_size in split_arguments] + [1])
+        if pool is None:
+            pool = get_default_pool()
+        if chunk_size is None:
+            chunk_count = 4 * pool.threads
+            chunk_size = (length + chunk_count - 1) // chunk_count
+        chunk_size = roundup(max(chunk_size, 1), granularity)
+
+        function_pointer = function.function_pointer
+
+        def call_chunk(chunk_start):
+            chunk_arguments = list(call_arguments)
+            for index, address, item_size in split_arguments:
+                chunk_arguments[index] = address + chunk_start * item_size
+            chunk_arguments[length_index] = min(chunk_size, length - chunk_start)
+            return function_pointer(*chunk_arguments)
+
+        chunk_starts = range(0, length, chunk_size)
+        if len(chunk_starts) <= 1:
+            # A single chunk is processed on the calling thread
+            results = [call_chunk(0)]
+        else:
+            results = pool.map(call_chunk, chunk_starts)
+    finally:
+        for buffer in buffers:
+            buffer.release()
+    if encoded_function.result_type is None:
+        return None
+    return results
@@ -0,0 +1,273 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Peephole optimization of functions after register allocation.
+
+After virtual registers are bound to physical registers and pseudo-instructions are lowered, the instruction stream
+often contains moves of a register to itself, moves which copy a value back to the register it was copied from, and
+similar redundancies. The peephole optimizer scans the instruction stream with a list of rules. Every rule looks at the
+instructions at the current position and either leaves them intact or replaces them with a shorter or cheaper sequence.
+The optimizer counts how many times every rule was applied.
+
+Custom rules subclass :class:`PeepholeRule` and override :meth:`PeepholeRule.rewrite`.
+"""
+
+import collections
+
+from peachpy.util import is_int, is_sint32
+
+
+class PeepholeRule(object):
+    """A rule which rewrites a short sequence of instructions.
+
+    :ivar str name: the name of the rule in the statistics of rule hits.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return str(self)
+
+    def rewrite(self, instructions, position, optimizer):
+        """Checks if the rule applies to instructions at the specified position and computes the replacement.
+
+        :param list instructions: the list of instructions of the function.
+        :param int position: the position of the first instruction to rewrite.
+        :param PeepholeOptimizer optimizer: the optimizer which applies the rule. Rules can use it to query properties
+            of the function, such as liveness of arithmetic flags.
+        :returns: None if the rule does not apply, or a tuple of the number of instructions to replace and the list
+            of replacement instructions.
+        """
+        raise NotImplementedError()
+
+
+# Moves which copy the full register
+_full_moves = frozenset(["MOVAPS", "MOVAPD", "MOVUPS", "MOVUPD", "MOVDQA", "MOVDQU"])
+_vex_full_moves = frozenset(["VMOVAPS", "VMOVAPD", "VMOVUPS", "VMOVUPD", "VMOVDQA", "VMOVDQU", "VMOVDQA32",
+                             "VMOVDQA64", "VMOVDQU8", "VMOVDQU16", "VMOVDQU32", "VMOVDQU64"])
+# Instructions which overwrite all arithmetic flags (or leave them undefined) without reading them
+_flags_killers = frozenset(["ADD", "SUB", "AND", "OR", "XOR", "CMP", "TEST", "NEG", "IMUL", "ANDN", "POPCNT", "LZCNT",
+                            "TZCNT", "BSF", "BSR", "COMISS", "COMISD", "UCOMISS", "UCOMISD", "VCOMISS", "VCOMISD",
+                            "VUCOMISS", "VUCOMISD", "PTEST", "VPTEST"])
+# Instruction classes which may read arithmetic flags
+_flags_readers = frozenset(["adc", "cmov", "setcc", "branch", "jmp"])
+
+
+def _is_noop_move(instruction, destination, source, vector_size):
+    """Checks if the instruction, applied to the destination and source registers with the same value, is a no-op"""
+    from peachpy.x86_64.registers import Register, GeneralPurposeRegister32, MMXRegister, XMMRegister
+
+    if not isinstance(destination, Register) or not isinstance(source, Register) or destination != source:
+        return False
+    if instruction.name == "MOV":
+        # Moves to 32-bit registers clear the high 32 bits of the 64-bit register
+        return not isinstance(destination, GeneralPurposeRegister32)
+    elif instruction.name == "MOVQ":
+        # Moves of XMM registers clear the high 64 bits
+        return isinstance(destination, MMXRegister)
+    elif instruction.name in _full_moves:
+        return isinstance(destination, XMMRegister)
+    elif instruction.name in _vex_full_moves:
+        # VEX and EVEX moves clear the bits above the destination register, which matters only if the function uses
+        # the wider registers
+        return destination.size >= vector_size
+    return False
+
+
+def _get_vector_size(instructions):
+    """Returns the size in bytes of the widest vector register used in the instructions"""
+    from peachpy.x86_64.registers import XMMRegister, YMMRegister, ZMMRegister, MaskedRegister
+
+    vector_size = 0
+    for instruction in instructions:
+        for operand in instruction.operands:
+            if isinstance(operand, MaskedRegister):
+                operand = operand.register
+            if isinstance(operand, (XMMRegister, YMMRegister, ZMMRegister)):
+                vector_size = max(vector_size, operand.size)
+    return vector_size
+
+
+class SelfMoveRule(PeepholeRule):
+    """Removes moves of a register to itself, e.g. MOV rax, rax or MOVAPS xmm1, xmm1"""
+
+    def __init__(self):
+        super(SelfMoveRule, self).__init__("self-move")
+
+    def rewrite(self, instructions, position, optimizer):
+        instruction = instructions[position]
+        if len(instruction.operands) == 2 and \
+                _is_noop_move(instruction, instruction.operands[0], instruction.operands[1], optimizer.vector_size):
+            return 1, []
+
+
+class RoundTripMoveRule(PeepholeRule):
+    """Removes the second move in MOV rax, rcx + MOV rcx, rax: after the first move both registers hold the same
+    value"""
+
+    def __init__(self):
+        super(RoundTripMoveRule, self).__init__("round-trip-move")
+
+    def rewrite(self, instructions, position, optimizer):
+        if position + 1 >= len(instructions):
+            return None
+        first, second = instructions[position], instructions[position + 1]
+        if first.name == second.name and len(first.operands) == 2 and len(second.operands) == 2 and \
+                first.operands[0] == second.operands[1] and first.operands[1] == second.operands[0] and \
+                _is_noop_move(second, second.operands[0], first.operands[1], optimizer.vector_size):
+            return 2, [first]
+
+
+class ZeroMoveRule(PeepholeRule):
+    """Replaces MOV reg, 0 with shorter XOR reg, reg if arithmetic flags are not used afterwards"""
+
+    def __init__(self):
+        super(ZeroMoveRule, self).__init__("zero-move")
+
+    def rewrite(self, instructions, position, optimizer):
+        from peachpy.x86_64.registers import GeneralPurposeRegister32, GeneralPurposeRegister64
+        from peachpy.x86_64.generic import XOR
+        from peachpy.stream import NullStream
+
+        instruction = instructions[position]
+        if instruction.name == "MOV" and len(instruction.operands) == 2 and \
+                isinstance(instruction.operands[0], (GeneralPurposeRegister32, GeneralPurposeRegister64)) and \
+                is_int(instruction.operands[1]) and instruction.operands[1] == 0 and \
+                optimizer.are_flags_dead(instructions, position + 1):
+            register = instruction.operands[0].as_dword
+            with NullStream():
+                return 1, [XOR(register, register, prototype=instruction)]
+
+
+class StackAdjustmentRule(PeepholeRule):
+    """Merges adjacent ADD rsp, imm and SUB rsp, imm instructions if arithmetic flags are not used afterwards"""
+
+    def __init__(self):
+        super(StackAdjustmentRule, self).__init__("stack-adjustment")
+
+    @staticmethod
+    def _get_adjustment(instruction):
+        from peachpy.x86_64.registers import rsp
+        if instruction.name in {"ADD", "SUB"} and len(instruction.operands) == 2 and \
+                instruction.operands[0] == rsp and is_int(instruction.operands[1]):
+            return int(instruction.operands[1]) if instruction.name == "ADD" else -int(instruction.operands[1])
+
+    def rewrite(self, instructions, position, optimizer):
+        from peachpy.x86_64.registers import rsp
+        from peachpy.x86_64.generic import ADD, SUB
+        from peachpy.stream import NullStream
+
+        if position + 1 >= len(instructions):
+            return None
+        first_adjustment = StackAdjustmentRule._get_adjustment(instructions[position])
+        second_adjustment = StackAdjustmentRule._get_adjustment(instructions[position + 1])
+        if first_adjustment is None or second_adjustment is None:
+            return None
+        adjustment = first_adjustment + second_adjustment
+        if not is_sint32(adjustment) or not is_sint32(-adjustment) or \
+                not optimizer.are_flags_dead(instructions, position + 2):
+            return None
+        if adjustment == 0:
+            return 2, []
+        with NullStream():
+            if adjustment > 0:
+                return 2, [ADD(rsp, adjustment, prototype=instructions[position])]
+            else:
+                return 2, [SUB(rsp, -adjustment, prototype=instructions[position])]
+
+
+class DeadComparisonRule(PeepholeRule):
+    """Removes CMP and TEST instructions on registers if the arithmetic flags they compute are not used"""
+
+    def __init__(self):
+        super(DeadComparisonRule, self).__init__("dead-flags")
+
+    def rewrite(self, instructions, position, optimizer):
+        from peachpy.x86_64.registers import Register
+
+        instruction = instructions[position]
+        if instruction.name in {"CMP", "TEST"} and \
+                all(isinstance(operand, Register) or is_int(operand) for operand in instruction.operands) and \
+                optimizer.are_flags_dead(instructions, position + 1):
+            return 1, []
+
+
+# Rules which only remove moves without side effects. They are always applied to the copies produced by register
+# allocation and lowering of pseudo-instructions.
+cleanup_rules = (SelfMoveRule(), RoundTripMoveRule())
+# Rules which are applied to all instructions only if peephole optimization is enabled (-fpeephole)
+optional_rules = (ZeroMoveRule(), StackAdjustmentRule(), DeadComparisonRule())
+default_rules = cleanup_rules + optional_rules
+
+
+class PeepholeOptimizer(object):
+    """Applies peephole rules to the instructions of a function until none of the rules applies.
+
+    :ivar tuple rules: the list of :class:`PeepholeRule` objects. At every position the rules are tried in this order.
+    :ivar collections.OrderedDict hits: a map from rule name to the number of times the rule was applied.
+    :ivar int vector_size: the size in bytes of the widest vector register used in the function.
+    """
+
+    def __init__(self, rules=None):
+        """
+        :param tuple rules: the list of :class:`PeepholeRule` objects to apply. If not specified, the default rules are
+            applied: removal of self-moves, round-trip moves, and dead comparisons, replacement of zero moves with XOR,
+            and merging of stack pointer adjustments.
+        """
+        if rules is None:
+            rules = default_rules
+        self.rules = tuple(rules)
+        self.hits = collections.OrderedDict((rule.name, 0) for rule in self.rules)
+        self.vector_size = 0
+
+    def are_flags_dead(self, instructions, position):
+        """Checks that the arithmetic flags are overwritten or discarded before they are read by any instruction
+        starting with the specified position.
+
+        The check is conservative: branches, labels, and instructions unknown to the optimizer are assumed to read the
+        flags.
+        """
+        from peachpy.x86_64.performance import get_instruction_class
+
+        for instruction in instructions[position:]:
+            if instruction.name in _flags_killers or instruction.name == "RET":
+                return True
+            instruction_class = get_instruction_class(instruction)
+            if instruction_class is None or instruction_class in _flags_readers:
+                return False
+        return True
+
+    def optimize(self, instructions, rewritable=None):
+        """Returns a new list of instructions with all rules applied.
+
+        :param list instructions: the list of :class:`peachpy.x86_64.instructions.Instruction` objects with physical
+            registers.
+        :param rewritable: an optional predicate which restricts the instructions the rules may remove or replace.
+            If specified, a rule is applied only if every instruction it rewrites either satisfies the predicate or is
+            kept in the replacement.
+        """
+        self.vector_size = _get_vector_size(instructions)
+        instructions = list(instructions)
+        position = 0
+        while position < len(instructions):
+            for rule in self.rules:
+                replacement = rule.rewrite(instructions, position, self)
+                if replacement is not None:
+                    count, replacement_instructions = replacement
+                    if rewritable is not None and \
+                            not all(rewritable(instruction) or
+                                    any(instruction is kept for kept in replacement_instructions)
+                                    for instruction in instructions[position:position + count]):
+                        continue
+                    instructions[position:position + count] = replacement_instructions
+                    self.hits[rule.name] += 1
+                    # The replacement can enable rules on the preceding instruction, e.g. merging of stack adjustments
+                    position = max(position - 1, 0)
+                    break
+            else:
+                position += 1
+        return instructions
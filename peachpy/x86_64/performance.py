@@ -0,0 +1,707 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Static performance models of x86-64 microarchitectures and throughput analysis of loops.
+
+Performance models describe instructions by classes of similar instructions (e.g. floating-point additions, shuffles,
+integer multiplications). For every class a model specifies the latency and the execution ports of its micro-operations.
+The numbers follow public measurements of the microarchitectures (Agner Fog's instruction tables, uops.info), but they
+are approximate: a class covers instructions with slightly different characteristics, and effects of memory
+dependencies, cache misses, branch mispredictions and partial register stalls are not modelled.
+"""
+
+import re
+from collections import namedtuple
+
+
+class InstructionTiming(namedtuple("InstructionTiming", ["latency", "load_latency", "uops", "fused_uops"])):
+    """Timing characteristics of an instruction on a microarchitecture.
+
+    :ivar int latency: the number of cycles from the time input registers are ready to the time output registers are
+        ready. Doesn't include the latency of loading a memory operand.
+    :ivar int load_latency: the latency of loading the memory operand, or 0 if the instruction doesn't load from memory.
+    :ivar tuple uops: micro-operations of the instruction as pairs of the set of execution ports which can execute the
+        micro-operation, and the number of cycles the micro-operation occupies the port.
+    :ivar int fused_uops: the number of micro-operations in the fused domain, i.e. issued by the front-end.
+    """
+
+
+# Mnemonics of instruction classes. AVX and AVX-512 versions of SSE instructions are classified as SSE instructions.
+_instruction_classes = {
+    "mov": "MOV MOVZX MOVSX MOVSXD MOVBE XCHG",
+    "alu": "ADD SUB AND OR XOR CMP TEST INC DEC NEG NOT ANDN BLSI BLSR BLSMSK BZHI",
+    "adc": "ADC SBB",
+    "shift": "SHL SHR SAR SAL ROL ROR SHLX SHRX SARX RORX BT BTS BTR BTC SHLD SHRD",
+    "lea": "LEA",
+    "imul": "IMUL",
+    "mul": "MUL MULX",
+    "div": "DIV IDIV",
+    "bitcount": "POPCNT LZCNT TZCNT BSF BSR PDEP PEXT",
+    "nop": "NOP VZEROUPPER VZEROALL PAUSE LFENCE",
+    "prefetch": "PREFETCHNTA PREFETCHT0 PREFETCHT1 PREFETCHT2 PREFETCHW PREFETCH",
+    "vmov": "MOVAPS MOVUPS MOVAPD MOVUPD MOVDQA MOVDQU MOVSS MOVSD LDDQU MOVNTPS MOVNTPD MOVNTDQ MOVNTDQA "
+            "VMOVDQA32 VMOVDQA64 VMOVDQU8 VMOVDQU16 VMOVDQU32 VMOVDQU64 MOVQ2DQ MOVDQ2Q",
+    "vmovd": "MOVD MOVQ",
+    "vmovmsk": "MOVMSKPS MOVMSKPD PMOVMSKB",
+    "vlogic": "ANDPS ANDPD ANDNPS ANDNPD ORPS ORPD XORPS XORPD PAND PANDN POR PXOR "
+              "VPANDD VPANDQ VPANDND VPANDNQ VPORD VPORQ VPXORD VPXORQ VPTERNLOGD VPTERNLOGQ",
+    "vint": "PADDB PADDW PADDD PADDQ PSUBB PSUBW PSUBD PSUBQ PADDSB PADDSW PADDUSB PADDUSW PSUBSB PSUBSW PSUBUSB "
+            "PSUBUSW PCMPEQB PCMPEQW PCMPEQD PCMPEQQ PCMPGTB PCMPGTW PCMPGTD PMAXSB PMAXSW PMAXSD PMAXUB PMAXUW "
+            "PMAXUD PMINSB PMINSW PMINSD PMINUB PMINUW PMINUD PAVGB PAVGW PABSB PABSW PABSD PSIGNB PSIGNW PSIGND",
+    "vint_mul": "PMULLW PMULHW PMULHUW PMULHRSW PMULUDQ PMULDQ PMADDWD PMADDUBSW PSADBW PCMPGTQ",
+    "vint_mul_long": "PMULLD PMULLQ",
+    "vshift": "PSLLW PSLLD PSLLQ PSRLW PSRLD PSRLQ PSRAW PSRAD PSRAQ",
+    "vshift_variable": "VPSLLVD VPSLLVQ VPSRLVD VPSRLVQ VPSRAVD VPSRAVQ",
+    "vshuffle": "SHUFPS SHUFPD UNPCKLPS UNPCKHPS UNPCKLPD UNPCKHPD PUNPCKLBW PUNPCKLWD PUNPCKLDQ PUNPCKLQDQ "
+                "PUNPCKHBW PUNPCKHWD PUNPCKHDQ PUNPCKHQDQ PSHUFB PSHUFD PSHUFLW PSHUFHW PALIGNR PACKSSWB PACKSSDW "
+                "PACKUSWB PACKUSDW MOVHLPS MOVLHPS MOVSHDUP MOVSLDUP MOVDDUP PSLLDQ PSRLDQ INSERTPS EXTRACTPS "
+                "PINSRB PINSRW PINSRD PINSRQ PEXTRB PEXTRW PEXTRD PEXTRQ PMOVZXBW PMOVZXBD PMOVZXBQ PMOVZXWD "
+                "PMOVZXWQ PMOVZXDQ PMOVSXBW PMOVSXBD PMOVSXBQ PMOVSXWD PMOVSXWQ PMOVSXDQ VPERMILPS VPERMILPD",
+    "vshuffle_lane": "VPERM2F128 VPERM2I128 VPERMPS VPERMD VPERMPD VPERMQ VINSERTF128 VINSERTI128 VEXTRACTF128 "
+                     "VEXTRACTI128 VINSERTF32X4 VINSERTF64X4 VINSERTI32X4 VINSERTI64X4 VEXTRACTF32X4 VEXTRACTF64X4 "
+                     "VEXTRACTI32X4 VEXTRACTI64X4 VSHUFF32X4 VSHUFF64X2 VSHUFI32X4 VSHUFI64X2 VPERMI2D VPERMI2Q "
+                     "VPERMI2PS VPERMI2PD VPERMT2D VPERMT2Q VPERMT2PS VPERMT2PD",
+    "vbroadcast": "VBROADCASTSS VBROADCASTSD VBROADCASTF128 VBROADCASTI128 VPBROADCASTB VPBROADCASTW VPBROADCASTD "
+                  "VPBROADCASTQ",
+    "vblend": "BLENDPS BLENDPD PBLENDW VPBLENDD VBLENDMPS VBLENDMPD VPBLENDMD VPBLENDMQ",
+    "vblendv": "BLENDVPS BLENDVPD PBLENDVB",
+    "fadd": "ADDPS ADDPD ADDSS ADDSD SUBPS SUBPD SUBSS SUBSD ADDSUBPS ADDSUBPD MINPS MINPD MINSS MINSD MAXPS MAXPD "
+            "MAXSS MAXSD CMPPS CMPPD CMPSS CMPSD",
+    "fmul": "MULPS MULPD MULSS MULSD",
+    "fdiv_single": "DIVPS DIVSS",
+    "fdiv_double": "DIVPD DIVSD",
+    "fsqrt_single": "SQRTPS SQRTSS",
+    "fsqrt_double": "SQRTPD SQRTSD",
+    "frcp": "RCPPS RCPSS RSQRTPS RSQRTSS VRCP14PS VRCP14PD VRSQRT14PS VRSQRT14PD",
+    "fhadd": "HADDPS HADDPD HSUBPS HSUBPD PHADDW PHADDD PHADDSW PHSUBW PHSUBD PHSUBSW DPPS DPPD",
+    "vcvt": "CVTDQ2PS CVTPS2DQ CVTTPS2DQ",
+    "vcvt_width": "CVTPS2PD CVTPD2PS CVTDQ2PD CVTPD2DQ CVTTPD2DQ CVTPH2PS CVTPS2PH CVTSI2SS CVTSI2SD CVTSS2SD "
+                  "CVTSD2SS CVTSS2SI CVTSD2SI CVTTSS2SI CVTTSD2SI",
+    "vround": "ROUNDPS ROUNDPD ROUNDSS ROUNDSD",
+    "vtest": "PTEST VTESTPS VTESTPD COMISS COMISD UCOMISS UCOMISD",
+}
+
+# Classes of instructions which only copy data. If they have a memory operand, they are pure loads or stores.
+_move_classes = frozenset(["mov", "vmov", "vmovd", "vbroadcast"])
+# Classes of instructions which write arithmetic flags
+_flags_output_classes = frozenset(["alu", "adc", "shift", "imul", "mul", "div", "bitcount", "vtest"])
+# Pseudo-instructions which don't generate code
+_pseudo_instructions = frozenset(["LABEL", "ALIGN", "IACA.START", "IACA.END"])
+# Register masks of register kinds. Registers of different kinds have the same ids, and register masks dictionaries
+# combine masks of registers with the same id.
+_register_kind_masks = (0xF, 0x10, 0x40, 0x700)
+# Key of arithmetic flags in dependency analysis
+_flags_register = "flags"
+_fma_mnemonic = re.compile(r"^VF(N?)M(ADD|SUB|ADDSUB|SUBADD)(132|213|231)?(PS|PD|SS|SD)$")
+_port_group = re.compile(r"^([a-z]+)(\d*)$")
+
+_instruction_class_map = None
+
+
+def get_instruction_class(instruction):
+    """Returns the name of the class of the instruction in performance models, or None for unknown instructions.
+
+    :param peachpy.x86_64.instructions.Instruction instruction: the instruction to classify.
+    """
+    global _instruction_class_map
+    if _instruction_class_map is None:
+        _instruction_class_map = dict((mnemonic, instruction_class)
+                                      for instruction_class, mnemonics in _instruction_classes.items()
+                                      for mnemonic in mnemonics.split())
+    from peachpy.x86_64.instructions import BranchInstruction
+    name = instruction.name
+    if isinstance(instruction, BranchInstruction):
+        return "branch" if instruction.is_conditional else "jmp"
+    if name.startswith("CMOV"):
+        return "cmov"
+    if name.startswith("SET"):
+        return "setcc"
+    if name in {"RET", "CALL"}:
+        return "jmp"
+    instruction_class = _instruction_class_map.get(name)
+    if instruction_class is None and name.startswith("V"):
+        instruction_class = _instruction_class_map.get(name[1:])
+    if instruction_class is None and _fma_mnemonic.match(name):
+        instruction_class = "fma"
+    return instruction_class
+
+
+def _parse_uops(specification):
+    """Parses micro-operations in a "p0156 2*p5 p0:7" notation.
+
+    A micro-operation is a group of ports: a port prefix followed by port numbers, e.g. "p015" for ports p0, p1 and p5,
+    or a single port name. A multiplier before the group repeats the micro-operation, and the number of cycles after the
+    group specifies how long a non-pipelined micro-operation occupies the port.
+    """
+    uops = []
+    for token in specification.split():
+        count, _, token = token.rpartition("*")
+        token, _, cycles = token.partition(":")
+        prefix, numbers = _port_group.match(token).groups()
+        ports = frozenset(prefix + number for number in numbers) if numbers else frozenset([prefix])
+        uops += [(ports, int(cycles or 1))] * int(count or 1)
+    return tuple(uops)
+
+
+class PerformanceModel(object):
+    """Static performance model of an x86-64 microarchitecture.
+
+    :ivar str name: the name of the microarchitecture.
+    :ivar int issue_width: the number of fused micro-operations the front-end can issue per cycle.
+    :ivar frozenset ports: the names of all execution ports.
+    """
+
+    def __init__(self, name, issue_width, timings, load, store, vector_load_latency,
+                 macro_fusion=(), wide_ports=None, split_width=None):
+        """Creates a performance model.
+
+        :param str name: the name of the microarchitecture.
+        :param int issue_width: the number of fused micro-operations the front-end can issue per cycle.
+        :param dict timings: a map from instruction class names to tuples of latency and micro-operations. A class
+            name can have a suffix with the vector width in bits, e.g. "fdiv_single.256", to override the timing of
+            instructions with such vector width.
+        :param tuple load: latency and micro-operations of loads into general-purpose registers.
+        :param str store: micro-operations of stores.
+        :param int vector_load_latency: latency of loads into vector registers.
+        :param tuple macro_fusion: mnemonics of instructions which are fused with the following conditional branch.
+        :param dict wide_ports: replacements of port groups for 512-bit instructions.
+        :param int split_width: the width of vector execution units in bits. Wider instructions are split into multiple
+            micro-operations.
+        """
+        self.name = name
+        self.issue_width = issue_width
+        self._timings = dict((instruction_class, (latency, _parse_uops(uops)))
+                             for instruction_class, (latency, uops) in timings.items())
+        self._load_latency, self._load_uops = load[0], _parse_uops(load[1])
+        self._store_uops = _parse_uops(store)
+        self._vector_load_latency = vector_load_latency
+        self._macro_fusion = frozenset(macro_fusion)
+        self._wide_ports = dict((frozenset(_parse_uops(old_ports)[0][0]), frozenset(_parse_uops(new_ports)[0][0]))
+                                for old_ports, new_ports in (wide_ports or {}).items())
+        self._split_width = split_width
+        self.ports = frozenset(port for _, uops in self._timings.values() for ports, _ in uops for port in ports) | \
+            frozenset(port for ports, _ in self._load_uops + self._store_uops for port in ports)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return str(self)
+
+    def can_fuse(self, instruction, branch):
+        """Checks if the instruction is macro-fused with the following conditional branch"""
+        from peachpy.x86_64.operand import MemoryOperand, is_imm
+        if instruction.name not in self._macro_fusion or not branch.is_conditional:
+            return False
+        # Instructions with both memory and immediate operands are not fused
+        return not (any(isinstance(operand, MemoryOperand) for operand in instruction.operands) and
+                    any(is_imm(operand) for operand in instruction.operands))
+
+    def get_timing(self, instruction):
+        """Returns the timing of the instruction, or None if the instruction is not covered by the model.
+
+        :param peachpy.x86_64.instructions.Instruction instruction: the instruction to analyze.
+        :rtype: InstructionTiming
+        """
+        from peachpy.x86_64.operand import MemoryOperand
+        from peachpy.x86_64.registers import MMXRegister, XMMRegister, YMMRegister, ZMMRegister, MaskedRegister
+
+        instruction_class = get_instruction_class(instruction)
+        if instruction_class is None:
+            return None
+
+        # Vector width of the instruction, in bits
+        width = 0
+        for operand in instruction.operands:
+            if isinstance(operand, MaskedRegister):
+                operand = operand.register
+            if isinstance(operand, (MMXRegister, XMMRegister, YMMRegister, ZMMRegister)):
+                width = max(width, operand.size * 8)
+        latency, uops = self._timings.get("%s.%d" % (instruction_class, width), self._timings[instruction_class])
+        if width == 512 and self._wide_ports:
+            uops = tuple((self._wide_ports.get(ports, ports), cycles) for ports, cycles in uops)
+        copies = 1
+        if self._split_width is not None and width > self._split_width:
+            copies = width // self._split_width
+
+        is_load, is_store = False, False
+        for operand, is_output in zip(instruction.operands, instruction.out_operands):
+            if isinstance(operand, MemoryOperand):
+                is_store = is_output
+                is_load = not is_output or instruction_class not in _move_classes
+        if instruction_class == "prefetch":
+            is_load = True
+
+        load_latency = 0
+        if instruction_class in _move_classes and (is_load or is_store):
+            # Pure loads and stores don't use execution units
+            latency, uops = 0, ()
+        fused_uops = max(len(uops), 1) * copies
+        uops = uops * copies
+        if is_load:
+            load_latency = self._vector_load_latency if width != 0 else self._load_latency
+            uops += self._load_uops * copies
+        if is_store:
+            uops += self._store_uops * copies
+        return InstructionTiming(latency, load_latency, uops, fused_uops)
+
+
+class LoopAnalysis(object):
+    """Results of static throughput analysis of a loop.
+
+    The analysis assumes that all data is in L1 cache, branches are predicted correctly, and every iteration starts
+    when the front-end and execution ports are available and the loop-carried dependencies are resolved.
+
+    :ivar str name: the name of the loop label.
+    :ivar PerformanceModel model: the performance model used in the analysis.
+    :ivar list instructions: instructions in the loop body.
+    :ivar list timings: timing of every instruction, or None for instructions not covered by the model.
+    :ivar float cycles: the estimated number of cycles per iteration, the maximum of the port, front-end, and latency
+        bounds.
+    :ivar str bottleneck: the limiting bound, one of "ports", "front-end", or "latency".
+    :ivar float port_cycles: the number of cycles per iteration needed to execute all micro-operations on the execution
+        ports, with the optimal distribution of micro-operations.
+    :ivar tuple bottleneck_ports: the sorted names of the execution ports which limit the port bound.
+    :ivar dict port_pressure: a map from port names to the cycles used on the port per iteration in a balanced
+        distribution of micro-operations.
+    :ivar float frontend_cycles: the number of cycles per iteration needed to issue all fused micro-operations.
+    :ivar float latency_cycles: the number of cycles per iteration on the longest loop-carried dependency chain.
+    :ivar int critical_path_latency: the latency of the longest dependency chain in a single iteration.
+    :ivar list unknown_instructions: instructions not covered by the model. They are excluded from the analysis.
+    """
+
+    # Number of simulated iterations in the analysis of loop-carried dependencies
+    _iterations = 16
+
+    def __init__(self, name, model, instructions):
+        self.name = name
+        self.model = model
+        self.instructions = instructions
+        self.timings = [model.get_timing(instruction) for instruction in instructions]
+        self.unknown_instructions = [instruction for instruction, timing in zip(instructions, self.timings)
+                                     if timing is None]
+
+        # Macro-fused instruction and branch pairs issue and execute as a single branch micro-operation
+        for index in range(1, len(instructions)):
+            previous_timing, timing = self.timings[index - 1], self.timings[index]
+            if previous_timing is not None and timing is not None and \
+                    get_instruction_class(instructions[index]) == "branch" and \
+                    model.can_fuse(instructions[index - 1], instructions[index]):
+                # Keep only the load and store micro-operations, which follow the compute micro-operations
+                self.timings[index - 1] = previous_timing._replace(
+                    uops=previous_timing.uops[previous_timing.fused_uops:], fused_uops=0)
+
+        self._analyze_ports()
+        self.frontend_cycles = float(sum(timing.fused_uops for timing in self.timings if timing is not None)) / \
+            model.issue_width
+        self._analyze_dependencies()
+
+        self.cycles = max(self.port_cycles, self.frontend_cycles, self.latency_cycles)
+        if self.cycles == self.latency_cycles and self.latency_cycles > max(self.port_cycles, self.frontend_cycles):
+            self.bottleneck = "latency"
+        elif self.cycles == self.frontend_cycles and self.frontend_cycles > self.port_cycles:
+            self.bottleneck = "front-end"
+        else:
+            self.bottleneck = "ports"
+
+    def _analyze_ports(self):
+        # Total cycles of micro-operations by the sets of ports which can execute them
+        port_set_cycles = dict()
+        for timing in self.timings:
+            if timing is not None:
+                for ports, cycles in timing.uops:
+                    port_set_cycles[ports] = port_set_cycles.get(ports, 0) + cycles
+
+        # The optimal distribution of micro-operations is limited by the most loaded union of port sets:
+        # micro-operations which can execute only on ports from the union must share these ports. A union of port sets
+        # which do not overlap is never more loaded than its most loaded part, so only the unions of overlapping port
+        # sets are considered. Every such union is built by adding overlapping port sets one at a time.
+        unions = set(port_set_cycles)
+        queue = list(unions)
+        while queue:
+            union = queue.pop()
+            for ports in port_set_cycles:
+                if union & ports and not ports <= union:
+                    extended_union = union | ports
+                    if extended_union not in unions:
+                        unions.add(extended_union)
+                        queue.append(extended_union)
+        self.port_cycles = 0.0
+        self.bottleneck_ports = ()
+        for union in sorted(unions, key=lambda union: (len(union), sorted(union))):
+            union_cycles = float(sum(cycles for ports, cycles in port_set_cycles.items() if ports <= union))
+            union_cycles /= len(union)
+            if union_cycles > self.port_cycles:
+                self.port_cycles = union_cycles
+                self.bottleneck_ports = tuple(sorted(union))
+
+        # Balanced distribution: micro-operations with fewer port options are distributed first, and every group of
+        # micro-operations fills its least loaded ports to an equal level
+        self.port_pressure = dict((port, 0.0) for port in self.model.ports)
+        for ports, cycles in sorted(port_set_cycles.items(), key=lambda item: (len(item[0]), sorted(item[0]))):
+            loads = sorted(self.port_pressure[port] for port in ports)
+            remaining, level = float(cycles), loads[0]
+            for count in range(1, len(loads) + 1):
+                next_level = loads[count] if count < len(loads) else float("inf")
+                if (next_level - level) * count >= remaining:
+                    level += remaining / count
+                    break
+                remaining -= (next_level - level) * count
+                level = next_level
+            for port in ports:
+                self.port_pressure[port] = max(self.port_pressure[port], level)
+
+    def _analyze_dependencies(self):
+        from peachpy.x86_64.operand import MemoryOperand, get_operand_registers
+        from peachpy.x86_64.instructions import BranchInstruction
+
+        # Input registers (data and address) and output registers of every instruction
+        dependencies = []
+        for instruction, timing in zip(self.instructions, self.timings):
+            if timing is None:
+                continue
+            address_registers = set((register._internal_id, register.mask & 0xF) for operand in instruction.operands
+                                    if isinstance(operand, MemoryOperand)
+                                    for register in get_operand_registers(operand))
+            input_registers = _get_register_keys(instruction.input_registers_masks) - address_registers
+            output_registers = _get_register_keys(instruction.output_registers_masks)
+            instruction_class = get_instruction_class(instruction)
+            if instruction_class in {"adc", "cmov", "setcc"} or \
+                    isinstance(instruction, BranchInstruction) and instruction.is_conditional:
+                input_registers.add(_flags_register)
+            if instruction_class in _flags_output_classes:
+                output_registers.add(_flags_register)
+            dependencies.append((timing, input_registers, address_registers, output_registers))
+
+        # Simulate the times when registers are ready in consecutive iterations
+        ready = dict()
+        iteration_latencies = []
+        for _ in range(LoopAnalysis._iterations):
+            iteration_latency = 0
+            for timing, input_registers, address_registers, output_registers in dependencies:
+                start = max([ready.get(register, 0) for register in input_registers] + [0])
+                if timing.load_latency:
+                    start = max([start] + [ready.get(register, 0) + timing.load_latency
+                                           for register in address_registers])
+                finish = start + timing.latency
+                for register in output_registers:
+                    ready[register] = finish
+                iteration_latency = max(iteration_latency, finish)
+            iteration_latencies.append(iteration_latency)
+        self.critical_path_latency = iteration_latencies[0]
+        # Latency grows by the length of the longest loop-carried dependency chain in every iteration
+        half = LoopAnalysis._iterations // 2
+        self.latency_cycles = float(iteration_latencies[-1] - iteration_latencies[half - 1]) / \
+            (LoopAnalysis._iterations - half)
+
+    def format(self, line_separator="\n"):
+        """Formats the results of the analysis as a text report"""
+        port_names = sorted(self.model.ports, key=lambda port: (_port_group.match(port).group(1), port))
+        lines = [
+            "Loop %s on %s: %.2f cycles per iteration, bound by %s" %
+            (self.name, self.model.name, self.cycles,
+             "ports " + ", ".join(self.bottleneck_ports) if self.bottleneck == "ports" else self.bottleneck),
+            "  Port bound: %.2f cycles, front-end bound: %.2f cycles, loop-carried latency: %.2f cycles" %
+            (self.port_cycles, self.frontend_cycles, self.latency_cycles),
+            "  Critical path latency: %d cycles" % self.critical_path_latency,
+            "  Port pressure: " + " ".join("%s %.2f" % (port, self.port_pressure[port]) for port in port_names),
+            "  %7s %5s  %-24s %s" % ("Latency", "Uops", "Ports", "Instruction"),
+        ]
+        for instruction, timing in zip(self.instructions, self.timings):
+            if timing is None:
+                lines.append("  %7s %5s  %-24s %s" % ("?", "?", "", str(instruction)))
+            else:
+                ports = " ".join(_format_ports(ports) + (":%d" % cycles if cycles != 1 else "")
+                                 for ports, cycles in timing.uops)
+                lines.append("  %7d %5d  %-24s %s" %
+                             (timing.latency + timing.load_latency, timing.fused_uops, ports, str(instruction)))
+        if self.unknown_instructions:
+            lines.append("  Instructions marked with ? are not covered by the model and excluded from the analysis")
+        return line_separator.join(lines)
+
+    def __str__(self):
+        return self.format()
+
+
+def _get_register_keys(registers_masks):
+    """Returns the set of keys of registers in the dependency analysis for a register masks dictionary"""
+    return set((register_id, kind_mask) for register_id, register_mask in registers_masks.items()
+               for kind_mask in _register_kind_masks if register_mask & kind_mask != 0)
+
+
+def _format_ports(ports):
+    """Formats a set of ports in the notation of performance models, e.g. "p015" for ports p0, p1 and p5"""
+    groups = dict()
+    for port in ports:
+        prefix, number = _port_group.match(port).groups()
+        groups.setdefault(prefix, []).append(number)
+    return "".join(prefix + "".join(sorted(numbers)) for prefix, numbers in sorted(groups.items()))
+
+
+def find_loops(instructions):
+    """Returns the loops in a list of instructions as tuples of the loop name and the instructions in the loop body.
+
+    A loop is a range of instructions from a label to the last backward branch to the label, e.g. a :class:`Loop`
+    block. Regions between IACA.START and IACA.END pseudo-instructions are analyzed as loops too.
+
+    :param list instructions: instructions of a finalized function.
+    """
+    from peachpy.x86_64.instructions import BranchInstruction
+    from peachpy.x86_64.pseudo import LABEL
+    label_positions = dict()
+    loop_ends = dict()
+    iaca_start = None
+    iaca_regions = []
+    for position, instruction in enumerate(instructions):
+        if isinstance(instruction, LABEL):
+            label_positions[instruction.identifier] = position
+        elif isinstance(instruction, BranchInstruction):
+            label_name = instruction.label_name
+            if label_name in label_positions:
+                loop_ends[label_name] = position
+        elif instruction.name == "IACA.START":
+            iaca_start = position
+        elif instruction.name == "IACA.END" and iaca_start is not None:
+            iaca_regions.append(("IACA", iaca_start + 1, position))
+            iaca_start = None
+    # Loop blocks are named after the Loop object rather than its begin label
+    regions = [(".".join(map(str, label_name[:-1] if str(label_name[-1]) == "begin" else label_name)),
+                label_positions[label_name] + 1, end + 1)
+               for label_name, end in loop_ends.items()]
+    regions = sorted(regions, key=lambda region: (region[1], -region[2])) + iaca_regions
+    return [(name, [instruction for instruction in instructions[start:end]
+                    if instruction.name not in _pseudo_instructions])
+            for name, start, end in regions]
+
+
+def analyze_loops(function, target=None):
+    """Analyzes throughput of every loop in a finalized function.
+
+    :param peachpy.x86_64.function.ABIFunction function: the function to analyze.
+    :param peachpy.x86_64.uarch.Microarchitecture target: the microarchitecture to analyze the loops for. If not
+        specified, the target microarchitecture of the function is used.
+    :returns: a list of :class:`LoopAnalysis` objects in the order of loops in the function. Nested loops are
+        analyzed separately, and the body of an outer loop includes the instructions of its inner loops once.
+    :raises ValueError: if neither the microarchitecture nor a similar microarchitecture has a performance model. See
+        :func:`get_performance_model`.
+    """
+    if target is None:
+        target = function.target
+    model = get_performance_model(target)
+    if model is None:
+        raise ValueError("Microarchitecture %s has no performance model" % target)
+    return [LoopAnalysis(name, model, instructions) for name, instructions in find_loops(function._instructions)]
+
+
+_haswell_timings = {
+    "mov": (1, "p0156"),
+    "alu": (1, "p0156"),
+    "adc": (2, "p0156 p06"),
+    "shift": (1, "p06"),
+    "lea": (1, "p15"),
+    "imul": (3, "p1"),
+    "mul": (4, "p1 p5"),
+    "div": (36, "p0:22"),
+    "cmov": (2, "p0156 p06"),
+    "setcc": (1, "p06"),
+    "branch": (1, "p06"),
+    "jmp": (1, "p6"),
+    "bitcount": (3, "p1"),
+    "nop": (0, ""),
+    "prefetch": (0, ""),
+    "vmov": (1, "p015"),
+    "vmovd": (1, "p0"),
+    "vmovmsk": (3, "p0"),
+    "vlogic": (1, "p015"),
+    "vint": (1, "p15"),
+    "vint_mul": (5, "p0"),
+    "vint_mul_long": (10, "2*p0"),
+    "vshift": (1, "p0"),
+    "vshift_variable": (2, "2*p0 p5"),
+    "vshuffle": (1, "p5"),
+    "vshuffle_lane": (3, "p5"),
+    "vbroadcast": (3, "p5"),
+    "vblend": (1, "p015"),
+    "vblendv": (2, "2*p5"),
+    "fadd": (3, "p1"),
+    "fmul": (5, "p01"),
+    "fma": (5, "p01"),
+    "fdiv_single": (13, "p0:7"),
+    "fdiv_single.256": (21, "p0:14 2*p15"),
+    "fdiv_double": (20, "p0:14"),
+    "fdiv_double.256": (35, "p0:28 2*p15"),
+    "fsqrt_single": (13, "p0:7"),
+    "fsqrt_single.256": (21, "p0:14 2*p15"),
+    "fsqrt_double": (20, "p0:14"),
+    "fsqrt_double.256": (35, "p0:28 2*p15"),
+    "frcp": (5, "p0"),
+    "frcp.256": (7, "2*p0 p15"),
+    "fhadd": (5, "p1 2*p5"),
+    "vcvt": (3, "p1"),
+    "vcvt_width": (4, "p1 p5"),
+    "vround": (6, "2*p1"),
+    "vtest": (3, "p0 p5"),
+}
+
+_broadwell_timings = dict(_haswell_timings)
+_broadwell_timings.update({
+    "adc": (1, "p06"),
+    "cmov": (1, "p06"),
+    "fmul": (3, "p01"),
+    "fdiv_single": (11, "p0:4"),
+    "fdiv_single.256": (17, "p0:10 2*p15"),
+    "fdiv_double": (14, "p0:8"),
+    "fdiv_double.256": (23, "p0:16 2*p15"),
+    "fsqrt_single": (12, "p0:5"),
+    "fsqrt_single.256": (19, "p0:12 2*p15"),
+    "fsqrt_double": (17, "p0:10"),
+    "fsqrt_double.256": (35, "p0:20 2*p15"),
+})
+
+_skylake_timings = dict(_broadwell_timings)
+_skylake_timings.update({
+    "vint": (1, "p015"),
+    "vint_mul": (5, "p01"),
+    "vint_mul_long": (10, "2*p01"),
+    "vshift": (1, "p01"),
+    "vshift_variable": (1, "p01"),
+    "vblendv": (2, "2*p015"),
+    "fadd": (4, "p01"),
+    "fmul": (4, "p01"),
+    "fma": (4, "p01"),
+    "fdiv_single": (11, "p0:3"),
+    "fdiv_single.256": (11, "p0:5"),
+    "fdiv_single.512": (18, "p0:10 2*p5"),
+    "fdiv_double": (14, "p0:4"),
+    "fdiv_double.256": (14, "p0:8"),
+    "fdiv_double.512": (23, "p0:16 2*p5"),
+    "fsqrt_single": (12, "p0:3"),
+    "fsqrt_single.256": (12, "p0:6"),
+    "fsqrt_single.512": (19, "p0:12 2*p5"),
+    "fsqrt_double": (18, "p0:6"),
+    "fsqrt_double.256": (18, "p0:12"),
+    "fsqrt_double.512": (31, "p0:24 2*p5"),
+    "frcp": (4, "p0"),
+    "frcp.256": (4, "p0"),
+    "fhadd": (6, "p01 2*p5"),
+    "vcvt": (4, "p01"),
+    "vcvt_width": (5, "p01 p5"),
+    "vround": (8, "2*p01"),
+    "vtest": (3, "p0 p5"),
+})
+
+_zen_timings = {
+    "mov": (1, "i0123"),
+    "alu": (1, "i0123"),
+    "adc": (1, "i0123"),
+    "shift": (1, "i12"),
+    "lea": (1, "i0123"),
+    "imul": (3, "i1"),
+    "mul": (3, "i1 i0123"),
+    "div": (30, "i2:30"),
+    "cmov": (1, "i0123"),
+    "setcc": (1, "i0123"),
+    "branch": (1, "i03"),
+    "jmp": (1, "i03"),
+    "bitcount": (1, "i0123"),
+    "nop": (0, ""),
+    "prefetch": (0, ""),
+    "vmov": (1, "f0123"),
+    "vmovd": (3, "f2"),
+    "vmovmsk": (3, "f2"),
+    "vlogic": (1, "f0123"),
+    "vint": (1, "f013"),
+    "vint_mul": (4, "f0"),
+    "vint_mul_long": (4, "f0:2"),
+    "vshift": (1, "f2"),
+    "vshift_variable": (3, "f1 f2"),
+    "vshuffle": (1, "f12"),
+    "vshuffle_lane": (3, "2*f12"),
+    "vbroadcast": (1, "f12"),
+    "vblend": (1, "f01"),
+    "vblendv": (1, "f01"),
+    "fadd": (3, "f23"),
+    "fmul": (3, "f01"),
+    "fma": (5, "f01"),
+    "fdiv_single": (10, "f3:4"),
+    "fdiv_double": (13, "f3:5"),
+    "fsqrt_single": (14, "f3:5"),
+    "fsqrt_double": (20, "f3:8"),
+    "frcp": (5, "f01"),
+    "fhadd": (7, "2*f12 2*f23"),
+    "vcvt": (4, "f3"),
+    "vcvt_width": (5, "f3 f12"),
+    "vround": (3, "f3"),
+    "vtest": (3, "f0 f3"),
+}
+
+_intel_macro_fusion = ("CMP", "TEST", "ADD", "SUB", "AND", "INC", "DEC")
+
+haswell = PerformanceModel("Haswell", 4, _haswell_timings, load=(5, "p23"), store="p237 p4", vector_load_latency=6,
+                           macro_fusion=_intel_macro_fusion)
+broadwell = PerformanceModel("Broadwell", 4, _broadwell_timings, load=(5, "p23"), store="p237 p4",
+                             vector_load_latency=6, macro_fusion=_intel_macro_fusion)
+skylake = PerformanceModel("Skylake", 4, _skylake_timings, load=(5, "p23"), store="p237 p4", vector_load_latency=6,
+                           macro_fusion=_intel_macro_fusion)
+# 512-bit instructions execute on the fused p0+p1 unit and on p5
+skylake_xeon = PerformanceModel("Skylake Xeon", 4, _skylake_timings, load=(5, "p23"), store="p237 p4",
+                                vector_load_latency=7, macro_fusion=_intel_macro_fusion,
+                                wide_ports={"p01": "p05", "p015": "p05"})
+# 256-bit instructions are split into two 128-bit micro-operations
+zen = PerformanceModel("Zen", 5, _zen_timings, load=(4, "a01"), store="a01 st", vector_load_latency=7,
+                       macro_fusion=("CMP", "TEST"), split_width=128)
+
+models = {
+    "Haswell": haswell,
+    "Broadwell": broadwell,
+    "Skylake": skylake,
+    "Skylake Xeon": skylake_xeon,
+    "Cannonlake": skylake_xeon,
+    "Zen": zen,
+}
+
+# Microarchitectures without own performance model are approximated by the model of the closest modeled
+# microarchitecture of the same vendor. Estimates for these microarchitectures are only indicative.
+approximate_models = {
+    "Default": haswell,
+    "Prescott": haswell,
+    "Conroe": haswell,
+    "Penryn": haswell,
+    "Nehalem": haswell,
+    "Sandy Bridge": haswell,
+    "Ivy Bridge": haswell,
+    "Knights Landing": skylake_xeon,
+    "Bonnell": haswell,
+    "Saltwell": haswell,
+    "Silvermont": haswell,
+    "Airmont": haswell,
+    "Goldmont": haswell,
+    "K8": zen,
+    "K10": zen,
+    "Bulldozer": zen,
+    "Piledriver": zen,
+    "Steamroller": zen,
+    "Excavator": zen,
+    "Bobcat": zen,
+    "Jaguar": zen,
+}
+
+
+def get_performance_model(target):
+    """Returns the performance model for analysis of code on a microarchitecture.
+
+    Only Haswell, Broadwell, Skylake, Skylake Xeon, Cannonlake and Zen have own performance models. Other known
+    microarchitectures are approximated by the model of the closest modeled microarchitecture, and a warning is issued.
+
+    :param peachpy.x86_64.uarch.Microarchitecture target: the microarchitecture.
+    :returns: a :class:`PerformanceModel` object, or None if there is no model for the microarchitecture or a similar
+        microarchitecture.
+    """
+    model = target.performance_model
+    if model is None:
+        model = approximate_models.get(target.name)
+        if model is not None:
+            import warnings
+            warnings.warn("Microarchitecture %s has no performance model, using the model of %s instead" %
+                          (target, model), RuntimeWarning)
+    return model
@@ -1,17 +1,17 @@
 # This file is part of PeachPy package and is licensed under the Simplified BSD license.
 #    See license.rst for the full text of the license.
 
-import inspect
-
 import peachpy.stream
 import peachpy.x86_64.options
 import peachpy.x86_64.isa
-from peachpy.x86_64.instructions import Instruction
+from peachpy.x86_64.instructions import Instruction, capture_origin
 from peachpy.x86_64.operand import check_operand, format_operand_type
 from peachpy.parse import parse_assigned_variable_name, parse_with_variable_name
 
 
-class Label:
+class Label(object):
+    __slots__ = ("name", "line_number")
+
     def __init__(self, name=None):
         from peachpy.name import Name
         if name is None:
@@ -186,7 +186,7 @@ class RETURN(Instruction):
         origin = kwargs.get("origin")
         prototype = kwargs.get("prototype")
         if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-            origin = inspect.stack()
+            origin = capture_origin()
         super(RETURN, self).__init__("RETURN", origin=origin)
         self.operands = tuple(map(check_operand, args))
         if len(self.operands) == 0:
@@ -267,7 +267,7 @@ class LOAD:
             origin = kwargs.get("origin")
             prototype = kwargs.get("prototype")
             if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-                origin = inspect.stack()
+                origin = capture_origin()
             super(LOAD.ARGUMENT, self).__init__("LOAD.ARGUMENT", origin=origin)
             self.operands = tuple(map(check_operand, args))
             self.out_regs = (True, False)
@@ -374,7 +374,7 @@ class STORE:
             origin = kwargs.get("origin")
             prototype = kwargs.get("prototype")
             if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-                origin = inspect.stack()
+                origin = capture_origin()
             super(STORE.RESULT, self).__init__("STORE.RESULT", origin=origin)
             self.operands = tuple(map(check_operand, args))
             self.out_regs = (False,)
@@ -495,7 +495,7 @@ class IACA:
             origin = kwargs.get("origin")
             prototype = kwargs.get("prototype")
             if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-                origin = inspect.stack()
+                origin = capture_origin()
             super(IACA.START, self).__init__("IACA.START", origin=origin)
 
             self.operands = tuple(map(check_operand, args))
@@ -515,7 +515,7 @@ class IACA:
             origin = kwargs.get("origin")
             prototype = kwargs.get("prototype")
             if origin is None and prototype is None and peachpy.x86_64.options.get_debug_level() > 0:
-                origin = inspect.stack()
+                origin = capture_origin()
             super(IACA.END, self).__init__("IACA.END", origin=origin)
 
             self.operands = tuple(map(check_operand, args))
@@ -20,6 +20,10 @@ class Register(object):
         0x700: 64
     }
     size = None
+    # Map from (register type, mask, physical id) to the shared register object returned by Register._intern
+    _interned_registers = dict()
+
+    __slots__ = ("mask", "virtual_id", "physical_id")
 
     def __init__(self, mask, virtual_id=None, physical_id=None):
         super(Register, self).__init__()
@@ -60,6 +64,28 @@ class Register(object):
     def __repr__(self):
         return str(self)
 
+    def __copy__(self):
+        register = object.__new__(type(self))
+        register.mask = self.mask
+        register.virtual_id = self.virtual_id
+        register.physical_id = self.physical_id
+        return register
+
+    def _intern(self):
+        """Returns a shared register object equal to this physical register.
+
+        Physical registers in instruction operands are never modified, so all instructions can refer to the same
+        register object instead of private copies. The shared object is never exposed to user code, where
+        :meth:`peachpy.x86_64.pseudo.SWAP.REGISTERS` can modify register objects.
+        """
+        assert self.physical_id is not None, "Only physical registers can be interned"
+        key = type(self), self.mask, self.physical_id
+        register = Register._interned_registers.get(key)
+        if register is None:
+            register = self.__copy__()
+            Register._interned_registers[key] = register
+        return register
+
     @property
     def _internal_id(self):
         if self.is_virtual:
@@ -200,6 +226,7 @@ class Register(object):
 
 class GeneralPurposeRegister(Register):
     """A base class for general-purpose registers"""
+    __slots__ = ()
     _go_physical_id_map = {0x0: 'AX',  0x1: 'CX',  0x2: 'DX',  0x3: 'BX',
                            0x4: 'SP',  0x5: 'BP',  0x6: 'SI',  0x7: 'DI',
                            0x8: 'R8',  0x9: 'R9',  0xA: 'R10', 0xB: 'R11',
@@ -241,6 +268,7 @@ class GeneralPurposeRegister(Register):
 
 class GeneralPurposeRegister64(GeneralPurposeRegister):
     """64-bit general-purpose register"""
+    __slots__ = ()
     size = 8
 
     _physical_id_map = {0x0: 'rax', 0x1: 'rcx', 0x2: 'rdx', 0x3: 'rbx',
@@ -300,6 +328,7 @@ r15 = GeneralPurposeRegister64(15)
 
 class GeneralPurposeRegister32(GeneralPurposeRegister):
     """32-bit general-purpose register"""
+    __slots__ = ()
     size = 4
 
     _physical_id_map = {0x0: 'eax',  0x1: 'ecx',  0x2: 'edx',  0x3: 'ebx',
@@ -360,6 +389,7 @@ r15d = GeneralPurposeRegister32(15)
 
 class GeneralPurposeRegister16(GeneralPurposeRegister):
     """16-bit general-purpose register"""
+    __slots__ = ()
     size = 2
 
     _physical_id_map = {0x0: 'ax',   0x1: 'cx',   0x2: 'dx',   0x3: 'bx',
@@ -403,6 +433,7 @@ r15w = GeneralPurposeRegister16(15)
 
 class GeneralPurposeRegister8(GeneralPurposeRegister):
     """8-bit general-purpose register"""
+    __slots__ = ()
     size = 1
 
     _physical_id_map = {(0x0, 0x1): 'al',   (0x1, 0x1): 'cl',   (0x2, 0x1): 'dl',   (0x3, 0x1): 'bl',
@@ -468,6 +499,7 @@ r15b = GeneralPurposeRegister8(15)
 
 class MMXRegister(Register):
     """64-bit MMX technology register"""
+    __slots__ = ()
     size = 8
 
     _physical_id_map = {n: "mm" + str(n) for n in range(8)}
@@ -515,6 +547,7 @@ mm7 = MMXRegister(7)
 
 class XMMRegister(Register):
     """128-bit xmm (SSE) register"""
+    __slots__ = ()
     size = 16
 
     _physical_id_map = {n: "xmm" + str(n) for n in range(32)}
@@ -629,6 +662,7 @@ xmm31 = XMMRegister(31)
 
 class YMMRegister(Register):
     """256-bit ymm (AVX) register"""
+    __slots__ = ()
     size = 32
 
     _physical_id_map = {n: "ymm" + str(n) for n in range(32)}
@@ -742,6 +776,7 @@ ymm31 = YMMRegister(31)
 
 class ZMMRegister(Register):
     """512-bit zmm (AVX-512) register"""
+    __slots__ = ()
     size = 64
 
     _physical_id_map = {n: "zmm" + str(n) for n in range(32)}
@@ -842,6 +877,7 @@ zmm31 = ZMMRegister(31)
 
 class KRegister(Register):
     """AVX-512 mask register"""
+    __slots__ = ()
     size = 8
 
     _physical_id_map = {n: "k" + str(n) for n in range(8)}
@@ -884,7 +920,9 @@ class KRegister(Register):
         return MaskedRegister(self, mask)
 
 
-class RegisterMask:
+class RegisterMask(object):
+    __slots__ = ("mask_register", "is_zeroing")
+
     def __init__(self, mask_register, is_zeroing=False):
         self.mask_register = mask_register
         self.is_zeroing = is_zeroing
@@ -910,7 +948,9 @@ k6 = KRegister(6)
 k7 = KRegister(7)
 
 
-class MaskedRegister:
+class MaskedRegister(object):
+    __slots__ = ("register", "mask")
+
     def __init__(self, register, mask):
         assert isinstance(register, (XMMRegister, YMMRegister, ZMMRegister, KRegister))
         assert isinstance(mask, (KRegister, RegisterMask))
@@ -0,0 +1,330 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Latency-aware list scheduling of instructions within basic blocks.
+
+The scheduler splits the instruction stream into regions of consecutive instructions which can be reordered: labels,
+branches, returns, pseudo-instructions and instructions unknown to performance models end a region and are never
+moved. In every region the scheduler builds a dependency graph of instructions on registers, arithmetic flags and
+memory, and reorders the instructions greedily: at every step it issues the instruction which can start the earliest
+given the latencies of its inputs, preferring instructions on the longest path to the end of the region.
+
+Stores are not reordered with other loads and stores, and loads are not reordered with stores, unless the accesses
+provably don't overlap: both addresses use the same values of the base and index registers and the same scale, and the
+ranges of displacements don't intersect. Loads of literal constants are free to move.
+
+The scheduler keeps the number of live registers of every kind within the limits of physical registers. If a region
+can not be scheduled within the limits, the original order of instructions in the region is preserved.
+"""
+
+from peachpy.x86_64.performance import get_instruction_class, _get_register_keys, _move_classes, \
+    _flags_output_classes, _flags_register
+
+# Instruction classes which read arithmetic flags
+_flags_input_classes = frozenset(["adc", "cmov", "setcc"])
+# Instruction classes which are never moved: branches, and instructions with side effects on the whole register state
+_barrier_classes = frozenset(["branch", "jmp", "nop"])
+# Latency of instructions if the target microarchitecture has no performance model
+_default_latency = 1
+# Issue width if the target microarchitecture has no performance model
+_default_issue_width = 4
+
+
+class _Node(object):
+    """An instruction in the dependency graph of a region.
+
+    :ivar int position: the position of the instruction in the region.
+    :ivar int latency: the latency of the instruction outputs, including the latency of loading a memory operand.
+    :ivar set input_keys: keys of registers and flags read by the instruction.
+    :ivar set output_keys: keys of registers and flags written by the instruction.
+    :ivar tuple address: the base and index registers with their writers, the scale, the displacement, and the size of
+        the memory access, or None if the range of accessed addresses can not be compared to other accesses.
+    :ivar dict predecessors: a map from nodes which must be issued before this node to the delay in cycles between the
+        start of the predecessor and the start of this node.
+    :ivar list successors: nodes which must be issued after this node.
+    :ivar int height: the length of the longest dependency path from the start of this node to the end of the region.
+    """
+
+    __slots__ = ("position", "instruction", "latency", "input_keys", "output_keys", "is_load", "is_store",
+                 "memory_operand", "address", "predecessors", "successors", "height")
+
+    def __init__(self, position, instruction, model):
+        from peachpy.x86_64.operand import MemoryOperand
+        from peachpy.literal import Constant
+
+        self.position = position
+        self.instruction = instruction
+        instruction_class = get_instruction_class(instruction)
+        self.latency = _default_latency
+        if model is not None:
+            timing = model.get_timing(instruction)
+            self.latency = max(timing.latency + timing.load_latency, 1)
+
+        self.input_keys = _get_register_keys(instruction.input_registers_masks)
+        self.output_keys = _get_register_keys(instruction.output_registers_masks)
+        if instruction_class in _flags_input_classes:
+            self.input_keys.add(_flags_register)
+        if instruction_class in _flags_output_classes:
+            self.output_keys.add(_flags_register)
+
+        self.is_load, self.is_store = False, False
+        self.memory_operand, self.address = None, None
+        if instruction_class not in {"lea", "prefetch"}:
+            for operand, is_output in zip(instruction.operands, instruction.out_operands):
+                if isinstance(operand, MemoryOperand) and not isinstance(operand.symbol, Constant):
+                    self.is_store = is_output
+                    self.is_load = not is_output or instruction_class not in _move_classes
+                    self.memory_operand = operand
+
+        self.predecessors = dict()
+        self.successors = list()
+        self.height = self.latency
+
+    def add_predecessor(self, node, delay):
+        if node is self:
+            return
+        if node not in self.predecessors:
+            node.successors.append(self)
+            self.predecessors[node] = delay
+        else:
+            self.predecessors[node] = max(self.predecessors[node], delay)
+
+    def may_alias(self, node):
+        """Checks if the memory accessed by this node and the other node can overlap"""
+        if self.address is None or node.address is None or self.address[:5] != node.address[:5]:
+            return True
+        displacement, size = self.address[5:]
+        other_displacement, other_size = node.address[5:]
+        return displacement < other_displacement + other_size and other_displacement < displacement + size
+
+
+def _get_address(operand, instruction, last_writers):
+    """Returns the address tuple of a memory operand for the may_alias check, or None if it is not comparable"""
+    from peachpy.x86_64.operand import MemoryAddress
+    from peachpy.x86_64.registers import Register, GeneralPurposeRegister64
+
+    address = operand.address
+    if operand.symbol is not None or operand.broadcast is not None or not isinstance(address, MemoryAddress):
+        return None
+    if address.index is not None and not isinstance(address.index, GeneralPurposeRegister64):
+        return None
+    size = operand.size
+    if size is None:
+        size = max([other_operand.size for other_operand in instruction.operands
+                    if isinstance(other_operand, Register)] + [0]) or None
+    if size is None:
+        return None
+    base_key, index_key = None, None
+    if address.base is not None:
+        base_key = (address.base._internal_id, GeneralPurposeRegister64._mask)
+    if address.index is not None:
+        index_key = (address.index._internal_id, GeneralPurposeRegister64._mask)
+    return (base_key, last_writers.get(base_key), index_key, last_writers.get(index_key), address.scale,
+            address.displacement, size)
+
+
+def is_schedulable(instruction):
+    """Checks if the instruction can be moved by the scheduler.
+
+    :param peachpy.x86_64.instructions.Instruction instruction: the instruction to check.
+    """
+    instruction_class = get_instruction_class(instruction)
+    return instruction_class is not None and instruction_class not in _barrier_classes
+
+
+def _build_dependency_graph(instructions, model):
+    """Returns the list of dependency graph nodes for the instructions of a region"""
+    nodes = [_Node(position, instruction, model) for position, instruction in enumerate(instructions)]
+    last_writers = dict()
+    readers = dict()
+    loads, stores = list(), list()
+    for node in nodes:
+        if node.memory_operand is not None:
+            node.address = _get_address(node.memory_operand, node.instruction, last_writers)
+        # Read after write: the instruction waits for the inputs to be computed
+        for key in node.input_keys:
+            writer = last_writers.get(key)
+            if writer is not None:
+                node.add_predecessor(writer, writer.latency)
+        # Write after read and write after write: the instruction must not overwrite a register too early
+        for key in node.output_keys:
+            writer = last_writers.get(key)
+            if writer is not None:
+                node.add_predecessor(writer, 0)
+            for reader in readers.get(key, ()):
+                node.add_predecessor(reader, 0)
+        for key in node.input_keys:
+            readers.setdefault(key, []).append(node)
+        for key in node.output_keys:
+            last_writers[key] = node
+            readers[key] = []
+
+        # Memory dependencies on overlapping accesses
+        if node.is_load or node.is_store:
+            for store in stores:
+                if store.may_alias(node):
+                    node.add_predecessor(store, int(node.is_load))
+        if node.is_store:
+            for load in loads:
+                if load.may_alias(node):
+                    node.add_predecessor(load, 0)
+        if node.is_load:
+            loads.append(node)
+        if node.is_store:
+            stores.append(node)
+
+    for node in reversed(nodes):
+        for successor in node.successors:
+            node.height = max(node.height, successor.predecessors[node] + successor.height)
+    return nodes
+
+
+class _RegisterPressure(object):
+    """Tracks the number of live registers of every kind as instructions of a region are issued.
+
+    The scheduler preserves the order of all reads and writes of a register relative to writes of the register, thus a
+    register is live before an instruction if the earliest access of the register which is not yet issued is a read,
+    or if all accesses were issued and the register is live at the end of the region.
+    """
+
+    def __init__(self, nodes, live_in_keys, live_out_keys, kind_limits):
+        self.kind_limits = kind_limits
+        self.live_out_keys = live_out_keys
+        self.accesses = dict()
+        for node in nodes:
+            for key in node.input_keys | node.output_keys:
+                if key != _flags_register:
+                    self.accesses.setdefault(key, []).append((node, key in node.input_keys))
+        self.next_access = dict.fromkeys(self.accesses, 0)
+        self.issued = set()
+        self.live_counts = dict.fromkeys(kind_limits, 0)
+        for key in live_in_keys:
+            self.live_counts[key[1]] += 1
+
+    def _is_live(self, key, next_access):
+        accesses = self.accesses[key]
+        if next_access == len(accesses):
+            return key in self.live_out_keys
+        return accesses[next_access][1]
+
+    def _advance(self, key, node):
+        accesses = self.accesses[key]
+        next_access = self.next_access[key]
+        while next_access < len(accesses) and (accesses[next_access][0] in self.issued or
+                                               accesses[next_access][0] is node):
+            next_access += 1
+        return next_access
+
+    def _changes(self, node):
+        for key in node.input_keys | node.output_keys:
+            if key != _flags_register:
+                next_access = self._advance(key, node)
+                delta = int(self._is_live(key, next_access)) - int(self._is_live(key, self.next_access[key]))
+                yield key, next_access, delta
+
+    def excess(self, node):
+        """Returns the number of registers above the limits which would be live after issuing the node"""
+        output_counts = dict()
+        for key in node.output_keys:
+            if key != _flags_register:
+                output_counts[key[1]] = output_counts.get(key[1], 0) + 1
+        if all(self.live_counts[kind] + count <= self.kind_limits[kind] for kind, count in output_counts.items()):
+            return 0
+        live_counts = self.live_counts.copy()
+        for key, _, delta in self._changes(node):
+            live_counts[key[1]] += delta
+        return sum(max(count - self.kind_limits[kind], 0) for kind, count in live_counts.items())
+
+    def issue(self, node):
+        for key, next_access, delta in list(self._changes(node)):
+            self.next_access[key] = next_access
+            self.live_counts[key[1]] += delta
+        self.issued.add(node)
+
+    @property
+    def is_within_limits(self):
+        return all(count <= self.kind_limits[kind] for kind, count in self.live_counts.items())
+
+
+def _schedule_region(instructions, live_in, live_out, model, kind_limits):
+    """Returns the instructions of a region in the scheduled order"""
+    nodes = _build_dependency_graph(instructions, model)
+    live_in_keys = _get_register_keys(live_in)
+    live_out_keys = _get_register_keys(live_out)
+    pressure = _RegisterPressure(nodes, live_in_keys, live_out_keys, kind_limits)
+    original_pressure = _RegisterPressure(nodes, live_in_keys, live_out_keys, kind_limits)
+    issue_width = model.issue_width if model is not None else _default_issue_width
+
+    remaining_predecessors = dict((node, len(node.predecessors)) for node in nodes)
+    ready_cycles = dict.fromkeys(nodes, 0)
+    candidates = [node for node in nodes if not node.predecessors]
+    cycle, issued_in_cycle = 0, 0
+    is_within_limits, is_originally_within_limits = pressure.is_within_limits, pressure.is_within_limits
+    order = list()
+    while candidates:
+        node = min(candidates, key=lambda candidate: (pressure.excess(candidate),
+                                                      max(ready_cycles[candidate], cycle),
+                                                      -candidate.height, candidate.position))
+        candidates.remove(node)
+        order.append(node)
+        pressure.issue(node)
+        is_within_limits = is_within_limits and pressure.is_within_limits
+        original_pressure.issue(nodes[len(order) - 1])
+        is_originally_within_limits = is_originally_within_limits and original_pressure.is_within_limits
+
+        if ready_cycles[node] > cycle:
+            cycle, issued_in_cycle = ready_cycles[node], 0
+        start_cycle = cycle
+        issued_in_cycle += 1
+        if issued_in_cycle == issue_width:
+            cycle, issued_in_cycle = cycle + 1, 0
+        for successor in node.successors:
+            ready_cycles[successor] = max(ready_cycles[successor], start_cycle + successor.predecessors[node])
+            remaining_predecessors[successor] -= 1
+            if remaining_predecessors[successor] == 0:
+                candidates.append(successor)
+    assert len(order) == len(nodes)
+
+    if not is_within_limits and is_originally_within_limits:
+        return list(instructions)
+    return [node.instruction for node in order]
+
+
+def schedule_instructions(instructions, target, max_live_registers):
+    """Reorders instructions within basic blocks to hide latencies of the target microarchitecture.
+
+    Liveness of registers must be analyzed before scheduling, and needs to be recomputed for the scheduled instructions.
+
+    :param list instructions: the list of :class:`peachpy.x86_64.instructions.Instruction` objects to schedule.
+    :param Microarchitecture target: the target microarchitecture. If the microarchitecture has no performance model,
+        all instructions are assumed to have the same latency.
+    :param dict max_live_registers: a map from register kind to the number of physical registers available for
+        allocation.
+    :returns: a new list of instructions in the scheduled order.
+    """
+    from peachpy.x86_64.registers import GeneralPurposeRegister, GeneralPurposeRegister64, MMXRegister, XMMRegister, \
+        ZMMRegister, KRegister
+
+    # Registers of one kind have the same mask bits in register masks dictionaries
+    kind_limits = {
+        GeneralPurposeRegister64._mask: max_live_registers[GeneralPurposeRegister._kind],
+        MMXRegister._mask: max_live_registers[MMXRegister._kind],
+        ZMMRegister._mask: max_live_registers[XMMRegister._kind],
+        KRegister._mask: max_live_registers[KRegister._kind]
+    }
+    model = target.performance_model
+    scheduled_instructions = list()
+    region_start = 0
+    for position in range(len(instructions) + 1):
+        if position == len(instructions) or not is_schedulable(instructions[position]):
+            if position - region_start > 1:
+                live_out = instructions[position]._live_registers if position < len(instructions) else dict()
+                scheduled_instructions += _schedule_region(instructions[region_start:position],
+                                                           instructions[region_start]._live_registers, live_out,
+                                                           model, kind_limits)
+            else:
+                scheduled_instructions += instructions[region_start:position]
+            if position < len(instructions):
+                scheduled_instructions.append(instructions[position])
+            region_start = position + 1
+    return scheduled_instructions
@@ -0,0 +1,142 @@
+# This file is part of PeachPy package and is licensed under the Simplified BSD license.
+#    See license.rst for the full text of the license.
+
+"""Trampolines which call loaded functions natively over arrays of packed arguments"""
+
+import threading
+
+
+_call_many_trampolines = dict()
+_call_many_trampolines_lock = threading.Lock()
+
+
+def get_argument_record_type(arguments):
+    """Returns a ctypes structure type with a field for each argument, which packs the arguments of a single call.
+
+    Fields are named after the arguments and naturally aligned, so the layout matches an aligned C struct or an aligned
+    NumPy structured dtype. Pointer arguments are stored as addresses.
+
+    :param list arguments: a list of :class:`peachpy.x86_64.function.Argument` objects.
+    """
+    import ctypes
+    fields = []
+    for argument in arguments:
+        if argument.is_pointer:
+            fields.append((argument.name, ctypes.c_void_p))
+        else:
+            fields.append((argument.name, argument.c_type.as_ctypes_type))
+    return type("ArgumentRecord", (ctypes.Structure,), {"_fields_": fields})
+
+
+def get_call_many_trampoline(function):
+    """Returns a loaded trampoline function which calls a function with the signature of the encoded function for every
+    record of packed arguments.
+
+    The trampoline has signature ``void trampoline(const void* records, size_t count, void* results, void* function)``.
+    Records are laid out as :func:`get_argument_record_type` structures, and results are stored contiguously with the
+    size of the result type. Trampolines are cached by function signature and ABI.
+
+    :param peachpy.x86_64.function.EncodedFunction function: the function to generate the trampoline for.
+    """
+    key = (function.abi, tuple(argument.c_type for argument in function.arguments), function.result_type)
+    with _call_many_trampolines_lock:
+        trampoline = _call_many_trampolines.get(key)
+        if trampoline is None:
+            trampoline = _build_call_many_trampoline(function).finalize(function.abi).encode().load()
+            _call_many_trampolines[key] = trampoline
+        return trampoline
+
+
+def _build_call_many_trampoline(function):
+    import ctypes
+    from peachpy import Argument
+    from peachpy.c.types import ptr, const_ptr, size_t
+    from peachpy.util import roundup
+    from peachpy.x86_64.abi import microsoft_x64_abi
+    from peachpy.x86_64.function import Function
+    from peachpy.x86_64.pseudo import Loop, Label, LABEL, LOAD, RETURN
+    from peachpy.x86_64.operand import byte, word, dword, qword
+    from peachpy.x86_64.registers import rax, rbx, rbp, rsp, r12, r13, r14, xmm0
+    from peachpy.x86_64.generic import MOV, MOVZX, MOVSX, ADD, SUB, AND, TEST, CALL, JZ, JNZ
+    from peachpy.x86_64.mmxsse import MOVSS, MOVSD
+
+    record_type = get_argument_record_type(function.arguments)
+    record_fields = dict((name, getattr(record_type, name)) for name, _ in record_type._fields_)
+    for argument in function.arguments:
+        if not (argument.is_integer or argument.is_pointer or argument.is_codeunit or argument.is_floating_point) \
+                or argument.is_floating_point and argument.size not in {4, 8}:
+            raise ValueError("Argument %s of type %s is not supported in bulk calls" % (argument.name, argument.c_type))
+    result_type = function.result_type
+    if result_type is not None:
+        result_size = result_type.get_size(function.abi)
+        if result_type.is_floating_point and result_size not in {4, 8} or \
+                not (result_type.is_integer or result_type.is_pointer or result_type.is_codeunit or
+                     result_type.is_floating_point or result_type.is_bool):
+            raise ValueError("Result type %s is not supported in bulk calls" % result_type)
+
+    # Arguments passed on stack are stored in the call frame at their offsets from the return address
+    stack_arguments_size = max([argument.stack_offset + 8 for argument in function.arguments
+                                if argument.register is None] + [0])
+    if function.abi == microsoft_x64_abi:
+        # Shadow space for the arguments passed in registers
+        stack_arguments_size = max(stack_arguments_size, 32)
+    call_frame_size = roundup(stack_arguments_size, 16)
+
+    records_argument = Argument(const_ptr(), name="records")
+    count_argument = Argument(size_t, name="count")
+    results_argument = Argument(ptr(), name="results")
+    function_argument = Argument(const_ptr(), name="function")
+    arguments = (records_argument, count_argument, results_argument, function_argument)
+    with Function("call_many_trampoline", arguments, target=function.target) as trampoline:
+        # The state of the loop is kept in callee-save registers, which survive the calls
+        LOAD.ARGUMENT(rbx, records_argument)
+        LOAD.ARGUMENT(r12, count_argument)
+        LOAD.ARGUMENT(r13, results_argument)
+        LOAD.ARGUMENT(r14, function_argument)
+
+        MOV(rbp, rsp)
+        if call_frame_size != 0:
+            SUB(rsp, call_frame_size)
+        AND(rsp, -16)
+
+        done = Label("done")
+        TEST(r12, r12)
+        JZ(done)
+        with Loop() as loop:
+            for argument in function.arguments:
+                field_offset = record_fields[argument.name].offset
+                if argument.is_floating_point:
+                    load, memory_operand = (MOVSS, dword) if argument.size == 4 else (MOVSD, qword)
+                    register = argument.register if argument.register is not None else xmm0
+                    load(register, memory_operand[rbx + field_offset])
+                    if argument.register is None:
+                        load(memory_operand[rsp + argument.stack_offset], register)
+                else:
+                    register = argument.register.as_qword if argument.register is not None else rax
+                    if argument.size == 8:
+                        MOV(register, qword[rbx + field_offset])
+                    elif argument.size == 4:
+                        MOV(register.as_dword, dword[rbx + field_offset])
+                    else:
+                        # Arguments narrower than 4 bytes are extended to 4 bytes as in System V ABI
+                        extend = MOVSX if argument.is_signed_integer else MOVZX
+                        extend(register.as_dword, {1: byte, 2: word}[argument.size][rbx + field_offset])
+                    if argument.register is None:
+                        MOV(qword[rsp + argument.stack_offset], register)
+            CALL(r14)
+            if result_type is not None:
+                if result_type.is_floating_point:
+                    store, memory_operand = (MOVSS, dword) if result_size == 4 else (MOVSD, qword)
+                    store(memory_operand[r13], xmm0)
+                else:
+                    register = {1: rax.as_low_byte, 2: rax.as_word, 4: rax.as_dword, 8: rax}[result_size]
+                    MOV({1: byte, 2: word, 4: dword, 8: qword}[result_size][r13], register)
+                ADD(r13, result_size)
+            ADD(rbx, ctypes.sizeof(record_type))
+            SUB(r12, 1)
+            JNZ(loop.begin)
+        LABEL(done)
+
+        MOV(rsp, rbp)
+        RETURN()
+    return trampoline
@@ -21,6 +21,12 @@ class Microarchitecture:
     def id(self):
         return self.name.replace(" ", "")
 
+    @property
+    def performance_model(self):
+        """Static performance model of the microarchitecture, or None if there is no model for the microarchitecture"""
+        from peachpy.x86_64.performance import models
+        return models.get(self.name)
+
     @property
     def has_sse3(self):
         return isa.sse3 in self.extensions
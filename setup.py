@@ -89,7 +89,7 @@ setup(
         "Topic :: Software Development :: Libraries"
         ],
     setup_requires=["Opcodes>=0.3.13", "six"],
-    install_requires=["six", 'enum34;python_version<"3.4"'],
+    install_requires=["six", 'enum34;python_version<"3.4"', 'futures;python_version<"3.2"'],
     cmdclass={
         "build": BuildGenerateInstructions,
         "develop": DevelopGenerateInstructions,
@@ -433,3 +433,52 @@ RETURN
     Avail regs: gp64-vreg<10>, gp64-vreg<11>, gp64-vreg<12>, gp64-vreg<13>, gp64-vreg<14>, gp64-vreg<15>, gp64-vreg<1>, gp64-vreg<2>, gp64-vreg<3>, gp64-vreg<4>, gp64-vreg<5>, gp64-vreg<6>, gp64-vreg<7>, gp64-vreg<8>, gp64-vreg<9>, rax
 """
         assert equal_codes(listing, ref_listing), "Unexpected PeachPy code:\n" + listing
+
+
+class TestManyBasicBlocksAnalysis(unittest.TestCase):
+    def runTest(self):
+        n = Argument(size_t)
+
+        with Function("many_loops", (n,), uint64_t) as function:
+            reg_n = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_n, n)
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            # More basic blocks than the default recursion limit in Python
+            for i in range(1200):
+                reg_i = GeneralPurposeRegister64()
+                MOV(reg_i, reg_n)
+                with Loop(name="loop%d" % i) as loop:
+                    ADD(reg_sum, reg_i)
+                    SUB(reg_i, 1)
+                    JNZ(loop.begin)
+            RETURN(reg_sum)
+
+        # reg_n is live until the last loop, and the loop counter is live only inside its loop
+        add_instructions = [instruction for instruction in function._instructions if instruction.name == "ADD"]
+        for instruction in add_instructions[:-1]:
+            self.assertEqual(len(instruction.live_registers), 3)
+            self.assertIn(reg_n, instruction.live_registers)
+        self.assertEqual(len(add_instructions[-1].live_registers), 2)
+        self.assertNotIn(reg_n, add_instructions[-1].live_registers)
+
+
+class TestLongBasicBlockAnalysis(unittest.TestCase):
+    def runTest(self):
+        with Function("unrolled", (), uint64_t) as function:
+            regs = [GeneralPurposeRegister64() for _ in range(10)]
+            # A long basic block where every instruction writes one of the registers
+            for i in range(1000):
+                MOV(regs[i % len(regs)], i)
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            for reg in regs:
+                ADD(reg_sum, reg)
+            RETURN(reg_sum)
+
+        # Available registers are reconstructed correctly in any order of access
+        mov_instructions = [instruction for instruction in function._instructions if instruction.name == "MOV"]
+        for i in [999, 5, 0, 9, 10, 500]:
+            self.assertEqual(set(mov_instructions[i].available_registers), set(regs[:min(i, len(regs))]))
+        for i, instruction in enumerate(mov_instructions):
+            self.assertEqual(len(instruction.available_registers), min(i, len(regs)))
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+from peachpy.x86_64.cache import CompilationCache
+
+
+class TestCompilationCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, "kernel.py")
+        self.dependency_path = os.path.join(self.directory, "helper.py")
+        for path in [self.source_path, self.dependency_path]:
+            with open(path, "w") as source_file:
+                source_file.write("# %s\n" % os.path.basename(path))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runTest(self):
+        x = Argument(ptr(const_float_))
+        with Function("cached", (x,), float_) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            xmm_x = XMMRegister()
+            MOVSS(xmm_x, [reg_x])
+            ADDSS(xmm_x, Constant.float32(1.0))
+            RETURN(xmm_x)
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        encoded_function = abi_function.encode()
+
+        cache_directory = os.path.join(self.directory, "cache")
+        options = {"abi": "sysv", "cpu": "default"}
+        cache = CompilationCache(cache_directory, self.source_path, options)
+        self.assertIsNone(cache.load())
+        cache.store([abi_function], [self.dependency_path])
+
+        cached_functions, dependencies = CompilationCache(cache_directory, self.source_path, options).load()
+        self.assertEqual(dependencies, [self.dependency_path])
+        self.assertEqual(len(cached_functions), 1)
+        self.assertEqual(cached_functions[0].mangled_name, abi_function.mangled_name)
+        cached_encoded_function = cached_functions[0].encode()
+        self.assertEqual(cached_encoded_function.code_section.content, encoded_function.code_section.content)
+        self.assertEqual(cached_encoded_function.const_section.content, encoded_function.const_section.content)
+        self.assertEqual(len(cached_encoded_function.code_section.relocations), 1)
+
+        # Different options use a different manifest
+        self.assertIsNone(CompilationCache(cache_directory, self.source_path, {"abi": "ms", "cpu": "default"}).load())
+
+        # Modification of a dependency invalidates the entry
+        with open(self.dependency_path, "a") as dependency_file:
+            dependency_file.write("K = 1\n")
+        self.assertIsNone(CompilationCache(cache_directory, self.source_path, options).load())
+
+
+class TestCompilationCacheSafety(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, "kernel.py")
+        with open(self.source_path, "w") as source_file:
+            source_file.write("# kernel.py\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runTest(self):
+        import stat
+        import peachpy.x86_64.cache
+
+        with Function("empty", ()) as function:
+            RETURN()
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+
+        cache_directory = os.path.join(self.directory, "cache")
+        options = {"abi": "sysv", "cpu": "default"}
+        CompilationCache(cache_directory, self.source_path, options).store([abi_function], [])
+        self.assertIsNotNone(CompilationCache(cache_directory, self.source_path, options).load())
+
+        # Changes in PeachPy sources, e.g. instruction encoders, invalidate the cache
+        hash_peachpy_sources = peachpy.x86_64.cache._hash_peachpy_sources
+        try:
+            peachpy.x86_64.cache._hash_peachpy_sources = lambda: "0" * 64
+            self.assertIsNone(CompilationCache(cache_directory, self.source_path, options).load())
+        finally:
+            peachpy.x86_64.cache._hash_peachpy_sources = hash_peachpy_sources
+
+        if hasattr(os, "getuid"):
+            # The cache directory is private, and the cache is not loaded from directories writable by other users
+            self.assertEqual(stat.S_IMODE(os.stat(cache_directory).st_mode) & 0o077, 0)
+            os.chmod(cache_directory, 0o777)
+            self.assertIsNone(CompilationCache(cache_directory, self.source_path, options).load())
@@ -0,0 +1,127 @@
+import array
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+def find_compiler():
+    for compiler in [os.environ.get("CC"), "cc", "gcc", "clang"]:
+        if compiler:
+            for directory in os.environ.get("PATH", "").split(os.pathsep):
+                if os.path.isfile(os.path.join(directory, compiler)):
+                    return os.path.join(directory, compiler)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux") and abi.detect() == abi.system_v_x86_64_abi and
+                     find_compiler() is not None and
+                     os.path.isfile(os.path.join(sysconfig.get_paths()["include"], "Python.h")),
+                     "Building CPython extensions requires x86-64 Linux, C compiler, and Python headers")
+class TestCPythonExtension(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runTest(self):
+        from peachpy.writer import ELFWriter, CPythonExtensionWriter
+
+        object_path = os.path.join(self.directory, "kernels.o")
+        source_path = os.path.join(self.directory, "peachpy_kernels.c")
+        with ELFWriter(object_path, abi.system_v_x86_64_abi) as elf_writer, \
+                CPythonExtensionWriter(source_path) as extension_writer:
+            x = Argument(ptr(const_float_), name="x")
+            y = Argument(ptr(float_), name="y")
+            n = Argument(size_t, name="n")
+            with Function("saxpy", (x, y, n), uint32_t) as saxpy:
+                reg_x = GeneralPurposeRegister64()
+                reg_y = GeneralPurposeRegister64()
+                reg_n = GeneralPurposeRegister64()
+                LOAD.ARGUMENT(reg_x, x)
+                LOAD.ARGUMENT(reg_y, y)
+                LOAD.ARGUMENT(reg_n, n)
+                reg_count = GeneralPurposeRegister32()
+                MOV(reg_count, reg_n.as_dword)
+                xmm_y = XMMRegister()
+                with Loop() as loop:
+                    MOVSS(xmm_y, [reg_y])
+                    ADDSS(xmm_y, [reg_x])
+                    MOVSS([reg_y], xmm_y)
+                    ADD(reg_x, 4)
+                    ADD(reg_y, 4)
+                    SUB(reg_n, 1)
+                    JNZ(loop.begin)
+                RETURN(reg_count)
+
+            a = Argument(int8_t, name="a")
+            b = Argument(double_, name="b")
+            with Function("scale", (a, b), double_) as scale:
+                reg_a = GeneralPurposeRegister32()
+                LOAD.ARGUMENT(reg_a, a)
+                xmm_a = XMMRegister()
+                CVTSI2SD(xmm_a, reg_a)
+                xmm_b = XMMRegister()
+                LOAD.ARGUMENT(xmm_b, b)
+                MULSD(xmm_a, xmm_b)
+                RETURN(xmm_a)
+
+            # Argument names which coincide with locals of the generated wrapper
+            result = Argument(int32_t, name="result")
+            args = Argument(ptr(const_int32_t), name="args")
+            nargs = Argument(uint32_t, name="nargs")
+            value = Argument(double_, name="value")
+            with Function("collide", (result, args, nargs, value), int64_t) as collide:
+                reg_result = GeneralPurposeRegister64()
+                LOAD.ARGUMENT(reg_result, result)
+                reg_args = GeneralPurposeRegister64()
+                LOAD.ARGUMENT(reg_args, args)
+                reg_nargs = GeneralPurposeRegister64()
+                LOAD.ARGUMENT(reg_nargs, nargs)
+                xmm_value = XMMRegister()
+                LOAD.ARGUMENT(xmm_value, value)
+                reg_value = GeneralPurposeRegister64()
+                CVTTSD2SI(reg_value, xmm_value)
+                MOVSXD(reg_result, reg_result.as_dword)
+                ADD(reg_result, reg_nargs)
+                ADD(reg_result, reg_value)
+                MOVSXD(reg_value, [reg_args])
+                ADD(reg_result, reg_value)
+                RETURN(reg_result)
+
+            for function in [saxpy, scale, collide]:
+                abi_function = function.finalize(abi.system_v_x86_64_abi)
+                elf_writer.add_function(abi_function)
+                extension_writer.add_function(abi_function)
+
+        extension_path = os.path.join(self.directory, "peachpy_kernels" + sysconfig.get_config_var("EXT_SUFFIX"))
+        subprocess.check_call([find_compiler(), "-shared", "-fPIC", "-I" + sysconfig.get_paths()["include"],
+                               source_path, object_path, "-o", extension_path])
+
+        sys.path.insert(0, self.directory)
+        try:
+            import peachpy_kernels
+        finally:
+            sys.path.remove(self.directory)
+            sys.modules.pop("peachpy_kernels", None)
+
+        x_array = array.array("f", [1.0, 2.0, 3.0])
+        y_array = array.array("f", [10.0, 20.0, 30.0])
+        self.assertEqual(peachpy_kernels.saxpy(x_array, y_array, 3), 3)
+        self.assertEqual(list(y_array), [11.0, 22.0, 33.0])
+        self.assertRaises(TypeError, peachpy_kernels.saxpy, x_array, y_array)
+        self.assertRaises(BufferError, peachpy_kernels.saxpy, x_array, y_array.tobytes(), 3)
+        self.assertRaises(TypeError, peachpy_kernels.saxpy, array.array("d", [1.0]), y_array, 1)
+        self.assertRaises(TypeError, peachpy_kernels.saxpy, array.array("i", [1]), y_array, 1)
+        self.assertRaises(OverflowError, peachpy_kernels.saxpy, x_array, y_array, -1)
+
+        self.assertEqual(peachpy_kernels.scale(-3, 0.5), -1.5)
+        self.assertRaises(OverflowError, peachpy_kernels.scale, 128, 1.0)
+        self.assertRaises(TypeError, peachpy_kernels.scale, 1, "1.0")
+
+        self.assertEqual(peachpy_kernels.collide(-1, array.array("i", [1000]), 20, 300.0), 1319)
@@ -0,0 +1,117 @@
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+from peachpy.x86_64.instructions import encoding_cache, EncodingCache
+from peachpy.x86_64.function import function_encoding_cache
+
+
+class TestEncodingCache(unittest.TestCase):
+    def setUp(self):
+        self.capacity = encoding_cache.capacity
+        encoding_cache.capacity = 16
+        encoding_cache.clear()
+
+    def tearDown(self):
+        encoding_cache.capacity = self.capacity
+        encoding_cache.clear()
+
+    def runTest(self):
+        with Function("encoding_cache", ()) as function:
+            ADD(rax, 1)
+            ADD(rax, 1)
+            ADD(rcx, 1)
+            MOVAPS(xmm0, [rsi + 16])
+            MOVAPS(xmm0, [rsi + 16])
+            MOVAPS(xmm0, [rsi + 32])
+            RETURN()
+
+        reference = [bytearray([0x48, 0x83, 0xC0, 0x01]), bytearray([0x48, 0x83, 0xC0, 0x01]),
+                     bytearray([0x48, 0x83, 0xC1, 0x01]), bytearray([0x0F, 0x28, 0x46, 0x10]),
+                     bytearray([0x0F, 0x28, 0x46, 0x10]), bytearray([0x0F, 0x28, 0x46, 0x20])]
+        instructions = [instruction for instruction in function._instructions if instruction.name != "RETURN"]
+        for (instruction, bytecode) in zip(instructions, reference):
+            self.assertEqual(instruction.encode(), bytecode)
+        self.assertEqual(encoding_cache.hits, 2)
+        self.assertEqual(encoding_cache.misses, 4)
+
+        # Cached results must not be affected by modifications of the returned bytecode
+        instructions[0].encode()[0] = 0
+        self.assertEqual(instructions[1].encode(), reference[1])
+
+        # Length options are cached separately
+        self.assertEqual(instructions[3].encode_length_options(), instructions[4].encode_length_options())
+        self.assertEqual(encoding_cache.hits, 5)
+
+
+class TestEncodingCacheVirtualRegisters(unittest.TestCase):
+    def runTest(self):
+        with Function("encoding_cache_virtual", ()) as function:
+            reg = GeneralPurposeRegister64()
+            MOV(reg, 1)
+            RETURN()
+
+        misses = encoding_cache.misses
+        self.assertIsNone(function._instructions[0]._encoding_signature)
+        self.assertEqual(encoding_cache.misses, misses)
+
+
+class TestEncodingCacheEviction(unittest.TestCase):
+    def runTest(self):
+        cache = EncodingCache(capacity=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        # "b" is the least recently used entry
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+class TestFunctionEncodingCache(unittest.TestCase):
+    def setUp(self):
+        function_encoding_cache.clear()
+
+    def tearDown(self):
+        function_encoding_cache.clear()
+
+    @staticmethod
+    def make_function(name, increment):
+        x = Argument(ptr(float_))
+        n = Argument(size_t)
+        with Function(name, (x, n)) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            reg_n = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_n, n)
+            xmm_increment = XMMRegister()
+            MOVSS(xmm_increment, Constant.float32(increment))
+            with Loop(name="loop") as loop:
+                xmm_x = XMMRegister()
+                MOVSS(xmm_x, [reg_x])
+                ADDSS(xmm_x, xmm_increment)
+                MOVSS([reg_x], xmm_x)
+                ADD(reg_x, 4)
+                SUB(reg_n, 1)
+                JNZ(loop.begin)
+            RETURN()
+        return function.finalize(abi.system_v_x86_64_abi)
+
+    def runTest(self):
+        first_function = self.make_function("increment_first", 1.0).encode()
+        second_function = self.make_function("increment_second", 1.0).encode()
+        self.assertEqual((function_encoding_cache.hits, function_encoding_cache.misses), (1, 1))
+        self.assertEqual(second_function.mangled_name, "increment_second")
+        self.assertEqual(second_function.code_section.content, first_function.code_section.content)
+        self.assertEqual(second_function.const_section.content, first_function.const_section.content)
+        self.assertEqual([relocation.offset for relocation in second_function.code_section.relocations],
+                         [relocation.offset for relocation in first_function.code_section.relocations])
+        self.assertIsNot(second_function.code_section, first_function.code_section)
+        self.assertEqual(second_function.format(), first_function.format())
+
+        # Different literal constants must not match
+        third_function = self.make_function("increment_third", 2.0).encode()
+        self.assertEqual((function_encoding_cache.hits, function_encoding_cache.misses), (1, 2))
+        self.assertNotEqual(third_function.const_section.content, first_function.const_section.content)
@@ -224,3 +224,79 @@ loop.begin:
 #             RETURN()
 #
 #         print add_function.assembly
+
+
+class TestMultipleABIFinalization(unittest.TestCase):
+    def runTest(self):
+        x = Argument(ptr(const_uint32_t))
+        with Function("multi_abi", (x,), uint32_t) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            reg_y = GeneralPurposeRegister32()
+            local_variable = LocalVariable(4)
+            MOV(reg_y, [reg_x])
+            MOV(local_variable, reg_y)
+            ADD(reg_y, local_variable)
+            RETURN(reg_y)
+
+        listing = function.format()
+        sysv_function = function.finalize(abi.system_v_x86_64_abi)
+        ms_function = function.finalize(abi.microsoft_x64_abi)
+
+        # Finalization must not modify the original function
+        self.assertEqual(function.format(), listing)
+        self.assertIsNone(local_variable.address)
+        # ABI-specific functions must not share mutable operands: only interned physical registers are shared
+        sysv_registers = dict((id(register), register) for instruction in sysv_function._instructions
+                              for register in instruction.register_objects)
+        ms_registers = dict((id(register), register) for instruction in ms_function._instructions
+                            for register in instruction.register_objects)
+        for register_id in set(sysv_registers) & set(ms_registers):
+            self.assertIs(sysv_registers[register_id], sysv_registers[register_id]._intern())
+        self.assertNotEqual(sysv_function.format(), ms_function.format())
+        sysv_function.encode()
+        ms_function.encode()
+
+
+class TestParallelFinalization(unittest.TestCase):
+    def runTest(self):
+        x = Argument(ptr(const_uint32_t))
+        with Function("parallel", (x,), uint32_t) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            reg_y = GeneralPurposeRegister32()
+            MOV(reg_y, [reg_x])
+            with Loop(name="loop") as loop:
+                ADD(reg_y, reg_y)
+                JNC(loop.begin)
+            RETURN(reg_y)
+
+        abis = [abi.system_v_x86_64_abi, abi.microsoft_x64_abi, abi.gosyso_amd64_abi, abi.native_client_x86_64_abi]
+        parallel_functions = function.finalize_many(abis, encode=True, max_workers=2)
+        self.assertEqual([encoded_function.abi for encoded_function in parallel_functions], abis)
+        for encoded_function, function_abi in zip(parallel_functions, abis):
+            serial_function = function.finalize(function_abi).encode()
+            self.assertEqual(encoded_function.code_section.content, serial_function.code_section.content)
+            self.assertEqual(encoded_function.format(), serial_function.format())
+
+
+class TestDebugOrigin(unittest.TestCase):
+    def runTest(self):
+        import inspect
+        import pickle
+        x = Argument(uint32_t)
+        with Function("debug_origin", (x,), uint32_t, debug_level=1) as function:
+            reg_x = GeneralPurposeRegister32()
+            LOAD.ARGUMENT(reg_x, x)
+            ADD(reg_x, 1); line_number = inspect.currentframe().f_lineno
+            RETURN(reg_x)
+
+        add = next(instruction for instruction in function._instructions if instruction.name == "ADD")
+        self.assertEqual(add.source_file, __file__.replace(".pyc", ".py"))
+        self.assertEqual(add.line_number, line_number)
+        self.assertTrue(add.source_code.startswith("ADD(reg_x, 1)"))
+
+        # Origin of the instruction is preserved in later processing stages and after pickling
+        abi_function = pickle.loads(pickle.dumps(function.finalize(abi.system_v_x86_64_abi)))
+        add = next(instruction for instruction in abi_function._instructions if instruction.name == "ADD")
+        self.assertEqual(add.line_number, line_number)
@@ -0,0 +1,70 @@
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+class TestInstructionFormDispatch(unittest.TestCase):
+    def runTest(self):
+        # Forms for operands of the same kind are selected from the cache, and must give the same results
+        self.assertEqual(MOV(eax, ecx).encode(), bytearray([0x89, 0xC8]))
+        self.assertEqual(MOV(edx, ebx).encode(), bytearray([0x89, 0xDA]))
+        # Forms with implicit operands depend on the specific register or immediate value
+        self.assertEqual(ADD(eax, 0x100).encode(), bytearray([0x05, 0x00, 0x01, 0x00, 0x00]))
+        self.assertEqual(ADD(ecx, 0x100).encode(), bytearray([0x81, 0xC1, 0x00, 0x01, 0x00, 0x00]))
+        self.assertEqual(SHL(eax, 1).encode(), bytearray([0xD1, 0xE0]))
+        self.assertEqual(SHL(eax, 2).encode(), bytearray([0xC1, 0xE0, 0x02]))
+        self.assertEqual(SHL(eax, cl).encode(), bytearray([0xD3, 0xE0]))
+        # Immediate size is checked after the form is selected
+        self.assertEqual(ADD(rax, 1).encode(), bytearray([0x48, 0x83, 0xC0, 0x01]))
+        self.assertRaises(ValueError, ADD, rax, 0x100000000)
+        # Invalid operands raise an error every time
+        for _ in range(2):
+            self.assertRaises(SyntaxError, MOV, eax, xmm0)
+            self.assertRaises(SyntaxError, ADD, rax, ecx)
+        # Virtual registers and labels
+        with Function("forms", ()) as function:
+            reg_x = GeneralPurposeRegister32()
+            MOV(reg_x, ecx)
+            MOV(edx, reg_x)
+            label = Label("loop")
+            LABEL(label)
+            JNZ(label)
+            RETURN()
+        code = function.finalize(abi.system_v_x86_64_abi).encode().code_section.content
+        self.assertEqual(code[-3:-1], bytearray([0x75, 0xFE]))
+
+
+class TestEncodingDescriptors(unittest.TestCase):
+    def runTest(self):
+        import pickle
+        from peachpy.x86_64 import generic
+        first, second = ADD(rax, rcx), ADD(rdx, rbx)
+        # Instructions of the same form share encoding descriptors from the module table
+        self.assertEqual(len(first.encodings), 2)
+        for (first_encoding, second_encoding) in zip(first.encodings, second.encodings):
+            self.assertIs(first_encoding, second_encoding)
+            self.assertIn(first_encoding, generic._encodings)
+        # Pickled instructions refer to the same descriptors
+        restored = pickle.loads(pickle.dumps(first, pickle.HIGHEST_PROTOCOL))
+        for (encoding, restored_encoding) in zip(first.encodings, restored.encodings):
+            self.assertIs(encoding, restored_encoding)
+        self.assertEqual(restored.encode(), first.encode())
+
+
+class TestCompactRepresentation(unittest.TestCase):
+    def runTest(self):
+        import copy
+        import pickle
+        first, second = ADD(rax, [rsi + 8]), MOV(rax, rcx)
+        # Instructions and operands use slots instead of instance dictionaries
+        for instance in [first, first.operands[0], first.operands[1], first.operands[1].address, Label("label")]:
+            self.assertFalse(hasattr(instance, "__dict__"))
+        # Physical registers in operands are shared, but different from the user-visible register objects
+        self.assertIs(first.operands[0], second.operands[0])
+        self.assertIsNot(first.operands[0], rax)
+        self.assertEqual(first.operands[0], rax)
+        # Copies and pickled instructions have all attributes of the original instructions
+        for clone in [copy.copy(first), pickle.loads(pickle.dumps(first, pickle.HIGHEST_PROTOCOL))]:
+            self.assertEqual(clone.encode(), first.encode())
+            self.assertEqual(clone.isa_extensions, first.isa_extensions)
+            self.assertEqual(str(clone), str(first))
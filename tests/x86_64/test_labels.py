@@ -131,3 +131,29 @@ used:
     RETURN
 """
         assert equal_codes(code, ref_code), "Unexpected PeachPy code:\n" + code
+
+
+class TestBranchRelaxation(unittest.TestCase):
+    """Test that branches use short encoding when possible, and long encoding only when needed"""
+    def runTest(self):
+        with Function("branch_relaxation", tuple()) as function:
+            near = Label("near")
+            far = Label("far")
+            JNZ(near)
+            JZ(far)
+            for _ in range(124):
+                NOP()
+            LABEL(near)
+            for _ in range(4):
+                NOP()
+            LABEL(far)
+            JMP(near)
+            RETURN()
+
+        code = bytearray(function.finalize(abi.system_v_x86_64_abi).encode().code_section.content)
+        # With short encoding JZ far would need offset 128, so it gets long encoding.
+        # This pushes label near out of the range of short JNZ, and it gets long encoding too.
+        self.assertEqual(code[0:6], bytearray([0x0F, 0x85, 0x82, 0x00, 0x00, 0x00]))
+        self.assertEqual(code[6:12], bytearray([0x0F, 0x84, 0x80, 0x00, 0x00, 0x00]))
+        # Backward JMP near is within the short range
+        self.assertEqual(code[140:142], bytearray([0xEB, 0xFA]))
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+generated_modules = ["generic", "mmxsse", "avx", "fma", "mask", "crypto", "amd"]
+
+
+def imported_generated_modules(statement):
+    """Executes the statement in a new interpreter and returns the list of loaded auto-generated modules"""
+    script = "import sys\n" + statement + "\n" + \
+        "print(' '.join(name for name in %r if 'peachpy.x86_64.' + name in sys.modules))" % generated_modules
+    environment = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    environment["PYTHONPATH"] = os.pathsep.join(filter(bool, [package_root, environment.get("PYTHONPATH")]))
+    output = subprocess.check_output([sys.executable, "-c", script], env=environment)
+    return output.decode("ascii").split()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "Lazy import requires module-level __getattr__ (PEP 562)")
+class TestLazyImport(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(imported_generated_modules("import peachpy.x86_64"), [])
+        self.assertEqual(imported_generated_modules("from peachpy.x86_64 import MOV, ADD"), ["generic"])
+        self.assertEqual(imported_generated_modules("from peachpy.x86_64 import MOV, VADDPS"), ["generic", "avx"])
+        self.assertEqual(imported_generated_modules("import peachpy.x86_64; peachpy.x86_64.AESENC"), ["crypto"])
+        self.assertEqual(imported_generated_modules("from peachpy.x86_64 import *"), generated_modules)
+
+
+class TestStarImport(unittest.TestCase):
+    def runTest(self):
+        import peachpy.x86_64
+        from peachpy.x86_64.instruction_index import instruction_modules
+        from peachpy.x86_64.fma import VFMADD132PS
+        for name in ["abi", "uarch", "isa", "Function", "LocalVariable", "Loop", "RETURN", "m256"]:
+            self.assertIn(name, peachpy.x86_64.__all__)
+        for name in instruction_modules:
+            self.assertIn(name, peachpy.x86_64.__all__)
+        self.assertIs(peachpy.x86_64.VFMADD132PS, VFMADD132PS)
+        self.assertRaises(AttributeError, getattr, peachpy.x86_64, "NOT_AN_INSTRUCTION")
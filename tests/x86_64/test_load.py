@@ -32,3 +32,268 @@ class LoadAsm(unittest.TestCase):
         assert py_multiply(2, 2.0) == 4.0
         assert py_multiply(2, 3.0) == 6.0
 
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadIntoCodeArena(unittest.TestCase):
+    def runTest(self):
+        from peachpy.loader import CodeArena
+
+        def build_add_constant(constant):
+            x = Argument(float_)
+            with Function("AddConstant%d" % constant, (x,), float_) as function:
+                xmm_x = XMMRegister()
+                LOAD.ARGUMENT(xmm_x, x)
+                ADDSS(xmm_x, Constant.float32(float(constant)))
+                RETURN(xmm_x)
+            return function.finalize(abi.detect()).encode()
+
+        arena = CodeArena()
+        functions = arena.load([build_add_constant(i) for i in range(20)])
+        functions.append(build_add_constant(20).load(arena=arena))
+        for i, executable_function in enumerate(functions):
+            self.assertEqual(executable_function(1.0), 1.0 + i)
+        del executable_function
+        usage = arena.usage
+        self.assertEqual(usage.chunks, 1)
+        self.assertEqual(usage.blocks, 21)
+        self.assertEqual(usage.reserved_size, usage.allocated_size + usage.free_size)
+
+        # Unloading returns the blocks to the arena, and compaction moves the remaining functions
+        moved_function = functions[-1]
+        old_address = moved_function.arena_block.address
+        del functions[:-1]
+        self.assertEqual(arena.usage.blocks, 1)
+        arena.compact()
+        self.assertEqual(moved_function.arena_block.offset, 0)
+        self.assertNotEqual(moved_function.arena_block.address, old_address)
+        self.assertEqual(moved_function(1.0), 21.0)
+
+        del functions[:], moved_function
+        self.assertEqual(arena.usage.chunks, 0)
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadIntoHugePageCodeArena(unittest.TestCase):
+    def runTest(self):
+        from peachpy.loader import CodeArena
+
+        x = Argument(uint32_t)
+        with Function("Increment", (x,), uint32_t) as function:
+            reg_x = GeneralPurposeRegister32()
+            LOAD.ARGUMENT(reg_x, x)
+            ADD(reg_x, 1)
+            RETURN(reg_x)
+        encoded_function = function.finalize(abi.detect()).encode()
+
+        # Huge pages are a hint: the arena falls back to regular pages if the host can't provide them
+        arena = CodeArena(huge_pages=True)
+        self.assertEqual(arena.chunk_size % (2 * 1024 * 1024), 0)
+        increment = encoded_function.load(arena=arena)
+        self.assertEqual(increment(41), 42)
+        self.assertIn(arena.usage.huge_page_chunks, [0, 1])
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadWithBufferArguments(unittest.TestCase):
+    def runTest(self):
+        import array
+        import ctypes
+
+        x = Argument(ptr(const_float_), name="x")
+        y = Argument(ptr(float_), name="y")
+        n = Argument(size_t, name="n")
+        with Function("Add", (x, y, n)) as asm_add:
+            reg_x = GeneralPurposeRegister64()
+            reg_y = GeneralPurposeRegister64()
+            reg_n = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            LOAD.ARGUMENT(reg_y, y)
+            LOAD.ARGUMENT(reg_n, n)
+
+            xmm_y = XMMRegister()
+            with Loop() as loop:
+                MOVSS(xmm_y, [reg_y])
+                ADDSS(xmm_y, [reg_x])
+                MOVSS([reg_y], xmm_y)
+                ADD(reg_x, 4)
+                ADD(reg_y, 4)
+                SUB(reg_n, 1)
+                JNZ(loop.begin)
+            RETURN()
+
+        py_add = asm_add.finalize(abi.detect()).encode().load()
+        a = array.array("f", [1.0, 2.0, 3.0])
+        b = array.array("f", [10.0, 20.0, 30.0])
+        py_add(a, b, 3)
+        self.assertEqual(list(b), [11.0, 22.0, 33.0])
+        # Constant buffers may be read-only
+        py_add(memoryview(a.tobytes()).cast("f"), memoryview(b), 3)
+        self.assertEqual(list(b), [12.0, 24.0, 36.0])
+        # ctypes pointers are passed as is
+        c = (ctypes.c_float * 3)(1.0, 1.0, 1.0)
+        py_add(c, ctypes.cast(c, ctypes.POINTER(ctypes.c_float)), 3)
+        self.assertEqual(list(c), [2.0, 2.0, 2.0])
+
+        # Output buffers must be writable
+        self.assertRaises(TypeError, py_add, a, memoryview(b.tobytes()).cast("f"), 3)
+        # Items must match the pointed type
+        self.assertRaises(TypeError, py_add, array.array("d", [1.0]), b, 1)
+        self.assertRaises(TypeError, py_add, array.array("i", [1]), b, 1)
+        self.assertRaises(TypeError, py_add, bytearray(12), b, 3)
+        self.assertRaises(TypeError, py_add, "abc", b, 1)
+        # Buffers must be contiguous and aligned
+        self.assertRaises(TypeError, py_add, memoryview(a)[::2], b, 1)
+        self.assertRaises(ValueError, py_add, memoryview(bytearray(16))[1:13].cast("f"), b, 3)
+        self.assertEqual(list(b), [12.0, 24.0, 36.0])
+
+        try:
+            import numpy
+        except ImportError:
+            return
+        x_array = numpy.arange(4, dtype=numpy.float32)
+        y_array = numpy.ones(4, dtype=numpy.float32)
+        py_add(x_array, y_array, 4)
+        self.assertEqual(y_array.tolist(), [1.0, 2.0, 3.0, 4.0])
+        self.assertRaises(TypeError, py_add, x_array, y_array.astype(numpy.float64), 4)
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadAndCallMany(unittest.TestCase):
+    def runTest(self):
+        import array
+
+        # Enough arguments to pass some of them on stack in every ABI
+        arguments = [Argument(int16_t if i % 2 else int64_t, name="x%d" % i) for i in range(8)]
+        y = Argument(double_, name="y")
+        with Function("SumTimes", tuple(arguments) + (y,), double_) as asm_sum_times:
+            reg_sum = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_sum, arguments[0])
+            for argument in arguments[1:]:
+                reg_x = GeneralPurposeRegister64()
+                LOAD.ARGUMENT(reg_x, argument)
+                ADD(reg_sum, reg_x)
+            xmm_sum = XMMRegister()
+            CVTSI2SD(xmm_sum, reg_sum)
+            xmm_y = XMMRegister()
+            LOAD.ARGUMENT(xmm_y, y)
+            MULSD(xmm_sum, xmm_y)
+            RETURN(xmm_sum)
+
+        py_sum_times = asm_sum_times.finalize(abi.detect()).encode().load()
+        argument_sets = [tuple(range(i, i - 8, -1)) + (0.5,) for i in range(10)]
+        expected_results = [py_sum_times(*argument_set) for argument_set in argument_sets]
+        self.assertEqual(expected_results, [sum(argument_set[:-1]) * 0.5 for argument_set in argument_sets])
+        self.assertEqual(list(py_sum_times.call_many(argument_sets)), expected_results)
+
+        # Packed argument records and a pre-allocated results buffer
+        records = (py_sum_times.argument_record_type * len(argument_sets))(*argument_sets)
+        results = array.array("d", [0.0] * len(argument_sets))
+        self.assertIs(py_sum_times.call_many(records, results), results)
+        self.assertEqual(list(results), expected_results)
+        self.assertEqual(len(py_sum_times.call_many([])), 0)
+        self.assertRaises(ValueError, py_sum_times.call_many, records, array.array("d", [0.0]))
+        self.assertRaises(TypeError, py_sum_times.call_many, records, array.array("f", [0.0] * len(argument_sets)))
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadAndCallParallelFor(unittest.TestCase):
+    def runTest(self):
+        import array
+        from peachpy.x86_64.parallel import ThreadPool
+
+        x = Argument(ptr(const_uint32_t), name="x")
+        y = Argument(ptr(uint32_t), name="y")
+        n = Argument(size_t, name="n")
+        with Function("DoubleAndSum", (x, y, n), uint64_t) as asm_double_and_sum:
+            reg_x = GeneralPurposeRegister64()
+            reg_y = GeneralPurposeRegister64()
+            reg_n = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            LOAD.ARGUMENT(reg_y, y)
+            LOAD.ARGUMENT(reg_n, n)
+
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            done = Label("done")
+            TEST(reg_n, reg_n)
+            JZ(done)
+            with Loop() as loop:
+                reg_value = GeneralPurposeRegister64()
+                MOV(reg_value.as_dword, [reg_x])
+                ADD(reg_sum, reg_value)
+                ADD(reg_value.as_dword, reg_value.as_dword)
+                MOV([reg_y], reg_value.as_dword)
+                ADD(reg_x, 4)
+                ADD(reg_y, 4)
+                SUB(reg_n, 1)
+                JNZ(loop.begin)
+            LABEL(done)
+            RETURN(reg_sum)
+
+        py_double_and_sum = asm_double_and_sum.finalize(abi.detect()).encode().load()
+        values = array.array("I", range(1000))
+        results = array.array("I", [0] * len(values))
+        with ThreadPool(3) as pool:
+            chunk_sums = py_double_and_sum.parallel_for((values, results, len(values)), chunk_size=100, pool=pool)
+            # Chunks of 4-byte elements are rounded up to cache lines
+            self.assertEqual(len(chunk_sums), 9)
+            self.assertEqual(sum(chunk_sums), sum(values))
+            self.assertEqual(list(results), [2 * value for value in values])
+
+            self.assertEqual(py_double_and_sum.parallel_for((values, results, 0), pool=pool), [0])
+            self.assertEqual(sum(py_double_and_sum.parallel_for((values, results, 10), length_argument="n",
+                                                                pool=pool)), sum(range(10)))
+            self.assertRaises(ValueError, py_double_and_sum.parallel_for, (values, results[:10], len(values)))
+            self.assertRaises(TypeError, py_double_and_sum.parallel_for, (values, bytes(4000), len(values)))
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class LoadWithSpilledRegisters(unittest.TestCase):
+    def runTest(self):
+        import array
+
+        x = Argument(ptr(const_uint64_t), name="x")
+        y = Argument(ptr(float_), name="y")
+        with Function("SumSpilled", (x, y), uint64_t, register_allocator="linear-scan") as asm_sum_spilled:
+            reg_x = GeneralPurposeRegister64()
+            reg_y = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            LOAD.ARGUMENT(reg_y, y)
+
+            # More live general-purpose and vector registers than the ABI provides
+            regs = [GeneralPurposeRegister64() for _ in range(20)]
+            for i, reg in enumerate(regs):
+                MOV(reg, [reg_x + i * 8])
+            xmm_values = [XMMRegister() for _ in range(20)]
+            for i, xmm_value in enumerate(xmm_values):
+                MOVUPS(xmm_value, [reg_y + i * 16])
+            for xmm_value in xmm_values[1:]:
+                ADDPS(xmm_values[0], xmm_value)
+            MOVUPS([reg_y], xmm_values[0])
+
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            for i, reg in enumerate(regs):
+                # Weight the values to detect mixed up spill slots
+                IMUL(reg, reg, i + 1)
+                ADD(reg_sum, reg)
+            RETURN(reg_sum)
+
+        py_sum_spilled = asm_sum_spilled.finalize(abi.detect()).encode().load()
+        x_values = array.array("Q", [1000 + i for i in range(20)])
+        y_values = array.array("f", [float(i // 4) for i in range(80)])
+        self.assertEqual(py_sum_spilled(x_values, y_values), sum((1000 + i) * (i + 1) for i in range(20)))
+        self.assertEqual(list(y_values[:4]), [float(sum(range(20)))] * 4)
@@ -0,0 +1,135 @@
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+from peachpy.x86_64.registers import rsp
+from peachpy.x86_64.peephole import PeepholeRule, default_rules
+
+
+def finalize_with_rules(function, function_abi, rules=default_rules):
+    peephole_rules = options.peephole_rules
+    try:
+        options.peephole_rules = rules
+        return function.finalize(function_abi)
+    finally:
+        options.peephole_rules = peephole_rules
+
+
+class IncrementRule(PeepholeRule):
+    def __init__(self):
+        super(IncrementRule, self).__init__("increment")
+
+    def rewrite(self, instructions, position, optimizer):
+        instruction = instructions[position]
+        if instruction.name == "ADD" and instruction.operands[1] == 1 and \
+                optimizer.are_flags_dead(instructions, position + 1):
+            return 1, [INC(instruction.operands[0], prototype=instruction)]
+
+
+def build_increment():
+    with Function("increment", (), uint64_t) as function:
+        MOV(rax, rax)
+        ADD(rax, 1)
+        RETURN(rax)
+    return function
+
+
+class TestRedundantMoves(unittest.TestCase):
+    def runTest(self):
+        with Function("moves", (), target=uarch.haswell) as function:
+            MOV(rax, rax)
+            MOV(ecx, ecx)
+            MOVAPS(xmm1, xmm1)
+            MOV(rdx, rcx)
+            MOV(rcx, rdx)
+            VMOVAPS(ymm2, ymm2)
+            VMOVAPS(xmm3, xmm3)
+            RETURN()
+
+        # Peephole optimization is disabled by default, and moves of physical registers are kept
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        self.assertEqual(len(abi_function._instructions), 9)
+        self.assertEqual(abi_function.peephole_hits, {"self-move": 0, "round-trip-move": 0})
+
+        abi_function = finalize_with_rules(function, abi.system_v_x86_64_abi)
+        instructions = [str(instruction) for instruction in abi_function._instructions]
+        self.assertEqual(instructions, ["MOV ecx, ecx", "MOV rdx, rcx", "VMOVAPS xmm3, xmm3", "VZEROUPPER", "RET"])
+        self.assertEqual(abi_function.peephole_hits["self-move"], 3)
+        self.assertEqual(abi_function.peephole_hits["round-trip-move"], 1)
+        abi_function.encode()
+
+
+class TestAllocatedCopies(unittest.TestCase):
+    def runTest(self):
+        x = Argument(uint64_t)
+        with Function("copies", (x,), uint64_t) as function:
+            reg_a = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_a, x)
+            reg_b = GeneralPurposeRegister64()
+            MOV(reg_b, reg_a)
+            MOV(reg_a, reg_b)
+            ADD(reg_a, reg_b)
+            RETURN(reg_a)
+
+        # Redundant copies of allocated registers are removed even if peephole optimization is disabled
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        instructions = [str(instruction) for instruction in abi_function._instructions]
+        self.assertEqual(instructions, ["MOV rax, rdi", "ADD rdi, rax", "MOV rax, rdi", "RET"])
+        self.assertEqual(abi_function.peephole_hits["round-trip-move"], 1)
+        abi_function.encode()
+
+
+class TestFlagsLiveness(unittest.TestCase):
+    def runTest(self):
+        with Function("flags", (), uint64_t) as function:
+            CMP(rdi, rsi)
+            MOV(rcx, 0)
+            CMP(rdi, 1)
+            MOV(rax, 0)
+            CMOVZ(rax, rdi)
+            SUB(rsp, 8)
+            SUB(rsp, 8)
+            ADD(rsp, 16)
+            RETURN(rax)
+
+        abi_function = finalize_with_rules(function, abi.system_v_x86_64_abi)
+        instructions = [str(instruction) for instruction in abi_function._instructions]
+        # The first comparison is overwritten before use, but the second is used by CMOVZ
+        self.assertEqual(instructions, ["XOR ecx, ecx", "CMP rdi, 1", "MOV rax, 0", "CMOVZ rax, rdi", "RET"])
+        self.assertEqual(abi_function.peephole_hits["dead-flags"], 1)
+        self.assertEqual(abi_function.peephole_hits["zero-move"], 1)
+        self.assertEqual(abi_function.peephole_hits["stack-adjustment"], 2)
+        abi_function.encode()
+
+
+class TestCustomRules(unittest.TestCase):
+    def runTest(self):
+        function = build_increment()
+        abi_function = finalize_with_rules(function, abi.system_v_x86_64_abi, (IncrementRule(),) + default_rules)
+        self.assertEqual([str(instruction) for instruction in abi_function._instructions], ["INC rax", "RET"])
+        self.assertEqual(abi_function.peephole_hits["increment"], 1)
+
+        abi_function = finalize_with_rules(function, abi.system_v_x86_64_abi, ())
+        self.assertEqual(len(abi_function._instructions), 3)
+        self.assertNotIn("increment", abi_function.peephole_hits)
+
+
+class TestParallelFinalization(unittest.TestCase):
+    def runTest(self):
+        import multiprocessing
+        from peachpy.x86_64.function import finalize_functions
+
+        function = build_increment()
+        abis = [abi.system_v_x86_64_abi, abi.microsoft_x64_abi]
+        peephole_rules = options.peephole_rules
+        # Spawned worker processes do not inherit the options of the parent process
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        try:
+            options.peephole_rules = (IncrementRule(),) + default_rules
+            multiprocessing.set_start_method("spawn", force=True)
+            abi_functions = finalize_functions([function], abis, max_workers=2)[0]
+        finally:
+            options.peephole_rules = peephole_rules
+            multiprocessing.set_start_method(start_method, force=True)
+        for abi_function in abi_functions:
+            self.assertEqual([str(instruction) for instruction in abi_function._instructions], ["INC rax", "RET"])
+            self.assertEqual(abi_function.peephole_hits["increment"], 1)
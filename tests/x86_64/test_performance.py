@@ -0,0 +1,127 @@
+import unittest
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+def build_dot_product(accumulators):
+    x = Argument(ptr(const_float_), name="x")
+    y = Argument(ptr(const_float_), name="y")
+    n = Argument(size_t, name="n")
+    with Function("dot", (x, y, n), float_, target=uarch.haswell) as function:
+        reg_x = GeneralPurposeRegister64()
+        reg_y = GeneralPurposeRegister64()
+        reg_n = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        LOAD.ARGUMENT(reg_y, y)
+        LOAD.ARGUMENT(reg_n, n)
+
+        ymm_accumulators = [YMMRegister() for _ in range(accumulators)]
+        for ymm_accumulator in ymm_accumulators:
+            VXORPS(ymm_accumulator, ymm_accumulator, ymm_accumulator)
+        with Loop() as loop:
+            for i, ymm_accumulator in enumerate(ymm_accumulators):
+                ymm_x = YMMRegister()
+                VMOVUPS(ymm_x, [reg_x + i * 32])
+                VFMADD231PS(ymm_accumulator, ymm_x, [reg_y + i * 32])
+            ADD(reg_x, accumulators * 32)
+            ADD(reg_y, accumulators * 32)
+            SUB(reg_n, accumulators * 8)
+            JNZ(loop.begin)
+
+        for ymm_accumulator in ymm_accumulators[1:]:
+            VADDPS(ymm_accumulators[0], ymm_accumulators[0], ymm_accumulator)
+        RETURN(ymm_accumulators[0].as_xmm)
+    return function.finalize(abi.system_v_x86_64_abi)
+
+
+class TestLatencyBoundLoop(unittest.TestCase):
+    def runTest(self):
+        loops = build_dot_product(1).analyze_loops(uarch.skylake)
+        self.assertEqual(len(loops), 1)
+        loop = loops[0]
+        self.assertEqual(loop.name, "loop")
+        self.assertEqual(len(loop.instructions), 6)
+        # Every iteration waits for the FMA of the previous iteration
+        self.assertEqual(loop.bottleneck, "latency")
+        self.assertEqual(loop.latency_cycles, 4.0)
+        self.assertEqual(loop.cycles, 4.0)
+        # Loads into vector registers (6 cycles) followed by FMA (4 cycles)
+        self.assertEqual(loop.critical_path_latency, 10)
+        self.assertEqual(loop.unknown_instructions, [])
+        self.assertIn("bound by latency", loop.format())
+
+
+class TestPortBoundLoop(unittest.TestCase):
+    def runTest(self):
+        loop = build_dot_product(8).analyze_loops(uarch.skylake)[0]
+        # 16 loads on two load ports
+        self.assertEqual(loop.bottleneck, "ports")
+        self.assertEqual(loop.port_cycles, 8.0)
+        self.assertEqual(loop.bottleneck_ports, ("p2", "p3"))
+        self.assertEqual(loop.port_pressure["p2"], 8.0)
+        self.assertEqual(loop.port_pressure["p0"] + loop.port_pressure["p1"], 8.0)
+        self.assertEqual(loop.latency_cycles, 4.0)
+        # SUB and JNZ are macro-fused
+        self.assertEqual(loop.frontend_cycles, 19.0 / 4)
+
+        # Zen splits 256-bit instructions into two micro-operations
+        zen_loop = build_dot_product(8).analyze_loops(uarch.zen)[0]
+        self.assertEqual(zen_loop.port_cycles, 16.0)
+        self.assertEqual(zen_loop.bottleneck_ports, ("a0", "a1"))
+
+
+class TestNestedLoops(unittest.TestCase):
+    def runTest(self):
+        n = Argument(size_t, name="n")
+        with Function("nested", (n,), target=uarch.haswell) as function:
+            reg_n = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_n, n)
+            reg_i = GeneralPurposeRegister64()
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            with Loop() as outer:
+                MOV(reg_i, 10)
+                with Loop() as inner:
+                    IMUL(reg_sum, reg_i)
+                    SUB(reg_i, 1)
+                    JNZ(inner.begin)
+                SUB(reg_n, 1)
+                JNZ(outer.begin)
+            IACA.START()
+            POPCNT(reg_sum, reg_sum)
+            IACA.END()
+            RETURN()
+
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        loops = abi_function.analyze_loops()
+        self.assertEqual([loop.name for loop in loops], ["outer", "inner", "IACA"])
+        self.assertEqual(len(loops[0].instructions), 6)
+        # Multiplication chain in the inner loop
+        self.assertEqual(loops[1].latency_cycles, 3.0)
+        self.assertEqual(loops[1].model, uarch.haswell.performance_model)
+        self.assertEqual(loops[2].critical_path_latency, 3)
+
+
+class TestApproximateModels(unittest.TestCase):
+    def runTest(self):
+        import warnings
+
+        abi_function = build_dot_product(1)
+        for target, model in [(uarch.default, uarch.haswell), (uarch.sandy_bridge, uarch.haswell),
+                              (uarch.jaguar, uarch.zen), (uarch.knights_landing, uarch.skylake_xeon)]:
+            with warnings.catch_warnings(record=True) as caught_warnings:
+                warnings.simplefilter("always")
+                loops = abi_function.analyze_loops(target)
+            self.assertEqual(loops[0].model, model.performance_model)
+            self.assertEqual(len(caught_warnings), 1)
+            self.assertIn(str(target), str(caught_warnings[0].message))
+
+        # Microarchitectures with own models are analyzed without warnings
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter("always")
+            abi_function.analyze_loops(uarch.broadwell)
+        self.assertEqual(caught_warnings, [])
+
+        unknown_target = uarch.Microarchitecture("Unknown", isa.default,
+                                                 alu_width=128, fpu_width=128, load_with=128, store_width=128)
+        self.assertRaises(ValueError, abi_function.analyze_loops, unknown_target)
@@ -1,4 +1,5 @@
 import unittest
+import pytest
 from tests import equal_codes
 from peachpy import *
 from peachpy.x86_64 import *
@@ -124,3 +125,152 @@ MOVQ 0(AX), BX
 RET
 """
         assert equal_codes(listing, ref_listing), "Unexpected PeachPy listing:\n" + listing
+
+
+class TestHighRegisterPressureGreedy(unittest.TestCase):
+    def runTest(self):
+        def build():
+            with Function("sum20", (), uint64_t):
+                regs = [GeneralPurposeRegister64() for _ in range(20)]
+                for i, reg in enumerate(regs):
+                    MOV(reg, i + 1)
+                for reg in regs[1:]:
+                    ADD(regs[0], reg)
+                RETURN(regs[0])
+        self.assertRaises(RegisterAllocationError, build)
+
+
+class TestHighRegisterPressureLinearScan(unittest.TestCase):
+    def runTest(self):
+        x_argument = Argument(ptr(const_uint64_t), name="x")
+        with Function("sum20", (x_argument,), uint64_t, register_allocator="linear-scan") as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x_argument)
+            regs = [GeneralPurposeRegister64() for _ in range(20)]
+            for i, reg in enumerate(regs):
+                MOV(reg, [reg_x + i * 8])
+            reg_sum = GeneralPurposeRegister64()
+            XOR(reg_sum, reg_sum)
+            for reg in regs:
+                ADD(reg_sum, reg)
+            RETURN(reg_sum)
+
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        spill_instructions = [instruction for instruction in abi_function._instructions
+                              if any(isinstance(getattr(operand, "symbol", None), LocalVariable)
+                                      for operand in instruction.operands)]
+        assert spill_instructions, "Expected spill code in the function body"
+        abi_function.encode()
+
+
+class TestHighRegisterPressureLinearScanAVX(unittest.TestCase):
+    def runTest(self):
+        x_argument = Argument(ptr(const_float_), name="x")
+        with Function("sum20", (x_argument,), register_allocator="linear-scan",
+                      target=uarch.default + isa.avx) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x_argument)
+            regs = [YMMRegister() for _ in range(20)]
+            for i, reg in enumerate(regs):
+                VMOVUPS(reg, [reg_x + i * 32])
+            for reg in regs[1:]:
+                VADDPS(regs[0], regs[0], reg)
+            VMOVUPS([reg_x], regs[0])
+            RETURN()
+
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        spill_instructions = [instruction for instruction in abi_function._instructions
+                              if instruction.name == "VMOVUPS" and
+                              any(isinstance(getattr(operand, "symbol", None), LocalVariable)
+                                      for operand in instruction.operands)]
+        assert spill_instructions, "Expected spill code in the function body"
+        abi_function.encode()
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class TestCopyCoalescing(unittest.TestCase):
+    def runTest(self):
+        import array
+
+        x_argument = Argument(ptr(float_), name="x")
+        with Function("copies", (x_argument,)) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x_argument)
+            xmm_a = XMMRegister()
+            MOVUPS(xmm_a, [reg_x])
+            # xmm_a is not used after the copy
+            xmm_b = XMMRegister()
+            MOVAPS(xmm_b, xmm_a)
+            ADDPS(xmm_b, xmm_b)
+            # xmm_b is used after the copy, and can't share the register with xmm_c
+            xmm_c = XMMRegister()
+            MOVAPS(xmm_c, xmm_b)
+            MULPS(xmm_c, xmm_c)
+            ADDPS(xmm_c, xmm_b)
+            reg_y = GeneralPurposeRegister64()
+            MOV(reg_y, reg_x)
+            MOVUPS([reg_y], xmm_c)
+            RETURN()
+
+        abi_function = function.finalize(abi.system_v_x86_64_abi)
+        # Coalesced copies are removed with default options
+        moves = [str(instruction) for instruction in abi_function._instructions
+                 if instruction.name in {"MOV", "MOVAPS"}]
+        self.assertEqual(len(moves), 1)
+        self.assertTrue(moves[0].startswith("MOVAPS "))
+
+        self.assertEqual(sum(instruction.name in {"MOV", "MOVAPS"} for instruction in function._instructions), 3)
+
+        # The same function without the copies which can be coalesced
+        with Function("copies", (x_argument,)) as reference_function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x_argument)
+            xmm_a = XMMRegister()
+            MOVUPS(xmm_a, [reg_x])
+            ADDPS(xmm_a, xmm_a)
+            xmm_c = XMMRegister()
+            MOVAPS(xmm_c, xmm_a)
+            MULPS(xmm_c, xmm_c)
+            ADDPS(xmm_c, xmm_a)
+            MOVUPS([reg_x], xmm_c)
+            RETURN()
+
+        reference_abi_function = reference_function.finalize(abi.system_v_x86_64_abi)
+        self.assertEqual(len(abi_function._instructions), len(reference_abi_function._instructions))
+        self.assertEqual(len(abi_function.encode().code_section.content),
+                         len(reference_abi_function.encode().code_section.content))
+
+        values = array.array("f", [1.0, 2.0, 3.0, 4.0])
+        function.finalize(abi.detect()).encode().load()(values)
+        self.assertEqual(list(values), [6.0, 20.0, 42.0, 72.0])
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class TestManyVirtualRegisters(unittest.TestCase):
+    def runTest(self):
+        import array
+
+        x_argument = Argument(ptr(const_float_), name="x")
+        with Function("sum", (x_argument,), float_) as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x_argument)
+            xmm_sum = XMMRegister()
+            XORPS(xmm_sum, xmm_sum)
+            # Sum 1000 loaded values through a window of 14 simultaneously live registers
+            xmm_window = []
+            for i in range(1000):
+                xmm_value = XMMRegister()
+                MOVSS(xmm_value, [reg_x + (i % 16) * 4])
+                xmm_window.append(xmm_value)
+                if len(xmm_window) > 14:
+                    ADDSS(xmm_sum, xmm_window.pop(0))
+            for xmm_value in xmm_window:
+                ADDSS(xmm_sum, xmm_value)
+            RETURN(xmm_sum)
+
+        values = array.array("f", [float(i) for i in range(16)])
+        self.assertEqual(function.finalize(abi.detect()).encode().load()(values), 62 * 120 + 28)
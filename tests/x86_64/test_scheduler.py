@@ -0,0 +1,117 @@
+import unittest
+import array
+import pytest
+from peachpy import *
+from peachpy.x86_64 import *
+
+
+def build_polynomials(instruction_scheduler, chains=2, degree=4):
+    """Evaluates independent chains of multiply-add operations on consecutive 4-element vectors of x"""
+    x = Argument(ptr(float_), name="x")
+    with Function("polynomials", (x,), target=uarch.haswell, instruction_scheduler=instruction_scheduler) as function:
+        reg_x = GeneralPurposeRegister64()
+        LOAD.ARGUMENT(reg_x, x)
+        xmm_values = [XMMRegister() for _ in range(chains)]
+        xmm_results = [XMMRegister() for _ in range(chains)]
+        for i, (xmm_value, xmm_result) in enumerate(zip(xmm_values, xmm_results)):
+            MOVUPS(xmm_value, [reg_x + i * 16])
+            MOVAPS(xmm_result, xmm_value)
+            for j in range(degree):
+                ADDPS(xmm_result, Constant.float32x4(1.0 / (j + 2)))
+                MULPS(xmm_result, xmm_value)
+            MOVUPS([reg_x + i * 16], xmm_result)
+        RETURN()
+    return function
+
+
+class TestInterleaveChains(unittest.TestCase):
+    def runTest(self):
+        instructions = [str(instruction) for instruction in build_polynomials("list")._instructions
+                        if instruction.name in {"ADDPS", "MULPS"}]
+        # Operations of the two chains alternate
+        for first, second in zip(instructions[0::2], instructions[1::2]):
+            self.assertEqual(first.split()[0], second.split()[0])
+            self.assertNotEqual(first.split()[1], second.split()[1])
+
+        original_instructions = [str(instruction) for instruction in build_polynomials("none")._instructions
+                                 if instruction.name in {"ADDPS", "MULPS"}]
+        self.assertEqual(len(set(instruction.split()[1] for instruction in original_instructions[:8])), 1)
+
+        self.assertRaises(ValueError, Function, "f", (), instruction_scheduler="random")
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class TestPreserveSemantics(unittest.TestCase):
+    def runTest(self):
+        x = array.array("f", [float(i) / 8 for i in range(16)])
+        expected_x = array.array("f", x)
+        build_polynomials("none", chains=4).finalize(abi.detect()).encode().load()(expected_x)
+        build_polynomials("list", chains=4).finalize(abi.detect()).encode().load()(x)
+        self.assertEqual(list(x), list(expected_x))
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class TestFlagsAndMemoryOrder(unittest.TestCase):
+    def runTest(self):
+        x = Argument(ptr(uint64_t), name="x")
+        with Function("flags", (x,), uint64_t, target=uarch.skylake, instruction_scheduler="list") as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            reg_a, reg_b, reg_c = GeneralPurposeRegister64(), GeneralPurposeRegister64(), GeneralPurposeRegister64()
+            MOV(reg_a, [reg_x])
+            IMUL(reg_a, reg_a)
+            CMP(reg_a, 100)
+            reg_flag = GeneralPurposeRegister8()
+            SETA(reg_flag)
+            MOV([reg_x + 8], reg_a)
+            MOV(reg_b, [reg_x + 8])
+            ADD(reg_b, 1)
+            MOV(reg_c, [reg_x + 16])
+            ADD(reg_c, reg_b)
+            MOVZX(reg_a, reg_flag)
+            ADD(reg_a, reg_c)
+            RETURN(reg_a)
+
+        instructions = [str(instruction) for instruction in function._instructions]
+        names = [instruction.name for instruction in function._instructions]
+        # The independent load is hoisted above multiplication, but not the load after the store to the same address
+        self.assertLess(instructions.index("MOV %s, [%s + 16]" % (reg_c, reg_x)), names.index("IMUL"))
+        self.assertLess(instructions.index("MOV [%s + 8], %s" % (reg_x, reg_a)),
+                        instructions.index("MOV %s, [%s + 8]" % (reg_b, reg_x)))
+        # Instructions which modify flags are not placed between CMP and SETA
+        self.assertEqual(set(names[names.index("CMP") + 1:names.index("SETA")]) - {"MOV"}, set())
+
+        buffer = array.array("Q", [11, 0, 1000])
+        self.assertEqual(function.finalize(abi.detect()).encode().load()(buffer), 1 + 121 + 1 + 1000)
+        self.assertEqual(list(buffer), [11, 121, 1000])
+
+
+@pytest.mark.xfail(
+    not abi.detect(), reason="x86-only test is run on non-x86 hardware!", strict=True
+)
+class TestRegisterPressure(unittest.TestCase):
+    def runTest(self):
+        x = Argument(ptr(const_float_), name="x")
+        with Function("sum", (x,), float_, target=uarch.haswell, instruction_scheduler="list") as function:
+            reg_x = GeneralPurposeRegister64()
+            LOAD.ARGUMENT(reg_x, x)
+            xmm_sum = XMMRegister()
+            XORPS(xmm_sum, xmm_sum)
+            # Hoisting all loads would need 24 registers
+            for i in range(24):
+                xmm_value = XMMRegister()
+                MOVSS(xmm_value, [reg_x + i * 4])
+                MULSS(xmm_value, xmm_value)
+                MULSS(xmm_value, xmm_value)
+                ADDSS(xmm_sum, xmm_value)
+            RETURN(xmm_sum)
+
+        self.assertLessEqual(max(len([register for register in instruction.live_registers
+                                      if isinstance(register, XMMRegister)])
+                                 for instruction in function._instructions), 16)
+        values = array.array("f", [float(i % 3) for i in range(24)])
+        self.assertEqual(function.finalize(abi.detect()).encode().load()(values), 8 * 1 + 8 * 16)